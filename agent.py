@@ -0,0 +1,316 @@
+"""
+QMediaTool - worker agent
+
+Runs task queue tasks for QMediaTool instances on other hosts, e.g.:
+
+    python main.py --agent --listen 0.0.0.0 --port 9900 --token secret
+
+Each task is sent over a TCP connection of its own as JSON lines:
+
+    {"cmd": "run", "name": ..., "code": ..., "env": {...}, "priority": 0, "duration": ..., "token": ...}
+    {"cmd": "kill"}, {"cmd": "pause"}, {"cmd": "resume"}
+
+and the agent answers with:
+
+    {"event": "output", "data": ...}         output of the task
+    {"event": "progress", "info": {...}}     ffmpeg progress ($FFMPEG_PROG), see TaskProgress
+    {"event": "file", "name": ..., "offset": ..., "data": <base64>}
+    {"event": "error", "message": ...}
+    {"event": "finish", "exit_code": ..., "stats": {...}}
+
+If the task's output folder exists on this host (shared storage, paths can be
+mapped with --map), the task writes to it directly. Otherwise it's run in a
+temporary folder, whose files are sent back when the task has finished. Input
+files must be reachable on this host (after mapping) in any case.
+
+The agent runs any code it's sent, so it only listens on other than loopback
+addresses with a token. The token (like everything else) is sent in plaintext,
+use the agent in trusted networks only, or through a VPN or SSH tunnel.
+"""
+
+import argparse
+import base64
+import hmac
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from PyQt5.QtCore import QCoreApplication, QObject, QProcess
+from PyQt5.QtNetwork import QTcpServer, QHostAddress, QAbstractSocket
+
+from const import *
+from task import Task
+from myprocess import MyProcess
+from taskenv import setup_env
+from progress import TaskProgress
+from jsonevents import emit
+
+
+########################################
+# Runs the task sent over a single connection
+########################################
+class AgentConnection (QObject):
+
+    def __init__ (self, socket, agent):
+        super().__init__(agent)
+        self._socket = socket
+        self._agent = agent
+        self._buffer = b''
+        self._task = None
+        self._proc = None
+        self._tmpdir = None
+        self._files = []
+        self._offset = 0
+        self._result = None
+        self._progress = None
+        self._disconnected = False
+        self.started = 0
+        socket.readyRead.connect(self.slot_ready_read)
+        socket.disconnected.connect(self.slot_disconnected)
+
+    ########################################
+    #
+    ########################################
+    def is_running (self):
+        return self._proc is not None and self._result is None
+
+    ########################################
+    #
+    ########################################
+    def slot_progress (self, info):
+        self.send('progress', info=info)
+
+    ########################################
+    #
+    ########################################
+    def send (self, event, **kwargs):
+        if self._socket.state() == QAbstractSocket.ConnectedState:
+            self._socket.write(json.dumps(dict(event=event, **kwargs)).encode() + b'\n')
+
+    ########################################
+    #
+    ########################################
+    def slot_ready_read (self):
+        self._buffer += self._socket.readAll().data()
+        lines = self._buffer.split(b'\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            cmd = msg.get('cmd')
+            if cmd == 'run' and self._task is None:
+                if self._agent.token and not hmac.compare_digest(str(msg.get('token', '')).encode(),
+                        self._agent.token.encode()):
+                    emit('rejected', peer=self._socket.peerAddress().toString())
+                    self.send('error', message='Invalid token')
+                    self.send('finish', exit_code=-1, stats={})
+                    self._socket.disconnectFromHost()
+                    return
+                self.run(msg)
+            elif self.is_running():
+                if cmd == 'kill':
+                    self._proc.stop()
+                elif cmd == 'pause' and not IS_WIN:
+                    self._proc.pause()
+                elif cmd == 'resume':
+                    self._proc.resume()
+
+    ########################################
+    #
+    ########################################
+    def run (self, msg):
+        env = self._agent.map_env(msg.get('env', {}))
+        outputDir = env.get('OUTPUTDIR')
+        if not outputDir or not os.path.isdir(outputDir):
+            # no shared storage, the outputs are sent back
+            self._tmpdir = tempfile.mkdtemp(prefix='qmt_agent_')
+            env['OUTPUTDIR'] = self._tmpdir
+        self._task = Task(msg.get('code', ''), env, msg.get('name', ''))
+        self._task.priority = msg.get('priority', TASK_PRIORITY_NORMAL)
+        self._proc = MyProcess(self)
+        self._proc.setProcessChannelMode(QProcess.MergedChannels)
+        self._proc.readyReadStandardOutput.connect(self.slot_stdout)
+        self._proc.finished.connect(self.slot_complete)
+        self._proc.errorOccurred.connect(self.slot_error_occurred)
+        self._progress = TaskProgress(msg.get('duration'), self)
+        self._progress.progress.connect(self.slot_progress)
+        self._task.progress_url = self._progress.url
+        self.started = time.time()
+        emit('start', name=self._task.name, peer=self._socket.peerAddress().toString())
+        self._task.run(self._proc, True)
+
+    ########################################
+    #
+    ########################################
+    def task_complete (self, exitCode):
+        if self._result is not None:
+            return
+        self._result = (exitCode, self._task.read_stats())
+        self._progress.close()
+        emit('finish', name=self._task.name, exit_code=exitCode, wall_time=round(time.time() - self.started, 3))
+        if self._tmpdir and self._socket.state() == QAbstractSocket.ConnectedState:
+            self._files = sorted(entry.path for entry in os.scandir(self._tmpdir) if entry.is_file())
+            self._socket.bytesWritten.connect(self.slot_send_files)
+            self.slot_send_files()
+        else:
+            self.finish()
+
+    ########################################
+    # Sends the output files in parts, as far as the socket's write buffer allows
+    ########################################
+    def slot_send_files (self):
+        while self._files and self._socket.bytesToWrite() < 4 * AGENT_FILE_CHUNK:
+            fn = self._files[0]
+            try:
+                with open(fn, 'rb') as f:
+                    f.seek(self._offset)
+                    data = f.read(AGENT_FILE_CHUNK)
+            except OSError as e:
+                self.send('error', message=f'Reading {os.path.basename(fn)} failed: {e}')
+                data = b''
+            if data or self._offset == 0:
+                self.send('file', name=os.path.basename(fn), offset=self._offset, data=base64.b64encode(data).decode())
+                self._offset += len(data)
+            if len(data) < AGENT_FILE_CHUNK:
+                self._files.pop(0)
+                self._offset = 0
+        if not self._files:
+            self._socket.bytesWritten.disconnect(self.slot_send_files)
+            self.finish()
+
+    ########################################
+    #
+    ########################################
+    def finish (self):
+        exitCode, stats = self._result
+        self.send('finish', exit_code=exitCode, stats=stats)
+        self._socket.disconnectFromHost()
+        if self._disconnected:
+            self.close()
+
+    ########################################
+    #
+    ########################################
+    def slot_stdout (self):
+        self.send('output', data=self._proc.readAllStandardOutput().data().decode(errors='replace'))
+
+    ########################################
+    #
+    ########################################
+    def slot_complete (self, exitCode, exitStatus):
+        self.task_complete(exitCode if exitStatus == QProcess.NormalExit else -1)
+
+    ########################################
+    # A process that failed to start never emits 'finished'
+    ########################################
+    def slot_error_occurred (self, err):
+        if err == QProcess.FailedToStart:
+            self.task_complete(-1)
+
+    ########################################
+    # Tasks of clients that went away are stopped, the connection is closed when
+    # they finished
+    ########################################
+    def slot_disconnected (self):
+        self._disconnected = True
+        if self.is_running():
+            self._proc.stop()
+        else:
+            self.close()
+
+    ########################################
+    #
+    ########################################
+    def close (self):
+        if self._tmpdir:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+        self._agent.remove_connection(self)
+        self._socket.deleteLater()
+        self.deleteLater()
+
+
+########################################
+# Accepts task connections
+########################################
+class Agent (QObject):
+
+    def __init__ (self, token, maps):
+        super().__init__()
+        self.token = token
+        self._maps = maps
+        self._connections = []
+
+        self._server = QTcpServer(self)
+        self._server.newConnection.connect(self.slot_new_connection)
+
+    ########################################
+    #
+    ########################################
+    def listen (self, address, port):
+        return self._server.listen(QHostAddress(address), port)
+
+    ########################################
+    # Maps the client's paths in task variables to paths on this host
+    ########################################
+    def map_env (self, env):
+        for k, v in env.items():
+            if isinstance(v, str):
+                for src, dst in self._maps:
+                    if v.startswith(src):
+                        env[k] = dst + v[len(src):]
+                        break
+        return env
+
+    ########################################
+    #
+    ########################################
+    def remove_connection (self, conn):
+        if conn in self._connections:
+            self._connections.remove(conn)
+
+    ########################################
+    #
+    ########################################
+    def slot_new_connection (self):
+        while self._server.hasPendingConnections():
+            self._connections.append(AgentConnection(self._server.nextPendingConnection(), self))
+
+
+########################################
+# Runs the worker agent, returns the exit code
+########################################
+def run_agent (argv):
+    parser = argparse.ArgumentParser(prog='main.py', description=f'Runs {APP_NAME} tasks for other hosts.')
+    parser.add_argument('--agent', action='store_true', required=True, help='run as worker agent')
+    parser.add_argument('--listen', default='127.0.0.1', metavar='ADDRESS',
+            help='address to listen on, e.g. 0.0.0.0 for all interfaces (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=DEFAULT_AGENT_PORT, help=f'TCP port (default: {DEFAULT_AGENT_PORT})')
+    parser.add_argument('--token', default=os.environ.get('QMT_AGENT_TOKEN', ''),
+            help='secret clients must send (in plaintext), default: $QMT_AGENT_TOKEN, '
+            'required unless listening on a loopback address')
+    parser.add_argument('--map', action='append', default=[], metavar='CLIENTPATH=PATH',
+            help='maps a path prefix of the clients to a path on this host, e.g. /Volumes/media=/mnt/media (repeatable)')
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as e:
+        return e.code
+
+    if not args.token and not QHostAddress(args.listen).isLoopback():
+        emit('error', message=f'Listening on {args.listen} requires --token or $QMT_AGENT_TOKEN')
+        return 2
+
+    app = QCoreApplication(sys.argv[:1])
+    setup_env()
+
+    maps = [tuple(m.split('=', 1)) for m in args.map if '=' in m]
+    agent = Agent(args.token, maps)
+    if not agent.listen(args.listen, args.port):
+        emit('error', message=f'Listening on {args.listen}:{args.port} failed')
+        return 1
+    emit('listening', address=args.listen, port=args.port)
+    return app.exec()
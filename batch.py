@@ -0,0 +1,274 @@
+"""
+QMediaTool - headless batch runner
+
+Runs a preset without GUI, e.g.:
+
+    python main.py --run-preset "MP3 - 160k 44.1kHz Stereo" --input a.wav --input b.wav --jobs 2
+
+Progress is written to stdout as JSON lines, the output of the tasks to stderr.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+from PyQt5.QtCore import QCoreApplication, QObject, QProcess, QTimer
+
+from const import *
+from task import Task
+from myprocess import MyProcess
+from progress import TaskProgress
+from presets import get_preset
+from taskenv import setup_env, build_task_env, get_media_duration
+from mediaprobe import get_mediainfo
+from jsonevents import emit
+
+EXIT_OK = 0
+EXIT_TASK_FAILED = 1
+EXIT_USAGE = 2
+EXIT_PRESET_NOT_FOUND = 3
+EXIT_INPUT_ERROR = 4
+
+
+########################################
+# Runs a list of tasks with up to jobs tasks in parallel
+########################################
+class BatchRunner (QObject):
+
+    def __init__ (self, tasks, jobs):
+        super().__init__()
+        self._tasks = tasks
+        self._jobs = max(1, jobs)
+        self._next = 0
+        self._running = {}
+        self._progress = {}
+        self._failures = 0
+
+    ########################################
+    #
+    ########################################
+    def start (self):
+        emit('queue', total=len(self._tasks), jobs=self._jobs)
+        self.run_next_tasks()
+
+    ########################################
+    #
+    ########################################
+    def run_next_tasks (self):
+        while self._next < len(self._tasks) and len(self._running) < self._jobs:
+            self.run_task(self._next)
+            self._next += 1
+        if len(self._running) == 0:
+            emit('done', total=len(self._tasks), failed=self._failures)
+            QCoreApplication.exit(EXIT_OK if self._failures == 0 else EXIT_TASK_FAILED)
+
+    ########################################
+    #
+    ########################################
+    def run_task (self, i):
+        task = self._tasks[i]
+        proc = MyProcess(self)
+        proc.setProcessChannelMode(QProcess.MergedChannels)
+        proc.readyReadStandardOutput.connect(self.slot_stdout)
+        proc.finished.connect(self.slot_complete)
+        proc.errorOccurred.connect(self.slot_error_occurred)
+        self._running[proc] = i
+        progress = TaskProgress(task.duration, self)
+        progress.progress.connect(self.slot_progress)
+        self._progress[progress] = i
+        task.progress_url = progress.url
+        task.started = time.time()
+        emit('start', task=i, name=task.name, input=task.env.get('INPUT', task.env.get('URL')))
+        task.run(proc, True)
+
+    ########################################
+    #
+    ########################################
+    def task_complete (self, proc, exitCode):
+        i = self._running.pop(proc)
+        task = self._tasks[i]
+        for progress, j in list(self._progress.items()):
+            if j == i:
+                del self._progress[progress]
+                progress.close()
+                progress.deleteLater()
+        task.exit_code = exitCode
+        task.finished = time.time()
+        if exitCode != 0:
+            self._failures += 1
+        emit('finish', task=i, name=task.name, exit_code=exitCode, wall_time=round(task.finished - task.started, 3),
+                stats=task.read_stats())
+        emit('progress', done=self._next - len(self._running), total=len(self._tasks), failed=self._failures)
+        proc.deleteLater()
+        self.run_next_tasks()
+
+    ########################################
+    #
+    ########################################
+    def slot_stdout (self):
+        sys.stderr.buffer.write(self.sender().readAllStandardOutput().data())
+        sys.stderr.flush()
+
+    ########################################
+    #
+    ########################################
+    def slot_complete (self, exitCode, exitStatus):
+        self.task_complete(self.sender(), exitCode if exitStatus == QProcess.NormalExit else -1)
+
+    ########################################
+    # A process that failed to start never emits 'finished'
+    ########################################
+    def slot_error_occurred (self, err):
+        if err == QProcess.FailedToStart and self.sender() in self._running:
+            self.task_complete(self.sender(), -1)
+
+    ########################################
+    #
+    ########################################
+    def slot_progress (self, info):
+        if self.sender() in self._progress:
+            emit('ffmpeg_progress', task=self._progress[self.sender()], **info)
+
+
+########################################
+# Yields the input files in the given files and folders. Folders are scanned
+# recursively, in name order and without following symlinks, for files with
+# extensions in exts (all if empty), files are yielded as they are found.
+########################################
+def iter_input_files (paths, exts):
+    exts = set(exts)
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        # folders left to scan, next one last
+        stack = [path]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError:
+                continue
+            dirs = []
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif (not exts or os.path.splitext(entry.name)[1][1:] in exts) and entry.is_file():
+                        yield entry.path
+                except OSError:
+                    pass
+            stack.extend(reversed(dirs))
+
+
+########################################
+# Returns the input files in the given files and folders, see iter_input_files
+########################################
+def get_input_files (paths, exts):
+    return list(iter_input_files(paths, exts))
+
+
+########################################
+# Creates the tasks for running preset with the given args
+########################################
+def get_tasks (preset, args):
+    code = preset['cmd'].strip(' \t\n')
+    overrides = {}
+    if args.output_dir:
+        overrides['OUTPUTDIR'] = args.output_dir
+    for s in args.set:
+        k, _, v = s.partition('=')
+        overrides[k.strip().upper()] = v
+
+    # list of (name suffix, inputs, media infos of input files)
+    inputs = []
+    if preset['input_type'] == INPUT_TYPE_URL:
+        for url in args.url:
+            inputs.append((url, [url], []))
+    elif preset['input_type'] in (INPUT_TYPE_FILE, INPUT_TYPE_FILES):
+        exts = preset['ext'].split(',') if preset['ext'] != '' else []
+        files = get_input_files(args.input, exts)
+        infos = {}
+        for fn in files:
+            try:
+                infos[fn] = get_mediainfo(fn)
+            except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+                # skip files that can't be probed instead of failing the whole batch
+                emit('error', input=fn, message=f'Reading media info failed: {e}')
+        if files and not infos:
+            raise OSError('None of the input files could be probed')
+        files = [fn for fn in files if fn in infos]
+        if preset['input_type'] == INPUT_TYPE_FILE or args.split:
+            for fn in files:
+                inputs.append((os.path.basename(fn), [fn], [infos[fn]]))
+        elif files:
+            inputs.append((None, files, [infos[fn] for fn in files]))
+    else:
+        inputs.append((None, [], []))
+
+    tasks = []
+    for suffix, input_files, input_infos in inputs:
+        env = build_task_env(preset, input_files, input_infos, overrides)
+        task = Task(code, env, preset['name'].strip() + (f' ({suffix})' if suffix else ''))
+        task.preset = preset['name'].strip()
+        task.duration = get_media_duration(input_infos, env)
+        tasks.append(task)
+    return tasks
+
+
+########################################
+# Runs a preset without GUI, returns the exit code
+########################################
+def run_batch (argv):
+    parser = argparse.ArgumentParser(prog='main.py', description=f'Runs a {APP_NAME} preset without GUI.')
+    parser.add_argument('--run-preset', required=True, metavar='PRESET', help='name or id of the preset')
+    parser.add_argument('--input', action='append', default=[], metavar='PATH',
+            help='input file, or folder that is scanned for files with supported extensions (repeatable)')
+    parser.add_argument('--url', action='append', default=[], metavar='URL', help='input URL (repeatable)')
+    parser.add_argument('--set', action='append', default=[], metavar='VAR=VALUE',
+            help='sets a task variable, e.g. CRF=20 (repeatable)')
+    parser.add_argument('--jobs', type=int, default=DEFAULT_MAX_JOBS, help='number of tasks run in parallel')
+    parser.add_argument('--output-dir', metavar='DIR', help='output directory, default: directory of (first) input file')
+    parser.add_argument('--split', action='store_true', help='multiple input files presets: run one task per input file')
+    parser.add_argument('--background', action='store_true', help='run tasks with lowest CPU and IO priority')
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as e:
+        return e.code
+
+    app = QCoreApplication(sys.argv[:1])
+    setup_env()
+
+    presets_db = sqlite3.connect(DATA_DIR + '/presets.db')
+    presets_db.row_factory = sqlite3.Row
+    preset = get_preset(presets_db, args.run_preset)
+    presets_db.close()
+    if preset is None:
+        emit('error', message=f'Preset not found: {args.run_preset}')
+        return EXIT_PRESET_NOT_FOUND
+
+    if preset['input_type'] == INPUT_TYPE_URL and not args.url:
+        emit('error', message='Preset requires --url')
+        return EXIT_INPUT_ERROR
+    if preset['input_type'] in (INPUT_TYPE_FILE, INPUT_TYPE_FILES):
+        missing = [p for p in args.input if not os.path.exists(p)]
+        if not args.input or missing:
+            emit('error', message='Preset requires existing --input files' + (': ' + ', '.join(missing) if missing else ''))
+            return EXIT_INPUT_ERROR
+    try:
+        tasks = get_tasks(preset, args)
+    except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+        emit('error', message=f'Reading media info failed: {e}')
+        return EXIT_INPUT_ERROR
+    if not tasks:
+        emit('error', message='No input files with supported extensions found')
+        return EXIT_INPUT_ERROR
+    if args.background:
+        for task in tasks:
+            task.priority = TASK_PRIORITY_BACKGROUND
+
+    runner = BatchRunner(tasks, args.jobs)
+    QTimer.singleShot(0, runner.start)
+    return app.exec()
@@ -0,0 +1,271 @@
+"""
+QMediaTool - FFmpegCapabilities class
+
+Registry of what the ffmpeg binary supports: encoders, decoders, filters,
+hwaccels, muxers and (Windows and macOS) capture devices. Querying them means
+running ffmpeg several times, so they are cached in a JSON file, which is valid
+as long as path, size and modification time of the binary don't change. They are
+only loaded when first needed, from the cache if possible, and then refreshed in
+the background, e.g. for devices that were plugged in. Capabilities needed before
+they are cached are queried right away.
+"""
+
+import json
+import os
+import re
+
+from PyQt5.QtCore import QObject, QProcess
+
+from const import *
+from task import Task
+from taskenv import get_base_env
+from mediacache import get_tool_id
+
+CACHE_FILE = DATA_DIR + '/ffmpegcaps.json'
+
+STREAM_TYPES = {'V': 'video', 'A': 'audio', 'S': 'subtitle'}
+
+# capability => ffmpeg arguments
+QUERIES = {
+    'encoders': '-encoders',
+    'decoders': '-decoders',
+    'filters': '-filters',
+    'hwaccels': '-hwaccels',
+    'muxers': '-muxers',
+}
+if IS_WIN:
+    QUERIES['devices'] = '-list_devices true -f dshow -i dummy'
+elif IS_MAC:
+    QUERIES['devices'] = '-list_devices true -f avfoundation -i /dev/null'
+
+
+########################################
+# Returns the lines after the line consisting of dashes that ends ffmpeg's legend
+########################################
+def get_list_lines (lines):
+    for i, line in enumerate(lines):
+        if line.strip() and line.strip(' -') == '':
+            return lines[i + 1:]
+    return []
+
+
+########################################
+# Parses the output of -encoders or -decoders, e.g. " V....D libx264   libx264 H.264",
+# returns a dict stream type => sorted names
+########################################
+def parse_codecs (lines):
+    codecs = {t: [] for t in STREAM_TYPES.values()}
+    for line in get_list_lines(lines):
+        parts = line.split()
+        if len(parts) >= 2 and parts[0][0] in STREAM_TYPES:
+            codecs[STREAM_TYPES[parts[0][0]]].append(parts[1])
+    return {t: sorted(names) for t, names in codecs.items()}
+
+
+########################################
+# Parses the output of -filters, e.g. " TSC acompressor  A->A  Audio compressor."
+########################################
+def parse_filters (lines):
+    return sorted(parts[1] for parts in map(str.split, lines) if len(parts) >= 3 and '->' in parts[2])
+
+
+########################################
+# Parses the output of -hwaccels, a name per line after a heading
+########################################
+def parse_hwaccels (lines):
+    return [line.strip() for line in lines[1:] if line.strip() and ' ' not in line.strip()]
+
+
+########################################
+# Parses the output of -muxers, e.g. "  E mp4   MP4 (MPEG-4 Part 14)"
+########################################
+def parse_muxers (lines):
+    return sorted(parts[1] for parts in map(str.split, get_list_lines(lines)) if len(parts) >= 2 and 'E' in parts[0])
+
+
+########################################
+# Parses the output of -list_devices, returns a dict 'video'/'audio' => device names
+########################################
+def parse_devices (lines):
+    devices = {'video': [], 'audio': []}
+    if IS_WIN:
+        re_dev = re.compile(r'^\[[^\]]*\] "(.*)" \((video|audio)\)')
+        for line in lines:
+            res = re.search(re_dev, line)
+            if res:
+                devices[res.group(2)].append(res.group(1))
+    else:
+        re_dev = re.compile(r'^\[[^\]]*\] (.*)')
+        current_list = None
+        for line in lines:
+            res = re.search(re_dev, line)
+            if res:
+                line = res.group(1)
+                if line.startswith('AVFoundation video'):
+                    current_list = devices['video']
+                elif line.startswith('AVFoundation audio'):
+                    current_list = devices['audio']
+                elif line.startswith('[') and current_list is not None:
+                    current_list.append(line[line.index(']') + 2:])
+    return devices
+
+
+PARSERS = {
+    'encoders': parse_codecs,
+    'decoders': parse_codecs,
+    'filters': parse_filters,
+    'hwaccels': parse_hwaccels,
+    'muxers': parse_muxers,
+    'devices': parse_devices,
+}
+
+
+########################################
+# Returns the key the cache is valid for: path, size and modification time of ffmpeg
+########################################
+def get_ffmpeg_key ():
+    return get_base_env().get('FFMPEG', '') + '|' + get_tool_id('ffmpeg')
+
+
+class FFmpegCapabilities (QObject):
+
+    ########################################
+    #
+    ########################################
+    def __init__ (self, parent=None):
+        super().__init__(parent)
+        self._caps = None
+        self._key = None
+        # capabilities whose query timed out, they're empty and not saved until queried again
+        self._unknown = set()
+        # background refresh: capabilities left to query, running process
+        self._pending = []
+        self._proc = None
+
+    ########################################
+    # Returns capability name (see QUERIES), queries ffmpeg right away if it's not cached.
+    # If ffmpeg doesn't answer within CAPS_QUERY_TIMEOUT, the capability is empty for now
+    # and queried again in the background.
+    ########################################
+    def get (self, name):
+        if self._caps is None:
+            self.load()
+        if name not in QUERIES:
+            return {'video': [], 'audio': []} if name == 'devices' else []
+        if (name not in self._caps and self._pending[:1] == [name] and self._proc is not None
+                and self._proc.state() != QProcess.NotRunning):
+            # already queried in the background, wait for that (slot_query_finished stores it)
+            if not self._proc.waitForFinished(CAPS_QUERY_TIMEOUT * 1000):
+                # keeps running, the capability is completed when it finishes
+                self._caps[name] = PARSERS[name]([])
+                self._unknown.add(name)
+        if name not in self._caps:
+            # not refreshed in the background again
+            if name in self._pending[1:]:
+                self._pending.remove(name)
+            proc = QProcess()
+            self.start_query(name, proc)
+            if proc.waitForFinished(CAPS_QUERY_TIMEOUT * 1000):
+                self._caps[name] = self.parse_output(name, proc)
+                self.save()
+            else:
+                proc.kill()
+                proc.waitForFinished(1000)
+                self._caps[name] = PARSERS[name]([])
+                self._unknown.add(name)
+                if name not in self._pending:
+                    self._pending.append(name)
+                    if self._proc is None:
+                        self.query_next()
+        return self._caps[name]
+
+    ########################################
+    # Loads the cached capabilities, and starts refreshing (or completing) them in the background
+    ########################################
+    def load (self):
+        self._key = get_ffmpeg_key()
+        self._caps = {}
+        try:
+            with open(CACHE_FILE, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('key') == self._key:
+                self._caps = data['caps']
+        except (OSError, ValueError, KeyError):
+            pass
+        self._pending = list(QUERIES)
+        self.query_next()
+
+    ########################################
+    #
+    ########################################
+    def save (self):
+        try:
+            with open(CACHE_FILE + '.tmp', 'w', encoding='utf-8') as f:
+                caps = {k: v for k, v in self._caps.items() if k not in self._unknown}
+                json.dump({'key': self._key, 'caps': caps}, f)
+            os.replace(CACHE_FILE + '.tmp', CACHE_FILE)
+        except OSError:
+            pass
+
+    ########################################
+    #
+    ########################################
+    def start_query (self, name, proc):
+        proc.setProcessChannelMode(QProcess.MergedChannels)
+        Task(f'$FFMPEG -hide_banner {QUERIES[name]}').run(proc)
+
+    ########################################
+    #
+    ########################################
+    def parse_output (self, name, proc):
+        lines = proc.readAllStandardOutput().data().decode(errors='ignore').rstrip().splitlines()
+        return PARSERS[name](lines)
+
+    ########################################
+    # Starts the next query of the background refresh
+    ########################################
+    def query_next (self):
+        self._proc = None
+        if not self._pending:
+            return
+        self._proc = QProcess(self)
+        self._proc.finished.connect(self.slot_query_finished)
+        self._proc.errorOccurred.connect(self.slot_query_error)
+        self.start_query(self._pending[0], self._proc)
+
+    ########################################
+    #
+    ########################################
+    def slot_query_finished (self, exitCode, exitStatus):
+        proc = self.sender()
+        if proc is not self._proc:
+            return
+        name = self._pending.pop(0)
+        if exitStatus == QProcess.NormalExit:
+            caps = self.parse_output(name, proc)
+            if caps != self._caps.get(name) or name in self._unknown:
+                self._caps[name] = caps
+                self._unknown.discard(name)
+                self.save()
+        proc.deleteLater()
+        self.query_next()
+
+    ########################################
+    # A process that failed to start never emits 'finished', the refresh is given up
+    ########################################
+    def slot_query_error (self, err):
+        if err == QProcess.FailedToStart and self.sender() is self._proc:
+            self._proc.deleteLater()
+            self._pending = []
+            self._proc = None
+
+    ########################################
+    # Stops the background refresh
+    ########################################
+    def stop (self):
+        self._pending = []
+        if self._proc is not None:
+            self._proc.finished.disconnect(self.slot_query_finished)
+            self._proc.kill()
+            self._proc.waitForFinished(1000)
+            self._proc = None
@@ -0,0 +1,115 @@
+"""
+QMediaTool - chunked encoding
+
+Turns a video encoding task into a graph of tasks, so a single long encode can
+use more cores than the encoder would: the input's video stream is cut without
+re-encoding into segments, each starting at the first keyframe after an evenly
+spaced split point (sources usually have keyframes at scene cuts), the segments
+are encoded in parallel by the task's own code, and the encoded segments are
+joined with the concat demuxer. The audio is encoded in one piece by a task of
+its own, so there are no gaps or priming samples at segment boundaries.
+"""
+
+from const import *
+from task import Task
+from taskenv import get_config_vars
+
+SPLIT_CODE = """mkdir -p "$CHUNKDIR" && cd "$CHUNKDIR" && mkdir -p {dirs} || exit 1
+$FFMPEG -hide_banner -y -i "$INPUT" -map 0:v:0 -c copy -f segment -segment_times $SEGMENTTIMES -reset_timestamps 1 src_%03d.mkv
+"""
+
+AUDIO_CODE = """mkdir -p "$CHUNKDIR" || exit 1
+$FFMPEG -hide_banner -y -i "$INPUT" -map 0:a -vn -sn -c:a {codec} "$CHUNKDIR/audio.mka"
+"""
+
+# the segment muxer creates fewer segments if there are no keyframes between split points
+CHUNK_CODE = """[ -f "$INPUT" ] || exit 0
+"""
+
+JOIN_CODE = """cd "$CHUNKDIR" || exit 1
+rm -f concat.txt
+for chunk in enc_*/*; do
+    [ -f "$chunk" ] && echo "file '$chunk'" >> concat.txt && ext="${chunk##*.}"
+done
+[ -f concat.txt ] || exit 1
+if [ -f audio.mka ]; then
+    $FFMPEG -hide_banner -y -f concat -safe 0 -i concat.txt -i audio.mka -map 0:v -map 1:a -c copy "$OUTPUTDIR/${INPUTBASENAME}_${TIMESTAMP}.$ext"
+else
+    $FFMPEG -hide_banner -y -f concat -safe 0 -i concat.txt -c copy "$OUTPUTDIR/${INPUTBASENAME}_${TIMESTAMP}.$ext"
+fi || exit 1
+cd "$OUTPUTDIR" && rm -rf "$CHUNKDIR"
+"""
+
+
+########################################
+# Returns True if the code of a preset can be run on chunks, i.e. it re-encodes the
+# video of a whole file
+########################################
+def can_chunk (code):
+    config_vars = get_config_vars(code)
+    return (('CodecVideo' in config_vars or 'Crf' in config_vars) and
+            not any(c in config_vars for c in ('Start', 'End', 'Duration')))
+
+
+########################################
+# Returns a split, audio or join task for task, which learn their speed under
+# preset name "Chunked Encoding - <step>"
+########################################
+def get_helper_task (code, env, task, step, duration):
+    helper = Task(code, env, f'{task.name} [{step}]')
+    helper.resources = {'disk-io': 1.0}
+    helper.priority = task.priority
+    helper.preset = f'Chunked Encoding - {step}'
+    helper.duration = duration
+    return helper
+
+
+########################################
+# Returns the tasks that run task (a single file task) in chunks parallel chunks:
+# split, chunk and audio tasks and a join task depending on all of them.
+# Returns [task] if the input has no video or its duration is unknown.
+########################################
+def get_chunk_tasks (task, info, chunks):
+    try:
+        duration = float(info['general']['Duration'])
+    except (TypeError, KeyError, ValueError):
+        duration = 0
+    tracks = info['track'] if info else []
+    if chunks < 2 or duration <= 0 or not any(t.get('@type') == 'Video' for t in tracks):
+        return [task]
+
+    env = dict(task.env)
+    env['CHUNKDIR'] = f'{env["OUTPUTDIR"]}/.chunks_{env["INPUTBASENAME"]}_{env["TIMESTAMP"]}'
+
+    split_env = dict(env, SEGMENTTIMES=','.join(f'{duration * i / chunks:.3f}' for i in range(1, chunks)))
+    split = get_helper_task(SPLIT_CODE.format(dirs=' '.join(f'enc_{i:03d}' for i in range(chunks))),
+            split_env, task, 'Split', duration)
+    tasks = [split]
+
+    for i in range(chunks):
+        chunk_env = dict(env)
+        chunk_env['INPUT'] = chunk_env['INPUT0'] = f'{env["CHUNKDIR"]}/src_{i:03d}.mkv'
+        chunk_env['INPUTDIR'] = env['CHUNKDIR']
+        chunk_env['INPUTBASENAME'] = f'chunk_{i:03d}'
+        chunk_env['INPUTEXT'] = 'mkv'
+        chunk_env['OUTPUTDIR'] = f'{env["CHUNKDIR"]}/enc_{i:03d}'
+        chunk = Task(CHUNK_CODE + task.code, chunk_env, f'{task.name} [Chunk {i + 1}/{chunks}]')
+        chunk.resources = task.resources
+        chunk.preset = task.preset
+        chunk.duration = duration / chunks
+        chunk.priority = task.priority
+        chunk.depends = [split]
+        tasks.append(chunk)
+
+    # tasks that drop the audio don't get any
+    if any(t.get('@type') == 'Audio' for t in tracks) and ' -an' not in task.code:
+        if 'CODECAUDIO' in env:
+            codec = '$CODECAUDIO -b:a $BITRATEAUDIO' if 'BITRATEAUDIO' in env else '$CODECAUDIO'
+        else:
+            codec = 'copy'
+        tasks.append(get_helper_task(AUDIO_CODE.format(codec=codec), env, task, 'Audio', duration))
+
+    join = get_helper_task(JOIN_CODE, env, task, 'Join', duration)
+    join.depends = tasks[1:]
+    tasks.append(join)
+    return tasks
@@ -46,6 +46,66 @@ INPUT_TYPE_FILES = 1
 INPUT_TYPE_URL = 2
 INPUT_TYPE_NONE = 3
 
+TASK_STATE_PENDING = 0
+TASK_STATE_RUNNING = 1
+TASK_STATE_SUCCEEDED = 2
+TASK_STATE_FAILED = 3
+TASK_STATE_STOPPED = 4
+TASK_STATE_SKIPPED = 5
+TASK_STATE_PAUSED = 6
+
+# states of tasks that don't have to be run again
+TASK_STATES_DONE = (TASK_STATE_SUCCEEDED, TASK_STATE_SKIPPED)
+
+TASK_STATE_COLORS = {
+    TASK_STATE_RUNNING: '#7F7F00',
+    TASK_STATE_SUCCEEDED: '#007F00',
+    TASK_STATE_FAILED: '#7F0000',
+    TASK_STATE_STOPPED: '#5F5F5F',
+    TASK_STATE_SKIPPED: '#3F5F3F',
+    TASK_STATE_PAUSED: '#3F3F5F',
+}
+
+# pending tasks with higher priority are run first, background tasks
+# in addition are run with lowest CPU and IO priority (nice/ionice)
+TASK_PRIORITY_BACKGROUND = -1
+TASK_PRIORITY_NORMAL = 0
+TASK_PRIORITY_URGENT = 1
+
+TASK_PRIORITY_NAMES = {
+    TASK_PRIORITY_URGENT: 'Urgent',
+    TASK_PRIORITY_NORMAL: 'Normal',
+    TASK_PRIORITY_BACKGROUND: 'Background',
+}
+
+# number of task queue items executed in parallel, ffmpeg itself is multi-threaded
+DEFAULT_MAX_JOBS = max(1, (os.cpu_count() or 1) // 4)
+
+# interval (ms) for sampling the memory usage of running tasks
+TASK_STATS_INTERVAL = 1000
+
+# tasks estimated to take less than this many seconds are run by reusable shell workers, if enabled
+WARM_SHELL_MAX_SECS = 5
+
+# how much of each resource class can be used by parallel tasks
+DEFAULT_RESOURCE_LIMITS = f'cpu-heavy:{max(1, (os.cpu_count() or 1) // 8)}, hw-encoder:3, network:4, disk-io:2'
+
+# TCP port of worker agents running tasks for other hosts
+DEFAULT_AGENT_PORT = 9900
+# size (bytes) of the parts output files are sent back by agents in
+AGENT_FILE_CHUNK = 1 << 20
+
+# how ffmpeg's progress reaches QMediaTool: 'fifo' (a named pipe per task, where
+# supported) or 'tcp' (a localhost port per task), see progress.py
+PROGRESS_TRANSPORT = os.environ.get('QMT_PROGRESS', 'fifo')
+
+# watch folders: seconds a new file's size must stay unchanged before it's added to the task queue
+WATCH_STABLE_SECS = 3
+# interval (ms) for polling folders that can't be watched by the file system watcher, e.g. network shares
+WATCH_POLL_INTERVAL = 5000
+# max. number of probed new files that are added to the task queue per event loop cycle
+WATCH_INGEST_CHUNK = 10
+
 CONTAINERS = ['aac','ac3','asf','au','avi','caf','flac','flv','gif','h264','m4a','m4v','mkv','mov','mp2','mp3','mp4','mpeg','ogg','rm','vob','wav','webm']
 
 CONTAINERS_AUDIO = ['aac','ac3','aiff','au','flac','m4a','mp3','ogg','wav']
@@ -114,3 +174,34 @@ LABELS = {
     'CodecAudio': 'A-Codec',
     'BitrateAudio': 'A-Bitrate',
 }
+
+# the output log widget is updated at most every OUTPUT_FLUSH_INTERVAL ms with at most
+# OUTPUT_MAX_FLUSH_LINES lines (older ones are skipped) and keeps the last OUTPUT_MAX_BLOCKS
+# lines, the complete output of each task is in its log file in LOG_DIR
+OUTPUT_FLUSH_INTERVAL = 80
+OUTPUT_MAX_FLUSH_LINES = 1000
+OUTPUT_MAX_BLOCKS = 20000
+LOG_DIR = DATA_DIR + '/logs'
+# the log viewer remembers the offset of every LOG_INDEX_STEP-th line and indexes large
+# files in parts of LOG_INDEX_CHUNK bytes, so it stays responsive
+LOG_INDEX_STEP = 64
+LOG_INDEX_CHUNK = 8 << 20
+
+# number of media files probed in parallel (mostly waiting for storage), and seconds after
+# which probing a file is given up
+PROBE_JOBS = max(4, min(8, 2 * (os.cpu_count() or 1)))
+PROBE_TIMEOUT = 30
+
+# seconds after which querying an ffmpeg capability (e.g. -encoders) the GUI waits for is given up
+CAPS_QUERY_TIMEOUT = 10
+
+# media probe engine, 'mediainfo' or 'ffprobe' (the other one is the fallback), see mediaprobe.py
+PROBE_ENGINE = os.environ.get('QMT_PROBE', 'mediainfo')
+
+# size cap (bytes of JSON) of the media info cache, least recently used entries are evicted
+MEDIA_CACHE_MAX_BYTES = 32 << 20
+# max. number of files looked up in the media info cache in one transaction
+MEDIA_CACHE_BATCH = 200
+
+# seconds spent at most per event loop iteration on adding files of dropped folders to the input list
+INPUT_SCAN_SLICE = 0.05
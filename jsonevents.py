@@ -0,0 +1,15 @@
+"""
+QMediaTool - JSON events
+
+The command line modes (batch runner, worker agent, probe benchmark) report
+progress and results as JSON lines on stdout.
+"""
+
+import json
+
+
+########################################
+# Writes event with fields kwargs to stdout
+########################################
+def emit (event, **kwargs):
+    print(json.dumps(dict(event=event, **kwargs)), flush=True)
@@ -0,0 +1,363 @@
+"""
+QMediaTool - LogViewer class
+
+Shows a task's log file (see outputlog.py) without loading it into memory: the
+file is memory-mapped, only the offsets of every LOG_INDEX_STEP-th line are kept,
+and the view only asks for the lines that are visible. Searches run on the mapped
+file, a window of SEARCH_WINDOW bytes at a time. Log files of running tasks are
+followed as they grow.
+"""
+
+import mmap
+import os
+import re
+from array import array
+from bisect import bisect_right
+
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+
+from const import *
+
+# a character class first is much faster for re than case insensitive alternatives
+RE_ERROR = re.compile(rb'\b[EeFfIiCcUuNn](?:rror|RROR|ailed|AILED|nvalid|NVALID|annot|ANNOT|nable to|ot found|o such file)\b')
+RE_NEWLINE = re.compile(rb'\n')
+
+# longer lines are cut, ffmpeg's status lines are only separated by \r
+MAX_LINE_CHARS = 2000
+# searches scan the file in windows of this size, one per event loop iteration
+SEARCH_WINDOW = 4 << 20
+
+
+class LogIndex ():
+
+    ########################################
+    #
+    ########################################
+    def __init__ (self, fn):
+        self._fn = fn
+        self._file = None
+        self._mm = None
+        self._size = 0
+        self.reset()
+
+    ########################################
+    #
+    ########################################
+    def reset (self):
+        self._checkpoints = array('q', [0])
+        self._newlines = 0
+        self._lastStart = 0
+        self._indexed = 0
+
+    ########################################
+    #
+    ########################################
+    def close (self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._size = 0
+
+    ########################################
+    # Maps the file anew if it grew, returns True if it was replaced (the task was run again)
+    ########################################
+    def refresh (self):
+        try:
+            st = os.stat(self._fn)
+            size = st.st_size
+        except OSError:
+            st = None
+            size = 0
+        # log files are replaced rather than truncated, see open_log_file()
+        replaced = self._file is not None and (st is None or os.fstat(self._file.fileno()).st_ino != st.st_ino)
+        if size == self._size and not replaced:
+            return False
+        replaced = replaced or size < self._size
+        self.close()
+        if replaced:
+            self.reset()
+        if size > 0:
+            try:
+                self._file = open(self._fn, 'rb')
+                self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._size = len(self._mm)
+            except (OSError, ValueError):
+                self.close()
+        return replaced
+
+    ########################################
+    # Indexes the next part of the file, returns True if there's more to do
+    ########################################
+    def index_chunk (self):
+        if self._mm is None:
+            return False
+        end = min(self._size, self._indexed + LOG_INDEX_CHUNK)
+        for m in RE_NEWLINE.finditer(self._mm, self._indexed, end):
+            self._newlines += 1
+            self._lastStart = m.end()
+            if self._newlines % LOG_INDEX_STEP == 0:
+                self._checkpoints.append(self._lastStart)
+        self._indexed = end
+        return end < self._size
+
+    ########################################
+    # Number of lines indexed so far, the last one may still be incomplete
+    ########################################
+    def line_count (self):
+        return self._newlines + (1 if self._indexed > self._lastStart else 0)
+
+    ########################################
+    # Returns the offset of the start of line i
+    ########################################
+    def get_offset (self, i):
+        if i >= self.line_count():
+            return self._indexed
+        offset = self._checkpoints[i // LOG_INDEX_STEP]
+        for _ in range(i % LOG_INDEX_STEP):
+            offset = self._mm.find(b'\n', offset) + 1
+        return offset
+
+    ########################################
+    # Returns the number of the line containing offset
+    ########################################
+    def get_line_number (self, offset):
+        cp = bisect_right(self._checkpoints, offset) - 1
+        return cp * LOG_INDEX_STEP + self._mm[self._checkpoints[cp]:offset].count(b'\n')
+
+    ########################################
+    #
+    ########################################
+    def get_line (self, i):
+        if self._mm is None or i >= self.line_count():
+            return ''
+        start = self.get_offset(i)
+        end = self._mm.find(b'\n', start, self._indexed)
+        line = self._mm[start:end if end >= 0 else self._indexed]
+        # show what a terminal would show
+        line = line.rstrip(b'\r').rsplit(b'\r', 1)[-1]
+        return line[:MAX_LINE_CHARS * 4].decode(errors='replace')[:MAX_LINE_CHARS]
+
+    ########################################
+    #
+    ########################################
+    def is_error (self, i):
+        return RE_ERROR.search(self.get_line(i).encode()) is not None
+
+    ########################################
+    # Searches the window after (or before) offset pos for regex, returns the number of
+    # the first (or last) line matching, or -1 and the offset to go on with (-1 at the end)
+    ########################################
+    def search (self, regex, pos, backwards=False):
+        if self._mm is None:
+            return -1, -1
+        # windows start and end at line starts, so lines aren't cut
+        if not backwards:
+            end = self._mm.find(b'\n', min(self._indexed, pos + SEARCH_WINDOW), self._indexed) + 1 or self._indexed
+            m = regex.search(self._mm, pos, end)
+            if m:
+                return self.get_line_number(m.start()), -1
+            return -1, end if end < self._indexed else -1
+        start = self._mm.rfind(b'\n', 0, max(0, pos - SEARCH_WINDOW)) + 1
+        last = None
+        for last in regex.finditer(self._mm, start, pos):
+            pass
+        if last is not None:
+            return self.get_line_number(last.start()), -1
+        return -1, start if start > 0 else -1
+
+
+class LogModel (QAbstractListModel):
+
+    ########################################
+    #
+    ########################################
+    def __init__ (self, index, parent=None):
+        super().__init__(parent)
+        self._index = index
+        self._rows = 0
+
+    ########################################
+    # Makes the lines indexed since the last update known to the view
+    ########################################
+    def update (self, reset=False):
+        rows = self._index.line_count()
+        if reset:
+            self.beginResetModel()
+            self._rows = rows
+            self.endResetModel()
+        elif rows > self._rows:
+            self.beginInsertRows(QModelIndex(), self._rows, rows - 1)
+            self._rows = rows
+            self.endInsertRows()
+        elif self._rows > 0:
+            # the last line may have been incomplete
+            idx = self.index(self._rows - 1)
+            self.dataChanged.emit(idx, idx)
+
+    ########################################
+    #
+    ########################################
+    def rowCount (self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._rows
+
+    ########################################
+    #
+    ########################################
+    def data (self, idx, role=Qt.DisplayRole):
+        if not idx.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self._index.get_line(idx.row())
+        if role == Qt.ForegroundRole and self._index.is_error(idx.row()):
+            return QBrush(QColor('#e05050'))
+        return None
+
+
+class LogViewer (QDialog):
+
+    ########################################
+    #
+    ########################################
+    def __init__ (self, fn, title, parent=None):
+        super().__init__(parent)
+        self.setAttribute(Qt.WA_DeleteOnClose)
+        self.setWindowTitle(f'Log - {title}')
+        self.resize(900, 600)
+
+        self._index = LogIndex(fn)
+        self._model = LogModel(self._index, self)
+
+        # a QListView lays out all rows again when rows are added, a QTableView with fixed
+        # row heights doesn't
+        layout = QVBoxLayout(self)
+        self.tableView = QTableView(self)
+        self.tableView.setModel(self._model)
+        self.tableView.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.tableView.horizontalHeader().hide()
+        self.tableView.horizontalHeader().setStretchLastSection(True)
+        self.tableView.verticalHeader().hide()
+        self.tableView.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.tableView.verticalHeader().setDefaultSectionSize(self.tableView.fontMetrics().height() + 2)
+        self.tableView.setShowGrid(False)
+        self.tableView.setWordWrap(False)
+        self.tableView.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.tableView.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.tableView)
+
+        row = QHBoxLayout()
+        self.lineEditSearch = QLineEdit(self)
+        self.lineEditSearch.setPlaceholderText('Search')
+        self.lineEditSearch.returnPressed.connect(lambda: self.slot_search(False))
+        row.addWidget(self.lineEditSearch)
+        for text, slot in (('&Previous', lambda: self.slot_search(True)), ('&Next', lambda: self.slot_search(False)),
+                ('Previous &Error', lambda: self.slot_find_error(True)), ('Next E&rror', lambda: self.slot_find_error(False))):
+            button = QPushButton(text, self)
+            button.setAutoDefault(False)
+            button.released.connect(slot)
+            row.addWidget(button)
+        self.labelStatus = QLabel(self)
+        row.addWidget(self.labelStatus)
+        layout.addLayout(row)
+
+        QShortcut(QKeySequence.Copy, self.tableView, self.slot_copy)
+        QShortcut(QKeySequence.Find, self, self.lineEditSearch.setFocus)
+
+        # a running search: regex, offset to go on with, direction
+        self._search = None
+        self._searchTimer = QTimer(self)
+        self._searchTimer.timeout.connect(self.slot_search_step)
+
+        # indexes the file in parts and follows it while it grows
+        self._timer = QTimer(self)
+        self._timer.setInterval(200)
+        self._timer.timeout.connect(self.slot_update)
+        self._timer.start()
+        self.finished.connect(self.slot_finished)
+        self.slot_update()
+
+    ########################################
+    #
+    ########################################
+    def slot_update (self):
+        atEnd = self.tableView.verticalScrollBar().value() == self.tableView.verticalScrollBar().maximum()
+        reset = self._index.refresh()
+        if reset:
+            self.stop_search()
+        self._index.index_chunk()
+        self._model.update(reset)
+        if self._search is None:
+            self.labelStatus.setText(f'{self._model.rowCount()} lines')
+        if atEnd:
+            self.tableView.scrollToBottom()
+
+    ########################################
+    #
+    ########################################
+    def slot_search (self, backwards):
+        text = self.lineEditSearch.text()
+        if text:
+            self.find(re.compile(re.escape(text.encode()), re.IGNORECASE), backwards)
+
+    ########################################
+    #
+    ########################################
+    def slot_find_error (self, backwards):
+        self.find(RE_ERROR, backwards)
+
+    ########################################
+    # Starts searching for the next (or previous) line after the current one matching regex
+    ########################################
+    def find (self, regex, backwards):
+        current = self.tableView.currentIndex()
+        if current.isValid():
+            pos = self._index.get_offset(current.row() if backwards else current.row() + 1)
+        else:
+            pos = self._index.get_offset(self._model.rowCount() if backwards else 0)
+        self._search = (regex, pos, backwards)
+        self.labelStatus.setText('Searching...')
+        self._searchTimer.start()
+
+    ########################################
+    #
+    ########################################
+    def slot_search_step (self):
+        regex, pos, backwards = self._search
+        line, pos = self._index.search(regex, pos, backwards)
+        if line >= 0 or pos < 0:
+            self.stop_search()
+            if line < 0 or line >= self._model.rowCount():
+                self.labelStatus.setText('Not found')
+                return
+            idx = self._model.index(line)
+            self.tableView.setCurrentIndex(idx)
+            self.tableView.scrollTo(idx, QAbstractItemView.PositionAtCenter)
+            self.labelStatus.setText(f'Line {line + 1} of {self._model.rowCount()}')
+        else:
+            self._search = (regex, pos, backwards)
+
+    ########################################
+    #
+    ########################################
+    def stop_search (self):
+        self._searchTimer.stop()
+        self._search = None
+
+    ########################################
+    #
+    ########################################
+    def slot_copy (self):
+        rows = sorted(idx.row() for idx in self.tableView.selectionModel().selectedIndexes())
+        QApplication.clipboard().setText('\n'.join(self._index.get_line(row) for row in rows))
+
+    ########################################
+    #
+    ########################################
+    def slot_finished (self):
+        self.stop_search()
+        self._timer.stop()
+        self._index.close()
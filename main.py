@@ -2,18 +2,15 @@
 QMediaTool - Main class
 """
 
-import json
 from math import floor
 import os
 import sys
-import re
 import sqlite3
 import time
 
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
-from PyQt5.QtNetwork import QTcpServer, QHostAddress
 from PyQt5 import uic, sip
 
 from const import *
@@ -26,9 +23,19 @@ if IS_WIN:
     DWMWA_USE_IMMERSIVE_DARK_MODE = 20
     windll.dwmapi.DwmSetWindowAttribute.argtypes = (HWND, DWORD, LPCVOID, DWORD)
 
-from presets import PresetsManager
+from presets import PresetsManager, get_preset
 from task import Task
+from taskresources import parse_resources, guess_resources
+from taskenv import setup_env, get_config_vars, build_task_env, get_media_duration
+from chunkencode import can_chunk, get_chunk_tasks
+from mediaprobe import MediaProbePool
+from capabilities import FFmpegCapabilities
+from batch import iter_input_files
 from myprocess import MyProcess
+from progress import TaskProgress, format_progress
+from outputlog import OutputLog, open_log_file, EDITOR_LOG_FILE
+from logviewer import LogViewer
+from watchfolders import WatchFolders
 
 
 class Main (QMainWindow):
@@ -70,25 +77,37 @@ class Main (QMainWindow):
         self.actionDarkTheme.setChecked(theme == 'dark')
         self.actionDarkTheme.toggled.connect(self.set_theme)
 
+        # output log, updated in batches
+        self._output = OutputLog(self.plainTextEditOutput, self)
+        self._logFile = None
+        self.plainTextEditOutput.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.plainTextEditOutput.customContextMenuRequested.connect(self.slot_output_context_menu)
+
         # setup drop support
         self.setAcceptDrops(True)
 
         # defaults
         self._supported_file_extensions = []
         self._media_infos = {}
+        # input files are probed in the background, their infos are added as they arrive
+        self._probes = MediaProbePool(parent=self)
+        self._probes.probed.connect(self.slot_media_probed)
+        # multiple files mode: input file => its list items, input files not probed yet
+        self._input_items = {}
+        self._input_unprobed = set()
+        # files of dropped folders are added a slice at a time
+        self._input_scans = []
+        self._input_scan_cnt = 0
+        self._inputScanTimer = QTimer(self)
+        self._inputScanTimer.setInterval(0)
+        self._inputScanTimer.timeout.connect(self.slot_input_scan)
         self._duration = 0
         self._track_cnt = 0
         self._current_preset = None
         self._config_widgets = {}
 
         # set env vars
-        os.environ['IS_WIN'] = 'true' if IS_WIN else 'false'
-        os.environ['IS_MAC'] = 'true' if IS_MAC else 'false'
-        os.environ['IS_LINUX'] = 'true' if IS_LINUX else 'false'
-        if IS_WIN:
-            os.environ['TMPDIR'] = os.environ['TMP'] + '\\'
-
-        self.setup_tool_env_vars()
+        setup_env()
 
         # single file mode
         self.pushButtonInputSelect.released.connect(self.slot_input_select)
@@ -97,6 +116,8 @@ class Main (QMainWindow):
         # multi file mode
         self.groupBoxInputs.hide()
         self.listWidgetInput.setDragDropMode(QAbstractItemView.InternalMove)
+        # otherwise adding items gets slower with every item
+        self.listWidgetInput.setUniformItemSizes(True)
         self.listWidgetInput.currentRowChanged.connect(self.slot_input_current_row_changed)
         self.pushButtonInputAdd.released.connect(self.slot_input_select)
         self.pushButtonInputDelete.released.connect(self.slot_input_delete)
@@ -113,8 +134,8 @@ class Main (QMainWindow):
         self.pushButtonAddTaskToQueue.released.connect(self.slot_add_task_to_queue)
         self.taskManager.statusMessage.connect(self.msg)
         self.taskManager.outputMessage.connect(self.out)
-        self.taskManager.outputClear.connect(self.plainTextEditOutput.clear)
-        self.taskManager._proc.errorOccurred.connect(self.slot_error_occurred)
+        self.taskManager.outputClear.connect(self._output.clear)
+        self.taskManager.errorOccurred.connect(self.slot_error_occurred)
         self.taskManager.pushButtonTaskAdd.released.connect(lambda: self.tabWidget.setCurrentIndex(0))
 
         self.setup_menu_actions()
@@ -123,9 +144,8 @@ class Main (QMainWindow):
         self.treeWidgetPresets.setContextMenuPolicy(Qt.CustomContextMenu)
         self.treeWidgetPresets.customContextMenuRequested.connect(self.slot_preset_context_menu)
 
-        # get available devices and codecs from ffmpeg
-        self.load_devices()
-        self.load_codecs()
+        # available devices and codecs, queried from ffmpeg when first needed
+        self._caps = FFmpegCapabilities(self)
 
         # load presets DB
         self._presets_db = sqlite3.connect(DATA_DIR + '/presets.db')
@@ -145,10 +165,15 @@ class Main (QMainWindow):
         if not res:
             sql = """
             CREATE TABLE presets(id INTEGER PRIMARY KEY, category_id INTEGER, name TEXT, desc TEXT, cmd TEXT,
-            ext TEXT NOT NULL DEFAULT '*', input_type INTEGER NOT NULL DEFAULT 0)
+            ext TEXT NOT NULL DEFAULT '*', input_type INTEGER NOT NULL DEFAULT 0, resources TEXT NOT NULL DEFAULT '')
             """
             c.execute(sql)
             self._presets_db.commit()
+        # add columns introduced by later versions
+        c.execute("PRAGMA table_info(presets)")
+        if not 'resources' in [row['name'] for row in c.fetchall()]:
+            c.execute("ALTER TABLE presets ADD COLUMN resources TEXT NOT NULL DEFAULT ''")
+            self._presets_db.commit()
         last_preset_id = int(self._state.value('LastSession/LastPreset', 0))
         self.load_presets(last_preset_id)
 
@@ -157,6 +182,11 @@ class Main (QMainWindow):
         self._preset_manager.message.connect(self.msg)
         self._preset_manager.error.connect(self.err)
 
+        # watch folders
+        self._watchFolders = WatchFolders(self.taskManager, self._presets_db)
+        self._watchFolders.statusMessage.connect(self.msg)
+        self._actions['actionWatchFolders'].triggered.connect(lambda: self._watchFolders.edit(self))
+
         # setup process
         self._proc = MyProcess()
         self._proc.readyReadStandardOutput.connect(self.slot_stdout)
@@ -180,14 +210,11 @@ class Main (QMainWindow):
                 d = DATA_DIR
         self.lineEditOutputFolder.setText(d)
 
-        # tcp server for ffmpeg progress updates
+        # progress bar for ffmpeg progress updates of the task run by the editor
         self._progressBar = QProgressBar(self.statusBar)
         self._progressBar.setAlignment(Qt.AlignHCenter)
         self.statusBar.addPermanentWidget(self._progressBar)
-        self._server = QTcpServer(self)
-        self._server.listen(QHostAddress.LocalHost, 9999)
-        self._server.newConnection.connect(self.slot_new_connection)
-        self._socket = None
+        self._taskProgress = None
 
         self.treeWidgetPresets.setFocus()
 
@@ -276,16 +303,10 @@ class Main (QMainWindow):
     #
     ########################################
     def select_preset (self, preset_id):
-        c = self._presets_db.cursor()
-        sql = """
-        SELECT presets.*,categories.name AS category FROM presets
-        LEFT JOIN categories ON presets.category_id=categories.id WHERE presets.id=?
-        """
-        c.execute(sql, (preset_id,))
-        preset = c.fetchone()
+        preset = get_preset(self._presets_db, preset_id)
         if preset is None:
             return
-        self._current_preset = dict(preset)
+        self._current_preset = preset
         self.lineEditPreset.setText(preset['name'])
 
         # test
@@ -293,11 +314,7 @@ class Main (QMainWindow):
         if layout:
             self.delete_layout(layout)
 
-        vars_found = []
-        for c in CONFIG_VARS:
-            flag = '$' + c.upper() in preset['cmd'] or '${' + c.upper() + '}' in preset['cmd']
-            if flag:
-                vars_found.append(c)
+        vars_found = get_config_vars(preset['cmd'])
 
         self._config_widgets = {}
         if vars_found:
@@ -337,6 +354,8 @@ class Main (QMainWindow):
         else:
             self.lineEditExtensions.setText('')
             self._supported_file_extensions = []
+        # folders are scanned for files supported by the previous preset
+        self.stop_input_scans()
         # check if currently selected file(s) are compatible with new preset
         if len(self._supported_file_extensions) > 0:
             if preset['input_type'] == INPUT_TYPE_FILES:
@@ -355,11 +374,8 @@ class Main (QMainWindow):
                     if IS_WIN and self.actionDarkTheme.isChecked():
                         windll.dwmapi.DwmSetWindowAttribute(int(dialog.winId()), 20, byref(c_int(1)), 4)
                     if dialog.exec() == QMessageBox.Yes:
-                        for i in range(cnt, 0, -1):
-                            row = unsupported[i]
-                            fn = self.listWidgetInput.item(row).text()
-                            del self._media_infos[fn]
-                            self.listWidgetInput.takeItem(row)
+                        for row in reversed(unsupported):
+                            self.remove_input_row(row)
             elif preset['input_type'] == INPUT_TYPE_FILE:
                 inputFile = self.lineEditInput.text()
                 if inputFile != '':
@@ -373,6 +389,7 @@ class Main (QMainWindow):
                         if dialog.exec() == QMessageBox.Yes:
                             self.lineEditInput.setText('')
                             self._media_infos = {}
+                            self._probes.clear()
         # update infos
         if self._current_preset['input_type'] == INPUT_TYPE_FILES:
             if len(self._media_infos.values()):
@@ -389,15 +406,16 @@ class Main (QMainWindow):
             self.plainTextEditInfos.setPlainText('')
         self.checkBoxOutputFolderInput.setEnabled(preset['input_type'] == INPUT_TYPE_FILE or
                 preset['input_type'] == INPUT_TYPE_FILES)
+        self.spinBoxChunks.setEnabled((preset['input_type'] == INPUT_TYPE_FILE or
+                preset['input_type'] == INPUT_TYPE_FILES) and can_chunk(preset['cmd']))
+        self.labelChunks.setEnabled(self.spinBoxChunks.isEnabled())
         self.lineEditOutputFolder.setEnabled(not self.checkBoxOutputFolderInput.isEnabled() or
                 not self.checkBoxOutputFolderInput.isChecked())
         self.pushButtonOutputFolder.setEnabled(not self.checkBoxOutputFolderInput.isEnabled() or
                 not self.checkBoxOutputFolderInput.isChecked())
         # enable/disable AddTask/run_task buttons according to preset's input type
-        if preset['input_type'] == INPUT_TYPE_FILE:
-            isIncomplete = self.lineEditInput.text() == ''
-        elif preset['input_type'] == INPUT_TYPE_FILES:
-            isIncomplete = self.listWidgetInput.count() == 0
+        if preset['input_type'] == INPUT_TYPE_FILE or preset['input_type'] == INPUT_TYPE_FILES:
+            isIncomplete = not self.is_input_probed()
         elif preset['input_type'] == INPUT_TYPE_URL:
             isIncomplete = not '://' in self.lineEditURL.text()
         elif preset['input_type'] == INPUT_TYPE_NONE:
@@ -419,10 +437,10 @@ class Main (QMainWindow):
             widget = QComboBox(self)
 
             if c == 'DeviceVideo':
-                for dev in self._devices_video:
+                for dev in self._caps.get('devices')['video']:
                     widget.addItem(dev)
             elif c == 'DeviceAudio':
-                for dev in self._devices_audio:
+                for dev in self._caps.get('devices')['audio']:
                     widget.addItem(dev)
 
             elif c == 'Container':
@@ -441,13 +459,13 @@ class Main (QMainWindow):
             elif c == 'CodecVideo':
                 widget.addItem('copy')
                 widget.insertSeparator(1)
-                for codec in self._codecs_video:
+                for codec in self._caps.get('encoders')['video']:
                     widget.addItem(codec)
 
             elif c == 'CodecAudio':
                 widget.addItem('copy')
                 widget.insertSeparator(1)
-                for codec in self._codecs_audio:
+                for codec in self._caps.get('encoders')['audio']:
                     widget.addItem(codec)
 
             elif c == 'Preset':
@@ -520,63 +538,6 @@ class Main (QMainWindow):
             self.treeWidgetPresets.setCurrentItem(selectedItem)
             self.select_preset(selectID)
 
-    ########################################
-    #
-    ########################################
-    def load_devices (self):
-        self._devices_video = []
-        self._devices_audio = []
-        if IS_WIN or IS_MAC:
-            task = Task('$FFMPEG -hide_banner -list_devices true -f dshow -i dummy'
-                    if IS_WIN else '$FFMPEG -hide_banner -list_devices true -f avfoundation -i /dev/null')
-            proc = QProcess()
-            task.run(proc)
-            proc.waitForFinished(-1)
-            lines = proc.readAllStandardError().data().decode(errors='ignore').rstrip().splitlines()
-            if IS_WIN:
-                re_vid = re.compile(r'^\[[^\]]*\] "(.*)" \(video\)')
-                re_aud = re.compile(r'^\[[^\]]*\] "(.*)" \(audio\)')
-                for line in lines:
-                    res = re.search(re_vid, line)
-                    if res:
-                        self._devices_video.append(res.group(1))
-                    res = re.search(re_aud, line)
-                    if res:
-                        self._devices_audio.append(res.group(1))
-            else:
-                re_dev = re.compile(r'^\[[^\]]*\] (.*)')
-                for line in lines:
-                    res = re.search(re_dev, line)
-                    if res:
-                        line = res.group(1)
-                        if line.startswith('AVFoundation video'):
-                            current_list = self._devices_video
-                        elif line.startswith('AVFoundation audio'):
-                            current_list = self._devices_audio
-                        elif line.startswith('['):
-                            current_list.append(line[line.index(']') + 2:])
-#        TODO: Linux
-#        else:
-#            $FFMPEG -hide_banner -list_devices true -f openal -i /dev/null
-#            [openal @ 0x55b9dc490e00] List of OpenAL capture devices on this system:
-#            [openal @ 0x55b9dc490e00]   ES1371/ES1373 / Creative Labs CT2518 (Audio PCI 64V/128/5200 / Creative CT4810/CT5803/CT5806 [Sound Blaster PCI]) Analog Stereo
-#            [openal @ 0x55b9dc490e00]   Monitor of ES1371/ES1373 / Creative Labs CT2518 (Audio PCI 64V/128/5200 / Creative CT4810/CT5803/CT5806 [Sound Blaster PCI]) Analog Stereo
-#            /dev/null: Immediate exit requested
-
-    ########################################
-    #
-    ########################################
-    def load_codecs (self):
-        task = Task('$FFMPEG -hide_banner -encoders')
-        proc = QProcess()
-        task.run(proc)
-        proc.waitForFinished(-1)
-        lines = proc.readAllStandardOutput().data().decode(errors='ignore').rstrip().splitlines()
-        lines = lines[lines.index(' ------') + 1:]
-#        print(lines)
-        self._codecs_video = list(sorted(l.split(' ')[2] for l in lines if l.startswith(' V')))
-        self._codecs_audio = list(sorted(l.split(' ')[2] for l in lines if l.startswith(' A')))
-
     ########################################
     # Connect menu actions
     ########################################
@@ -598,19 +559,6 @@ class Main (QMainWindow):
         self._actions['actionHelp'].triggered.connect(self.slot_help)
         self._actions['actionAbout'].triggered.connect(self.slot_about)
 
-    ########################################
-    # Sets environment variables for all binary modules in folder 'bin'
-    ########################################
-    def setup_tool_env_vars (self):
-        modules = os.listdir(BIN_DIR)
-        for m in modules:
-            if m.startswith('_'):
-                continue
-            p = BIN_DIR + '/' + m + '/' + m
-            if ' ' in p:
-                p = '"' + p + '"'
-            os.environ[m.upper()] = p
-
     ########################################
     # Single file mode - sets file
     ########################################
@@ -627,103 +575,149 @@ class Main (QMainWindow):
                     windll.dwmapi.DwmSetWindowAttribute(int(dialog.winId()), 20, byref(c_int(1)), 4)
                 if dialog.exec() != QMessageBox.Yes:
                     return False  # discard loading
-        info = self.get_mediainfo(fn)
-        if info is None:
-            return False
-        # activate buttons
-        self.pushButtonAddTaskToQueue.setDisabled(False)
-        self.pushButtonRunTask.setDisabled(False)
-        self._media_infos = {fn: info}
+        self._probes.clear()
+        self._media_infos = {}
         self.lineEditInput.setText(fn)
-        self.show_mediainfo(info)
+        self.plainTextEditInfos.setPlainText('Probing...')
+        self.update_input_buttons()
+        self._probes.probe(fn)
         return True
 
+    ########################################
+    # Multiple file mode - adds files and folders. Files with incompatible extensions
+    # are only added if the user confirms it (once for all of them), folders are
+    # scanned in the background for files with compatible extensions.
+    ########################################
+    def add_input_paths (self, paths):
+        exts = self._supported_file_extensions
+        files = {fn for fn in paths if os.path.isfile(fn)}
+        unsupported = {fn for fn in files if exts and os.path.splitext(fn)[1][1:] not in exts}
+        if unsupported:
+            dialog = QMessageBox(QMessageBox.Warning, 'Incompatible Extension',
+                    f'The extension of {len(unsupported)} selected file(s) is not compatible with current preset.\nAdd anyway?',
+                    QMessageBox.Yes | QMessageBox.No, self)
+            if IS_WIN and self.actionDarkTheme.isChecked():
+                windll.dwmapi.DwmSetWindowAttribute(int(dialog.winId()), 20, byref(c_int(1)), 4)
+            if dialog.exec() != QMessageBox.Yes:
+                files -= unsupported
+        paths = [p for p in paths if p in files or os.path.isdir(p)]
+        if paths:
+            self._input_scans.append(iter_input_files(paths, exts))
+            self._inputScanTimer.start()
+            self.update_input_buttons()
+
+    ########################################
+    # Adds the next files found by the input scans, for INPUT_SCAN_SLICE seconds at most
+    ########################################
+    def slot_input_scan (self):
+        deadline = time.monotonic() + INPUT_SCAN_SLICE
+        self.listWidgetInput.setUpdatesEnabled(False)
+        while self._input_scans and time.monotonic() < deadline:
+            try:
+                self.add_input_item(next(self._input_scans[0]))
+                self._input_scan_cnt += 1
+            except StopIteration:
+                self._input_scans.pop(0)
+        self.listWidgetInput.setUpdatesEnabled(True)
+        if self._input_scans:
+            self.msg(f'Adding input files... {self._input_scan_cnt}')
+        else:
+            self.msg(f'{self._input_scan_cnt} input file(s) added')
+            self.stop_input_scans()
+        self.update_input_buttons()
+
+    ########################################
+    #
+    ########################################
+    def stop_input_scans (self):
+        self._inputScanTimer.stop()
+        self._input_scans.clear()
+        self._input_scan_cnt = 0
+
     ########################################
     # Multiple file mode - adds file
     ########################################
     def add_input_item (self, fn):
-        if os.path.isfile(fn):
-            if len(self._supported_file_extensions) > 0:
-                ext = os.path.splitext(fn)[1][1:]
-                if not ext in self._supported_file_extensions:
-                    dialog = QMessageBox(QMessageBox.Warning, 'Incompatible Extension',
-                            'The selected file\'s extension is not compatible with current preset.\nAdd file anyway?',
-                            QMessageBox.Yes | QMessageBox.No, self)
-                    if IS_WIN and self.actionDarkTheme.isChecked():
-                        windll.dwmapi.DwmSetWindowAttribute(int(dialog.winId()), 20, byref(c_int(1)), 4)
-                    if dialog.exec() != QMessageBox.Yes:
-                        return False  # discard loading
-            self.listWidgetInput.addItem(fn)
-            info = self.get_mediainfo(fn)
+        # shown as probing until its infos arrive
+        item = QListWidgetItem(fn)
+        if fn not in self._media_infos:
+            font = item.font()
+            font.setItalic(True)
+            item.setFont(font)
+            item.setForeground(self.palette().color(QPalette.Disabled, QPalette.Text))
+            item.setToolTip('Probing...')
+            self._input_unprobed.add(fn)
+            self._probes.probe(fn)
+        self._input_items.setdefault(fn, []).append(item)
+        self.listWidgetInput.addItem(item)
+
+    ########################################
+    # Multiple file mode - removes the file in row
+    ########################################
+    def remove_input_row (self, row):
+        item = self.listWidgetInput.takeItem(row)
+        fn = item.text()
+        items = self._input_items.get(fn, [])
+        if item in items:
+            items.remove(item)
+        # the same file may have been added twice
+        if not items:
+            self._input_items.pop(fn, None)
+            self._input_unprobed.discard(fn)
+            self._media_infos.pop(fn, None)
+            self._probes.cancel(fn)
+
+    ########################################
+    # Stores the infos of a probed input file, files that couldn't be probed are removed
+    ########################################
+    def slot_media_probed (self, fn, info):
+        if info is None:
+            self.err(f'Probing "{fn}" failed')
+        if self.lineEditInput.text() == fn:
             if info is None:
-                return False
-            # activate buttons
-            self.pushButtonAddTaskToQueue.setDisabled(False)
-            self.pushButtonRunTask.setDisabled(False)
+                self.lineEditInput.setText('')
+                self.plainTextEditInfos.setPlainText('')
+            else:
+                self._media_infos[fn] = info
+                self.show_mediainfo(info)
+        self._input_unprobed.discard(fn)
+        if info is None:
+            for item in self._input_items.pop(fn, []):
+                self.listWidgetInput.takeItem(self.listWidgetInput.row(item))
+        for item in self._input_items.get(fn, []):
             self._media_infos[fn] = info
-        else:
-            l = os.listdir(fn)
-            for f in l:
-                self.add_input_item(fn + '/' + f)
-        return True
+            font = item.font()
+            font.setItalic(False)
+            item.setFont(font)
+            item.setData(Qt.ForegroundRole, None)
+            item.setToolTip('')
+            if item is self.listWidgetInput.currentItem():
+                self.show_mediainfo(info)
+        self.update_input_buttons()
 
     ########################################
-    # Returns media info as dict
+    # Returns True if all input files of the current preset were probed
     ########################################
-    def get_mediainfo (self, fn):
-        task = Task(f'$MEDIAINFO --Output=JSON "{fn}"')
-        proc = QProcess()
-        task.run(proc)
-        proc.waitForFinished(-1)
-        res = proc.readAllStandardOutput().data().decode(errors='ignore')
-        info = json.loads(res)['media']
-        info['general'] = info['track'][0]
-        del info['track'][0]
-        return info
+    def is_input_probed (self):
+        if self._current_preset['input_type'] == INPUT_TYPE_FILE:
+            return self.lineEditInput.text() in self._media_infos
+        return self.listWidgetInput.count() > 0 and not self._input_unprobed and not self._input_scans
 
     ########################################
-    # Creates and returns a new task based on current settings
+    # Enables Run Task/Add Task to Task Queue as soon as all input files were probed
     ########################################
-    def get_task (self):
+    def update_input_buttons (self):
+        if self._current_preset is None or self._current_preset['input_type'] not in (INPUT_TYPE_FILE, INPUT_TYPE_FILES):
+            return
+        isIncomplete = not self.is_input_probed()
+        self.pushButtonAddTaskToQueue.setDisabled(isIncomplete)
+        self.pushButtonRunTask.setDisabled(isIncomplete or self._proc.state() != QProcess.NotRunning)
+
+    ########################################
+    # Returns the variables of all config widgets
+    ########################################
+    def get_config_env (self):
         env = {}
-        if self._current_preset['input_type'] == INPUT_TYPE_FILE or self._current_preset['input_type'] == INPUT_TYPE_URL:
-            trackNum = self._config_widgets['Track'].value() if 'Track' in self._config_widgets else 0
-            if self._current_preset['input_type'] == INPUT_TYPE_FILE:
-                inputFile = self.lineEditInput.text()
-                f, ext = os.path.splitext(inputFile)
-                env['INPUT'] = inputFile
-                env['INPUTDIR'] = os.path.dirname(f)
-                env['INPUTBASENAME'] = os.path.basename(f).replace(' ', '_')
-                env['INPUTEXT'] = ext[1:]
-                # variables for tracks
-                tracks = list(self._media_infos.values())[0]['track']
-                for i in range(len(tracks)):
-                    track = tracks[i]
-                    if 'Format' in track:
-                        env['FORMAT' + str(i)] = track['Format']
-                    if 'FrameRate' in track:
-                        env['FPS' + str(i)] = float(track['FrameRate'])
-                # variables for currently selected track
-                track = tracks[trackNum]  # -1
-                if 'Format' in track:
-                    env['FORMAT'] = track['Format']
-            else:
-                env['URL'] = self.lineEditURL.text()
-            # arguments variables
-            if 'Track' in self._config_widgets:
-                env['TRACK'] = str(trackNum)  # -1
-        elif self._current_preset['input_type'] == INPUT_TYPE_FILES:
-            cnt = self.listWidgetInput.count()
-            if cnt==0:
-                return
-            env['CNT'] = str(cnt)
-            inputFile = self.listWidgetInput.item(0).text()
-            f, ext = os.path.splitext(inputFile)
-            env['INPUTEXT'] = ext[1:]
-            env['INPUTBASENAME'] = os.path.basename(f).replace(' ', '_')
-            for i in range(cnt):
-                inputFile = self.listWidgetInput.item(i).text()
-                env['INPUT' + str(i)] = inputFile
         # general variables
         # env['LANG'] = 'C.UTF-8'
 
@@ -760,19 +754,77 @@ class Main (QMainWindow):
             env['DEVICEVIDEO'] = self._config_widgets['DeviceVideo'].currentText() if IS_WIN else self._config_widgets['DeviceVideo'].currentIndex()
         if 'DeviceAudio' in self._config_widgets:
             env['DEVICEAUDIO'] = self._config_widgets['DeviceAudio'].currentText() if IS_WIN else self._config_widgets['DeviceAudio'].currentIndex()
+        return env
 
-        if self.checkBoxOutputFolderInput.isEnabled() and self.checkBoxOutputFolderInput.isChecked():
-            if self._current_preset['input_type'] == INPUT_TYPE_FILE:
-                env['OUTPUTDIR'] = os.path.dirname(self.lineEditInput.text())
-            elif self._current_preset['input_type'] == INPUT_TYPE_FILES: # multiple
-                env['OUTPUTDIR'] = os.path.dirname(self.listWidgetInput.item(0).text())
-        else:
+    ########################################
+    # Returns the variables set by the widgets: config vars, $TRACK and $OUTPUTDIR
+    # (unless the input folder is used)
+    ########################################
+    def get_task_overrides (self):
+        env = self.get_config_env()
+        if self._current_preset['input_type'] in (INPUT_TYPE_FILE, INPUT_TYPE_URL) and 'Track' in self._config_widgets:
+            env['TRACK'] = str(self._config_widgets['Track'].value())  # -1
+        if not (self.checkBoxOutputFolderInput.isEnabled() and self.checkBoxOutputFolderInput.isChecked()):
             env['OUTPUTDIR'] = self.lineEditOutputFolder.text()
-        env['TIMESTAMP'] = time.strftime("%Y%m%d_%H%M%S")
+        return env
+
+    ########################################
+    # Creates and returns a new task based on current settings
+    ########################################
+    def get_task (self):
+        if self._current_preset['input_type'] == INPUT_TYPE_FILE:
+            inputs = [self.lineEditInput.text()]
+            infos = [self._media_infos[inputs[0]]]
+        elif self._current_preset['input_type'] == INPUT_TYPE_URL:
+            inputs = [self.lineEditURL.text()]
+            infos = []
+        elif self._current_preset['input_type'] == INPUT_TYPE_FILES:
+            if self.listWidgetInput.count() == 0:
+                return
+            inputs = [self.listWidgetInput.item(i).text() for i in range(self.listWidgetInput.count())]
+            infos = [self._media_infos[fn] for fn in inputs]
+        else:
+            inputs = infos = []
+        env = build_task_env(self._current_preset, inputs, infos, self.get_task_overrides())
         task = Task(self.plainTextEditCommandLine.toPlainText().strip(' \t\n'), env,
                 self._current_preset['name'])
+        task.resources = self.get_resources(task.code)
+        task.preset = self._current_preset['name'].strip()
+        task.duration = get_media_duration(infos, env)
         return task
 
+    ########################################
+    # Returns the resources declared by the current preset, or guessed from the code
+    ########################################
+    def get_resources (self, code):
+        if self._current_preset['resources'] != '':
+            return parse_resources(self._current_preset['resources'])
+        return guess_resources(code, self._current_preset['input_type'])
+
+    ########################################
+    # Creates and returns a list of new tasks based on current settings.
+    # In multiple files mode with "one task per file" checked, each input file
+    # gets its own task, which sees itself as the only input ($CNT=1, $INPUT0)
+    # and in addition has the single file variables ($INPUT, $INPUTDIR etc.).
+    ########################################
+    def get_tasks (self):
+        if not (self._current_preset['input_type'] == INPUT_TYPE_FILES and self.checkBoxSplitTasks.isChecked()):
+            task = self.get_task()
+            return [task] if task is not None else []
+        tasks = []
+        code = self.plainTextEditCommandLine.toPlainText().strip(' \t\n')
+        overrides = self.get_task_overrides()
+        resources = self.get_resources(code)
+        for i in range(self.listWidgetInput.count()):
+            inputFile = self.listWidgetInput.item(i).text()
+            env = build_task_env(self._current_preset, [inputFile], [self._media_infos[inputFile]], overrides)
+            task = Task(code, env, f'{self._current_preset["name"]} ({os.path.basename(inputFile)})')
+            task.resources = resources
+            task.preset = self._current_preset['name'].strip()
+            task.duration = get_media_duration([self._media_infos[inputFile]], env)
+            tasks.append(task)
+        return tasks
+
     ########################################
     #
     ########################################
@@ -783,6 +835,10 @@ class Main (QMainWindow):
             self._taskBarProgress.setValue(0)
             self._taskBarProgress.setVisible(True)
 
+        self._logFile = open_log_file(task)
+        self._taskProgress = TaskProgress(task.duration, self)
+        self._taskProgress.progress.connect(self.slot_task_progress)
+        task.progress_url = self._taskProgress.url
         task.run(self._proc)
 
     ########################################
@@ -871,8 +927,18 @@ class Main (QMainWindow):
     # Appends text to Output Log
     ########################################
     def out (self, s):
-        self.plainTextEditOutput.appendPlainText(s)
-        self.plainTextEditOutput.ensureCursorVisible()
+        self._output.write(s)
+
+    ########################################
+    # Output Log context menu, with access to the complete log of the editor's last task
+    ########################################
+    def slot_output_context_menu (self, p):
+        m = self.plainTextEditOutput.createStandardContextMenu()
+        m.addSeparator()
+        action = m.addAction('Show Editor Task &Log...')
+        action.setEnabled(os.path.isfile(EDITOR_LOG_FILE))
+        action.triggered.connect(lambda: LogViewer(EDITOR_LOG_FILE, 'Editor', self).show())
+        m.exec_(self.plainTextEditOutput.mapToGlobal(p))
 
     ########################################
     #
@@ -901,13 +967,12 @@ class Main (QMainWindow):
     def dropEvent (self, e):
         if self._current_preset and (self._current_preset['input_type'] == INPUT_TYPE_URL or self._current_preset['input_type'] == INPUT_TYPE_NONE):
             return
-        for u in e.mimeData().urls():
-            fn = u.toLocalFile()
-            if self._current_preset and self._current_preset['input_type'] == INPUT_TYPE_FILE:
-                self.set_input_item(fn)
-                break
-            else:
-                self.add_input_item(fn)
+        paths = [u.toLocalFile() for u in e.mimeData().urls()]
+        if self._current_preset and self._current_preset['input_type'] == INPUT_TYPE_FILE:
+            if paths:
+                self.set_input_item(paths[0])
+        else:
+            self.add_input_paths(paths)
 
     ########################################
     #
@@ -945,15 +1010,16 @@ class Main (QMainWindow):
     #
     ########################################
     def slot_stdout (self):
-        s = self._proc.readAllStandardOutput().data().decode(errors='ignore').strip(' \n\r')
+        data = self._proc.readAllStandardOutput().data()
+        self.write_log(data)
+        s = data.decode(errors='ignore').strip(' \n\r')
 
         # remove false UTF-8 BOM (needed for AtomicParsely)
 #        if s.startswith('ï»¿'):
 #            s = s[3:]
 
-        for l in s.splitlines():
-            l = l.strip()
-            self.out(l)
+        lines = [l.strip() for l in s.splitlines()]
+        for l in lines:
             try:
                 prog = int(l.split()[1][:-1])
                 self._progressBar.setValue(prog)
@@ -961,6 +1027,8 @@ class Main (QMainWindow):
                     self._taskBarProgress.setValue(prog)
             except:
                 pass
+        if lines:
+            self.out('\n'.join(lines))
 
        # self.out(s)
 
@@ -968,14 +1036,33 @@ class Main (QMainWindow):
     #
     ########################################
     def slot_stderr (self):
-        s = self._proc.readAllStandardError().data().decode(errors='ignore').strip(' \n\r')
+        data = self._proc.readAllStandardError().data()
+        self.write_log(data)
+        s = data.decode(errors='ignore').strip(' \n\r')
         self.out(s)
 
+    ########################################
+    # Writes output of the task run by the editor to its log file
+    ########################################
+    def write_log (self, data):
+        if self._logFile is not None:
+            try:
+                self._logFile.write(data)
+            except OSError:
+                pass
+
     ########################################
     #
     ########################################
     def slot_complete (self, exitCode, exitStatus):
         self._task = None
+        if self._taskProgress is not None:
+            self._taskProgress.close()
+            self._taskProgress.deleteLater()
+            self._taskProgress = None
+        if self._logFile is not None:
+            self._logFile.close()
+            self._logFile = None
         if exitCode == 0:
             msg = 'Task successfully executed'
         else:
@@ -986,6 +1073,8 @@ class Main (QMainWindow):
         self.out('\nDone.')
         self.pushButtonRunTask.setDisabled(False)
         self.pushButtonStopTask.setDisabled(True)
+        # inputs added while the task was running may not be probed yet
+        self.update_input_buttons()
 
 #        time.sleep(0.25)
 #        self._progressBar.reset()
@@ -993,7 +1082,8 @@ class Main (QMainWindow):
 #            self._taskBarProgress.setVisible(False)
 
         QTimer.singleShot(500, lambda:
-            self._progressBar.reset() or (self._taskBarProgress.setVisible(False) if IS_WIN else None))
+            self._progressBar.reset() or self._progressBar.setFormat('%p%') or
+            (self._taskBarProgress.setVisible(False) if IS_WIN else None))
 
     ########################################
     #
@@ -1004,8 +1094,10 @@ class Main (QMainWindow):
             self.plainTextEditInfos.setPlainText('')
         else:
             fn = self.listWidgetInput.item(row).text()
-            info = self._media_infos[fn]
-            self.show_mediainfo(info)
+            if fn in self._media_infos:
+                self.show_mediainfo(self._media_infos[fn])
+            else:
+                self.plainTextEditInfos.setPlainText('Probing...')
 
     ########################################
     #
@@ -1026,8 +1118,7 @@ class Main (QMainWindow):
             self.set_input_item(os.path.normpath(fn))
         else:
             resList, _ = QFileDialog.getOpenFileNames(self, 'Add Input Files', DATA_DIR, fltr)
-            for fn in resList:
-                self.add_input_item(os.path.normpath(fn))
+            self.add_input_paths([os.path.normpath(fn) for fn in resList])
 
     ########################################
     #
@@ -1035,19 +1126,18 @@ class Main (QMainWindow):
     def slot_input_delete (self):
         row = self.listWidgetInput.currentRow()
         if row >= 0:
-            fn = self.listWidgetInput.item(row).text()
-            del self._media_infos[fn]
-            self.listWidgetInput.takeItem(row)
-            if self.listWidgetInput.count() == 0:
-                # deactivate buttons
-                self.pushButtonAddTaskToQueue.setDisabled(True)
-                self.pushButtonRunTask.setDisabled(True)
+            self.remove_input_row(row)
+            self.update_input_buttons()
 
     ########################################
     #
     ########################################
     def slot_input_clear (self):
+        self.stop_input_scans()
         self._media_infos = {}
+        self._input_items = {}
+        self._input_unprobed = set()
+        self._probes.clear()
         self.listWidgetInput.clear()
         # deactivate buttons
         self.pushButtonAddTaskToQueue.setDisabled(True)
@@ -1075,7 +1165,7 @@ class Main (QMainWindow):
     ########################################
     def slot_run_task (self):
         self.msg('')
-        self.plainTextEditOutput.clear()
+        self._output.clear()
         self.pushButtonRunTask.setDisabled(True)
         self.pushButtonStopTask.setDisabled(False)
         self._task = self.get_task()
@@ -1096,6 +1186,8 @@ class Main (QMainWindow):
     ########################################
     def slot_quit (self):
         self.slot_stop_task()
+        self._caps.stop()
+        self._watchFolders.quit()
         self.taskManager.quit()
         # save LastPreset
         if self._current_preset is not None:
@@ -1307,42 +1399,36 @@ class Main (QMainWindow):
         self._preset_manager.show(None, cat_id)
 
     ########################################
-    #
-    ########################################
-    def slot_new_connection (self):
-        if self._socket is not None:
-            self._socket.close()
-        self._socket = self._server.nextPendingConnection()
-        self._socket.readyRead.connect(self.slot_socket_ready_read)
-
+    # Shows the ffmpeg progress of the task run by the editor, based on its own media duration
     ########################################
-    #
-    ########################################
-    def slot_socket_ready_read (self):
-        s = self._socket.readAll().data().decode(errors='ignore')
-        res = re.search('progress=([a-z]*)', s)
-        if res is not None and res.group(1) == 'end':
+    def slot_task_progress (self, info):
+        if info['end']:
             self._progressBar.setValue(100)
             if IS_WIN:
                 self._taskBarProgress.setValue(100)
-            time.sleep(0.25)
-            self._progressBar.reset()
+            QTimer.singleShot(250, lambda:
+                self._progressBar.reset() or self._progressBar.setFormat('%p%') or
+                (self._taskBarProgress.setVisible(False) if IS_WIN else None))
+        elif self._task is not None and self._task.duration and 'out_time' in info:
+            prog = min(100, int(info['out_time'] / self._task.duration * 100))
+            extra = format_progress(info)
+            self._progressBar.setFormat(f'%p% ({extra})' if extra else '%p%')
+            self._progressBar.setValue(prog)
             if IS_WIN:
-                self._taskBarProgress.setVisible(False)
-        elif self._duration > 0:
-            res = re.search('out_time_ms=([0-9]*)', s)
-            if res is not None:
-                prog = int(int(res.group(1)) / self._duration / 10)
-                self._progressBar.setValue(prog)
-                if IS_WIN:
-                    self._taskBarProgress.setValue(prog)
-                    self._taskBarProgress.setVisible(True)
+                self._taskBarProgress.setValue(prog)
+                self._taskBarProgress.setVisible(True)
 
     ########################################
     #
     ########################################
     def slot_add_task_to_queue (self):
-        self.taskManager.add_task(self.get_task())
+        tasks = self.get_tasks()
+        chunks = self.spinBoxChunks.value() if self.spinBoxChunks.isEnabled() else 1
+        if chunks > 1:
+            # only single file tasks can be chunked
+            tasks = [t for task in tasks for t in (get_chunk_tasks(task, self._media_infos.get(task.env['INPUT']), chunks)
+                    if 'INPUT' in task.env else [task])]
+        self.taskManager.add_tasks(tasks)
         self.tabWidget.setCurrentIndex(1)
 
 
@@ -1352,6 +1438,15 @@ class Main (QMainWindow):
 if __name__ == '__main__':
     import traceback
     sys.excepthook = traceback.print_exception
+    if '--run-preset' in sys.argv:
+        from batch import run_batch
+        sys.exit(run_batch(sys.argv[1:]))
+    if '--agent' in sys.argv:
+        from agent import run_agent
+        sys.exit(run_agent(sys.argv[1:]))
+    if '--probe-benchmark' in sys.argv:
+        from probebench import run_probe_benchmark
+        sys.exit(run_probe_benchmark(sys.argv[1:]))
     QApplication.setAttribute(Qt.AA_EnableHighDpiScaling)
     app = QApplication(sys.argv)
     main = Main()
@@ -0,0 +1,173 @@
+"""
+QMediaTool - MediaCache class
+
+Caches the media infos of probed files in a SQLite DB, so files aren't probed
+again in every session. Entries are keyed by the file's real path, size and
+modification time and by the probe tool (its binary's size and modification
+time), so changed files and tool updates cause a new probe. Infos of either probe
+engine are returned, they're alike. The least recently used entries are evicted
+when the cache exceeds MEDIA_CACHE_MAX_BYTES.
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+from const import *
+from taskenv import get_base_env
+
+_cache = None
+
+
+########################################
+# Returns an id of the tool (name of a module in folder 'bin') that changes when it's updated
+########################################
+def get_tool_id (name):
+    path = get_base_env().get(name.upper(), '').strip('"')
+    for p in (path, path + '.exe'):
+        try:
+            st = os.stat(p)
+            return f'{name}:{st.st_size}:{st.st_mtime_ns}'
+        except OSError:
+            pass
+    return name
+
+
+########################################
+# Returns the shared media info cache
+########################################
+def get_media_cache ():
+    global _cache
+    if _cache is None:
+        _cache = MediaCache(DATA_DIR + '/mediacache.db')
+    return _cache
+
+
+class MediaCache():
+
+    def __init__ (self, db_file):
+        # tool name => tool id
+        self._tools = {}
+        try:
+            self._db = sqlite3.connect(db_file, timeout=5)
+            self._db.row_factory = sqlite3.Row
+            c = self._db.cursor()
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            sql = """
+            CREATE TABLE IF NOT EXISTS media(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,
+            tool TEXT, info TEXT, used REAL)
+            """
+            c.execute(sql)
+            c.execute("CREATE INDEX IF NOT EXISTS media_used ON media(used)")
+            self._db.commit()
+            c.execute("SELECT TOTAL(LENGTH(info)) FROM media")
+            self._bytes = int(c.fetchone()[0])
+        except sqlite3.Error:
+            # e.g. read-only app folder, files are always probed then
+            self._db = None
+
+    ########################################
+    # Returns the cached media info of file fn, or None if there's none (or it's outdated)
+    ########################################
+    def get (self, fn):
+        return self.get_many([fn]).get(fn)
+
+    ########################################
+    # Returns a dict file name => cached media info for those of files fns that have
+    # one, their entries are marked as used in a single transaction
+    ########################################
+    def get_many (self, fns):
+        infos = {}
+        if self._db is None:
+            return infos
+        used = []
+        c = self._db.cursor()
+        sql = "SELECT tool, info FROM media WHERE path=? AND size=? AND mtime_ns=?"
+        for fn in fns:
+            try:
+                path = os.path.realpath(fn)
+                st = os.stat(path)
+                c.execute(sql, (path, st.st_size, st.st_mtime_ns))
+                row = c.fetchone()
+                if row is None or row['tool'] != self.get_tool(row['tool'].split(':')[0]):
+                    continue
+                infos[fn] = json.loads(row['info'])
+                used.append(path)
+            except (OSError, sqlite3.Error, ValueError):
+                pass
+        if used:
+            try:
+                now = time.time()
+                c.executemany("UPDATE media SET used=? WHERE path=?", [(now, path) for path in used])
+                self._db.commit()
+            except sqlite3.Error:
+                pass
+        return infos
+
+    ########################################
+    # Returns the id of tool name, determined once per session
+    ########################################
+    def get_tool (self, name):
+        if name not in self._tools:
+            self._tools[name] = get_tool_id(name)
+        return self._tools[name]
+
+    ########################################
+    # Stores media info info of file fn, probed with tool name
+    ########################################
+    def put (self, fn, info, tool):
+        self.put_many([(fn, info, tool)])
+
+    ########################################
+    # Stores entries, a list of (file name, media info, tool name), in a single transaction
+    ########################################
+    def put_many (self, entries):
+        if self._db is None:
+            return
+        c = self._db.cursor()
+        sql = "INSERT OR REPLACE INTO media(path, size, mtime_ns, tool, info, used) VALUES(?,?,?,?,?,?)"
+        for fn, info, tool in entries:
+            try:
+                path = os.path.realpath(fn)
+                st = os.stat(path)
+                data = json.dumps(info, separators=(',', ':'))
+                c.execute("SELECT LENGTH(info) FROM media WHERE path=?", (path,))
+                row = c.fetchone()
+                c.execute(sql, (path, st.st_size, st.st_mtime_ns, self.get_tool(tool), data, time.time()))
+                self._bytes += len(data) - (row[0] if row else 0)
+            except (OSError, sqlite3.Error):
+                pass
+        try:
+            if self._bytes > MEDIA_CACHE_MAX_BYTES:
+                self.evict(c)
+            self._db.commit()
+        except sqlite3.Error:
+            pass
+
+    ########################################
+    # Deletes the least recently used entries until the cache is at 90% of its size cap
+    ########################################
+    def evict (self, c):
+        while self._bytes > MEDIA_CACHE_MAX_BYTES * 0.9:
+            c.execute("SELECT path, LENGTH(info) AS len FROM media ORDER BY used LIMIT 100")
+            rows = c.fetchall()
+            if not rows:
+                self._bytes = 0
+                break
+            paths = []
+            for row in rows:
+                paths.append((row['path'],))
+                self._bytes -= row['len']
+                if self._bytes <= MEDIA_CACHE_MAX_BYTES * 0.9:
+                    break
+            c.executemany("DELETE FROM media WHERE path=?", paths)
+
+    ########################################
+    #
+    ########################################
+    def close (self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,409 @@
+"""
+QMediaTool - media probing
+
+MediaProbePool probes files in the background, a few at a time, so adding many
+files (or files on slow or hung network shares) doesn't block the GUI. Results
+are kept in the MediaCache, which a thread of the pool looks files up in and
+stores results in, in batches. This stats the files, which can block too.
+
+Files are probed by a probe engine, "mediainfo" or "ffprobe" ($QMT_PROBE, see
+PROBE_ENGINE), the other one serves as fallback if the tool is missing or fails
+for a file. Both engines return media infos in MediaInfo's layout, reduced to
+the fields QMediaTool uses:
+
+    {'general': {'Format': ..., 'Duration': ...},
+     'track': [{'@type': ..., 'ID': ..., 'Format': ..., 'Format_Info': ..., 'FrameRate': ...}, ...]}
+
+ffprobe only outputs these fields (-show_entries), its names for formats and
+codecs are mapped to MediaInfo's, so presets testing $FORMAT work with both.
+Run "python3 main.py --probe-benchmark" to compare the engines.
+"""
+
+import json
+import queue
+import shlex
+import threading
+import time
+
+from PyQt5.QtCore import QObject, QProcess, QTimer, pyqtSignal
+
+from const import *
+from task import Task
+from taskenv import get_base_env
+from mediacache import MediaCache, get_media_cache
+
+# fields of the media infos that are kept
+GENERAL_FIELDS = ('Format', 'Duration')
+TRACK_FIELDS = ('@type', 'ID', 'Format', 'Format_Info', 'FrameRate')
+
+# ffprobe's codec types, container and codec names => MediaInfo's
+FFPROBE_TYPES = {'video': 'Video', 'audio': 'Audio', 'subtitle': 'Text'}
+FFPROBE_CONTAINERS = {
+    'mov': 'MPEG-4', 'matroska': 'Matroska', 'avi': 'AVI', 'asf': 'Windows Media', 'flv': 'Flash Video',
+    'mpegts': 'MPEG-TS', 'mpeg': 'MPEG-PS', 'mp3': 'MPEG Audio', 'aac': 'ADTS', 'wav': 'Wave',
+    'aiff': 'AIFF', 'flac': 'FLAC', 'ogg': 'Ogg', 'mxf': 'MXF', 'image2': 'Image', 'png_pipe': 'PNG',
+    'jpeg_pipe': 'JPEG', 'gif': 'GIF',
+}
+FFPROBE_CODECS = {
+    'h264': 'AVC', 'hevc': 'HEVC', 'av1': 'AV1', 'vp8': 'VP8', 'vp9': 'VP9', 'mpeg4': 'MPEG-4 Visual',
+    'mpeg2video': 'MPEG Video', 'mpeg1video': 'MPEG Video', 'prores': 'ProRes', 'dnxhd': 'VC-3',
+    'mjpeg': 'JPEG', 'png': 'PNG', 'gif': 'GIF', 'theora': 'Theora', 'ffv1': 'FFV1',
+    'aac': 'AAC', 'mp3': 'MPEG Audio', 'mp2': 'MPEG Audio', 'ac3': 'AC-3', 'eac3': 'E-AC-3',
+    'dts': 'DTS', 'truehd': 'MLP FBA', 'flac': 'FLAC', 'alac': 'ALAC', 'opus': 'Opus',
+    'vorbis': 'Vorbis', 'subrip': 'UTF-8', 'ass': 'ASS', 'mov_text': 'Timed Text',
+    'hdmv_pgs_subtitle': 'PGS', 'dvd_subtitle': 'VobSub',
+}
+
+
+########################################
+# Returns the frame rate as float of a fraction like "30000/1001", or None
+########################################
+def get_frame_rate (s):
+    try:
+        num, _, den = s.partition('/')
+        return float(num) / float(den or 1)
+    except (AttributeError, ValueError, ZeroDivisionError):
+        return None
+
+
+class ProbeEngine ():
+
+    # name of the engine and of its tool (module in folder 'bin')
+    name = ''
+
+    ########################################
+    # True if the engine's tool is there
+    ########################################
+    def is_available (self):
+        return self.name.upper() in get_base_env()
+
+    ########################################
+    # Starts probing file fn in proc
+    ########################################
+    def start_probe (self, fn, proc):
+        Task(self.get_code(), get_probe_env(fn)).run(proc)
+
+    ########################################
+    # Returns the task code that probes file $PROBEFILE
+    ########################################
+    def get_code (self):
+        raise NotImplementedError
+
+    ########################################
+    # Returns media info as dict, parsed from the tool's output. Raises ValueError,
+    # KeyError, IndexError or TypeError if the output isn't valid.
+    ########################################
+    def parse (self, output):
+        raise NotImplementedError
+
+
+class MediaInfoEngine (ProbeEngine):
+
+    name = 'mediainfo'
+
+    ########################################
+    #
+    ########################################
+    def get_code (self):
+        return '$MEDIAINFO --Output=JSON $PROBEFILE'
+
+    ########################################
+    #
+    ########################################
+    def parse (self, output):
+        tracks = json.loads(output)['media']['track']
+        return {
+            'general': {k: tracks[0][k] for k in GENERAL_FIELDS if k in tracks[0]},
+            'track': [{k: t[k] for k in TRACK_FIELDS if k in t} for t in tracks[1:]],
+        }
+
+
+class FFprobeEngine (ProbeEngine):
+
+    name = 'ffprobe'
+
+    ########################################
+    #
+    ########################################
+    def get_code (self):
+        return ('$FFPROBE -v error -of json -show_entries format=format_name,duration:'
+                'stream=index,codec_type,codec_name,codec_long_name,avg_frame_rate,r_frame_rate:'
+                'stream_disposition=attached_pic $PROBEFILE')
+
+    ########################################
+    #
+    ########################################
+    def parse (self, output):
+        data = json.loads(output)
+        fmt = data['format']
+        # e.g. "mov,mp4,m4a,3gp,3g2,mj2"
+        name = fmt['format_name'].split(',')[0]
+        general = {'Format': FFPROBE_CONTAINERS.get(name, name)}
+        if fmt.get('duration', 'N/A') != 'N/A':
+            general['Duration'] = fmt['duration']
+        tracks = []
+        for stream in data.get('streams', []):
+            # cover art
+            if stream.get('disposition', {}).get('attached_pic'):
+                continue
+            track = {'@type': FFPROBE_TYPES.get(stream.get('codec_type'), 'Other'), 'ID': str(stream['index'] + 1)}
+            codec = stream.get('codec_name')
+            if codec:
+                track['Format'] = 'PCM' if codec.startswith('pcm_') else FFPROBE_CODECS.get(codec, codec.upper())
+                if 'codec_long_name' in stream:
+                    track['Format_Info'] = stream['codec_long_name']
+            if track['@type'] == 'Video':
+                fps = get_frame_rate(stream.get('avg_frame_rate')) or get_frame_rate(stream.get('r_frame_rate'))
+                if fps:
+                    track['FrameRate'] = f'{fps:.3f}'
+            tracks.append(track)
+        return {'general': general, 'track': tracks}
+
+
+ENGINES = {e.name: e for e in (MediaInfoEngine(), FFprobeEngine())}
+
+
+########################################
+# Returns the task variables for probing file fn. Files can come from watch folders
+# or folder scans, so the name is shell-quoted: it must neither run as command nor
+# have $VARs in it expanded.
+########################################
+def get_probe_env (fn):
+    return {'PROBEFILE': shlex.quote(fn)}
+
+
+########################################
+# Returns the available probe engines, preferred one first
+########################################
+def get_probe_engines ():
+    engines = sorted(ENGINES.values(), key=lambda e: e.name != PROBE_ENGINE)
+    return [e for e in engines if e.is_available()] or engines[:1]
+
+
+########################################
+# Returns media info as dict. Raises OSError if probing timed out, and the error of
+# the last engine if all failed.
+########################################
+def get_mediainfo (fn):
+    info = get_media_cache().get(fn)
+    if info is not None:
+        return info
+    error = None
+    for engine in get_probe_engines():
+        proc = QProcess()
+        engine.start_probe(fn, proc)
+        if not proc.waitForFinished(PROBE_TIMEOUT * 1000):
+            proc.kill()
+            proc.waitForFinished(1000)
+            raise OSError(f'Probing {fn} timed out')
+        try:
+            info = engine.parse(proc.readAllStandardOutput().data().decode(errors='ignore'))
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            error = e
+            continue
+        get_media_cache().put(fn, info, engine.name)
+        return info
+    raise error
+
+
+class MediaProbePool (QObject):
+
+    # file name, media info or None if probing failed or timed out
+    probed = pyqtSignal(str, object)
+    # emitted by the cache thread, list of (file name, cached media info or None)
+    lookedUp = pyqtSignal(object)
+
+    ########################################
+    #
+    ########################################
+    def __init__ (self, jobs=PROBE_JOBS, parent=None):
+        super().__init__(parent)
+        self._jobs = jobs
+        # files waiting, in order (dict as ordered set)
+        self._queue = {}
+        # process => (file name, start time, engines left to try)
+        self._running = {}
+        # files looked up in the cache (dict as ordered set)
+        self._lookups = {}
+        # cache thread and its queue of lookups and results to store, (file name, info, tool),
+        # info is None for lookups
+        self._cacheThread = None
+        self._cacheQueue = queue.Queue()
+        self.lookedUp.connect(self.slot_looked_up)
+
+        # kills probes that hang, e.g. on unreachable network shares
+        self._watchdog = QTimer(self)
+        self._watchdog.setInterval(1000)
+        self._watchdog.timeout.connect(self.slot_watchdog)
+
+    ########################################
+    #
+    ########################################
+    def probe (self, fn):
+        if self.is_probing(fn):
+            return
+        self._lookups[fn] = None
+        self.queue_cache_job(fn, None, None)
+
+    ########################################
+    #
+    ########################################
+    def queue_cache_job (self, fn, info, tool):
+        self._cacheQueue.put((fn, info, tool))
+        if self._cacheThread is None:
+            self._cacheThread = threading.Thread(target=self.cache_loop, daemon=True)
+            self._cacheThread.start()
+
+    ########################################
+    #
+    ########################################
+    def is_running (self, fn):
+        return any(f == fn for f, _, _ in self._running.values())
+
+    ########################################
+    # True if fn is waiting or being probed
+    ########################################
+    def is_probing (self, fn):
+        return fn in self._lookups or fn in self._queue or self.is_running(fn)
+
+    ########################################
+    # Stops probing fn, its result isn't reported
+    ########################################
+    def cancel (self, fn):
+        self._lookups.pop(fn, None)
+        self._queue.pop(fn, None)
+        for proc, (f, _, _) in list(self._running.items()):
+            if f == fn:
+                self.stop(proc)
+        self.run_next()
+
+    ########################################
+    # Stops probing all files
+    ########################################
+    def clear (self):
+        self._lookups.clear()
+        self._queue.clear()
+        for proc in list(self._running):
+            self.stop(proc)
+
+    ########################################
+    #
+    ########################################
+    def stop (self, proc):
+        del self._running[proc]
+        proc.finished.disconnect(self.slot_finished)
+        proc.errorOccurred.disconnect(self.slot_error_occurred)
+        if proc.state() == QProcess.NotRunning:
+            proc.deleteLater()
+        else:
+            # not waited for, deleted once it has finished
+            proc.finished.connect(proc.deleteLater)
+            proc.kill()
+
+    ########################################
+    #
+    ########################################
+    def run_next (self):
+        while self._queue and len(self._running) < self._jobs:
+            fn = next(iter(self._queue))
+            del self._queue[fn]
+            self.start(fn, get_probe_engines())
+        if self._running:
+            self._watchdog.start()
+        else:
+            self._watchdog.stop()
+
+    ########################################
+    # Starts probing fn with the first of engines
+    ########################################
+    def start (self, fn, engines):
+        proc = QProcess(self)
+        proc.finished.connect(self.slot_finished)
+        proc.errorOccurred.connect(self.slot_error_occurred)
+        self._running[proc] = (fn, time.time(), engines)
+        engines[0].start_probe(fn, proc)
+
+    ########################################
+    #
+    ########################################
+    def probe_complete (self, proc, info):
+        fn, _, engines = self._running.pop(proc)
+        proc.deleteLater()
+        if info is None and len(engines) > 1:
+            self.start(fn, engines[1:])
+            return
+        if info is not None:
+            self.queue_cache_job(fn, info, engines[0].name)
+        self.run_next()
+        self.probed.emit(fn, info)
+
+    ########################################
+    # Runs in the cache thread: stores and looks up the queued files, in batches of up
+    # to MEDIA_CACHE_BATCH files. Stat'ing files on hung network shares can block, it
+    # must not happen in the GUI thread. The thread has its own DB connection.
+    ########################################
+    def cache_loop (self):
+        cache = MediaCache(DATA_DIR + '/mediacache.db')
+        while True:
+            jobs = [self._cacheQueue.get()]
+            while len(jobs) < MEDIA_CACHE_BATCH and not self._cacheQueue.empty():
+                jobs.append(self._cacheQueue.get())
+            cache.put_many([job for job in jobs if job[1] is not None])
+            fns = [fn for fn, info, _ in jobs if info is None]
+            if not fns:
+                continue
+            infos = cache.get_many(fns)
+            try:
+                self.lookedUp.emit([(fn, infos.get(fn)) for fn in fns])
+            except RuntimeError:
+                # the pool was deleted
+                break
+        cache.close()
+
+    ########################################
+    # Reports cached infos, and queues the other files for probing
+    ########################################
+    def slot_looked_up (self, results):
+        for fn, info in results:
+            if fn not in self._lookups:
+                # canceled meanwhile
+                continue
+            del self._lookups[fn]
+            if info is not None:
+                self.probed.emit(fn, info)
+            else:
+                self._queue[fn] = None
+        self.run_next()
+
+    ########################################
+    #
+    ########################################
+    def slot_finished (self, exitCode, exitStatus):
+        proc = self.sender()
+        if proc not in self._running:
+            return
+        engine = self._running[proc][2][0]
+        try:
+            info = engine.parse(proc.readAllStandardOutput().data().decode(errors='ignore'))
+        except (ValueError, KeyError, IndexError, TypeError):
+            info = None
+        self.probe_complete(proc, info)
+
+    ########################################
+    # A process that failed to start never emits 'finished'
+    ########################################
+    def slot_error_occurred (self, err):
+        proc = self.sender()
+        if err == QProcess.FailedToStart and proc in self._running:
+            self.probe_complete(proc, None)
+
+    ########################################
+    #
+    ########################################
+    def slot_watchdog (self):
+        now = time.time()
+        for proc, (fn, started, engines) in list(self._running.items()):
+            if now - started > PROBE_TIMEOUT:
+                # reported as failed by slot_finished, without fallback (the file is what hangs)
+                self._running[proc] = (fn, started, engines[:1])
+                proc.kill()
@@ -2,12 +2,24 @@
 QMediaTool - MyProcess class
 """
 
-from PyQt5.QtCore import QProcess
+import os
+import signal
+
+from PyQt5.QtCore import QProcess, QTimer
 
 
 class MyProcess (QProcess):
 
+    def __init__ (self, parent=None):
+        super().__init__(parent)
+        self.paused = False
+        self._stopping = False
+        # the process may be reused for another task before the stop timeout
+        self.started.connect(self.slot_started)
+
     def kill (self):
+        if self.paused:
+            self.resume()
         if 'ffmpeg' in self.program() or 'bash' in self.program():
             # exit cleanly by sending 'q'
             self.write(b'q')
@@ -18,3 +30,79 @@ class MyProcess (QProcess):
         else:
             super().kill()
             #self._proc.terminate() -> only for GUI apps, sends WM_CLOSE
+
+    ########################################
+    # Like kill(), but doesn't wait: a process that didn't quit after 3 seconds is killed
+    ########################################
+    def stop (self):
+        if self.paused:
+            self.resume()
+        if 'ffmpeg' in self.program() or 'bash' in self.program():
+            self.write(b'q')
+            self._stopping = True
+            QTimer.singleShot(3000, self.slot_stop_timeout)
+        else:
+            super().kill()
+
+    ########################################
+    #
+    ########################################
+    def slot_stop_timeout (self):
+        if self._stopping and self.state() != QProcess.NotRunning:
+            super().kill()
+        self._stopping = False
+
+    ########################################
+    #
+    ########################################
+    def slot_started (self):
+        self._stopping = False
+
+    ########################################
+    # Returns the pids of the process and all its descendants, parents first.
+    # Qt5 can't start the process in a process group of its own, so the tree is
+    # looked up via ps.
+    ########################################
+    def get_pids (self):
+        pids = [self.processId()]
+        proc = QProcess()
+        proc.start('ps', ['-A', '-o', 'pid=', '-o', 'ppid='])
+        if not proc.waitForFinished(3000):
+            return pids
+        children = {}
+        for line in proc.readAllStandardOutput().data().decode().splitlines():
+            pid, _, ppid = line.strip().partition(' ')
+            children.setdefault(int(ppid), []).append(int(pid))
+        i = 0
+        while i < len(pids):
+            pids.extend(children.get(pids[i], []))
+            i += 1
+        return pids
+
+    ########################################
+    # Suspends the process and all its descendants (not supported on Windows)
+    ########################################
+    def pause (self):
+        if self.paused or self.state() != QProcess.Running:
+            return
+        # stop the shell first, so it doesn't start new commands meanwhile
+        os.kill(self.processId(), signal.SIGSTOP)
+        for pid in self.get_pids()[1:]:
+            try:
+                os.kill(pid, signal.SIGSTOP)
+            except OSError:
+                pass
+        self.paused = True
+
+    ########################################
+    #
+    ########################################
+    def resume (self):
+        if not self.paused:
+            return
+        for pid in reversed(self.get_pids()):
+            try:
+                os.kill(pid, signal.SIGCONT)
+            except OSError:
+                pass
+        self.paused = False
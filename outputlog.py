@@ -0,0 +1,113 @@
+"""
+QMediaTool - OutputLog class
+
+Verbose tools write thousands of lines per second, appending each of them to the
+output log widget would freeze the GUI. Output is collected instead and appended
+in one go every OUTPUT_FLUSH_INTERVAL ms. If there's more than anyone could read,
+only the latest lines are shown - Qt takes longer for removing lines beyond the
+widget's maximum block count than for appending them. Every task also writes its
+complete output to a log file of its own.
+"""
+
+import os
+
+from PyQt5.QtCore import QObject, QTimer
+
+from const import *
+
+# log file of the task run by the editor
+EDITOR_LOG_FILE = os.path.join(LOG_DIR, 'editor.log')
+
+
+########################################
+# Returns the path of the log file of a task, tasks not in the task queue (run by
+# the editor) share one
+########################################
+def get_log_file (task):
+    return os.path.join(LOG_DIR, f'task_{task.id}.log') if task.id else EDITOR_LOG_FILE
+
+
+########################################
+# Returns the task's log file opened for writing, or None if that failed
+########################################
+def open_log_file (task):
+    fn = get_log_file(task)
+    try:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        # a new file rather than truncating the old one, which might be memory-mapped by a log viewer
+        if os.path.exists(fn):
+            os.remove(fn)
+        return open(fn, 'wb')
+    except OSError:
+        return None
+
+
+########################################
+#
+########################################
+def delete_log_file (task):
+    try:
+        os.remove(get_log_file(task))
+    except OSError:
+        pass
+
+
+class OutputLog (QObject):
+
+    ########################################
+    #
+    ########################################
+    def __init__ (self, plainTextEdit, parent=None):
+        super().__init__(parent)
+        self._edit = plainTextEdit
+        self._edit.setMaximumBlockCount(OUTPUT_MAX_BLOCKS)
+        self._pending = []
+        self._lines = 0
+        self._dropped = 0
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(OUTPUT_FLUSH_INTERVAL)
+        self._timer.timeout.connect(self.flush)
+
+    ########################################
+    # Appends text (as paragraph of its own) with the next flush
+    ########################################
+    def write (self, s):
+        self._pending.append(s)
+        self._lines += s.count('\n') + 1
+        while self._lines > OUTPUT_MAX_FLUSH_LINES and len(self._pending) > 1:
+            lines = self._pending.pop(0).count('\n') + 1
+            self._lines -= lines
+            self._dropped += lines
+        if not self._timer.isActive():
+            self._timer.start()
+
+    ########################################
+    #
+    ########################################
+    def flush (self):
+        self._timer.stop()
+        if not self._pending:
+            return
+        s = '\n'.join(self._pending)
+        if self._lines > OUTPUT_MAX_FLUSH_LINES:
+            parts = s.rsplit('\n', OUTPUT_MAX_FLUSH_LINES)
+            self._dropped += len(parts) - OUTPUT_MAX_FLUSH_LINES
+            s = '\n'.join(parts[-OUTPUT_MAX_FLUSH_LINES:])
+        if self._dropped:
+            s = f'[... {self._dropped} line(s) skipped, see the log files in {LOG_DIR}]\n' + s
+        self._edit.appendPlainText(s)
+        self._edit.ensureCursorVisible()
+        self._pending.clear()
+        self._lines = 0
+        self._dropped = 0
+
+    ########################################
+    #
+    ########################################
+    def clear (self):
+        self._timer.stop()
+        self._pending.clear()
+        self._lines = 0
+        self._dropped = 0
+        self._edit.clear()
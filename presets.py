@@ -10,6 +10,23 @@ from PyQt5.QtWidgets import *
 from PyQt5 import uic
 
 from const import *
+from taskresources import parse_resources, format_resources
+
+
+########################################
+# Returns the preset with the given name or id as dict, or None
+########################################
+def get_preset (presets_db, preset):
+	c = presets_db.cursor()
+	sql = """
+	SELECT presets.*,categories.name AS category FROM presets
+	LEFT JOIN categories ON presets.category_id=categories.id WHERE presets.id=? OR TRIM(presets.name)=TRIM(?)
+	ORDER BY presets.id=? DESC
+	"""
+	preset_id = int(preset) if str(preset).isdigit() else -1
+	c.execute(sql, (preset_id, str(preset), preset_id))
+	row = c.fetchone()
+	return dict(row) if row else None
 
 
 class PresetsManager(QDialog):
@@ -79,6 +96,7 @@ class PresetsManager(QDialog):
 				self.radioButtonSingle.setChecked(True)
 			ext = preset['ext']
 			self.lineEditExtensions.setText(ext)
+			self.lineEditResources.setText(preset['resources'])
 			index = self.comboBoxCategories.findData(preset['category_id'])
 			self.comboBoxCategories.setCurrentIndex(index)
 		else:
@@ -87,6 +105,7 @@ class PresetsManager(QDialog):
 			self.plainTextEditCommandLine.setPlainText('')
 			self.radioButtonSingle.setChecked(True)
 			self.lineEditExtensions.setText('')
+			self.lineEditResources.setText('')
 			self.pushButtonSave.setDisabled(True)
 			self.pushButtonSaveAsNew.setDisabled(True)
 
@@ -109,6 +128,7 @@ class PresetsManager(QDialog):
 		notes = self.plainTextEditNotes.toPlainText()
 		cmd = self.plainTextEditCommandLine.toPlainText()
 		ext = self.lineEditExtensions.text()
+		resources = format_resources(parse_resources(self.lineEditResources.text()))
 		if self.radioButtonMultiple.isChecked():
 			input_type = INPUT_TYPE_FILES
 		elif self.radioButtonURL.isChecked():
@@ -119,8 +139,8 @@ class PresetsManager(QDialog):
 			input_type = INPUT_TYPE_FILE
 		try:
 			c = self._presets_db.cursor()
-			sql = "UPDATE presets SET category_id=?, name=?, notes=?, cmd=?, ext=?, input_type=? WHERE id=?"
-			c.execute(sql, (catID,name,notes,cmd,ext,input_type, self._presets_id))
+			sql = "UPDATE presets SET category_id=?, name=?, notes=?, cmd=?, ext=?, input_type=?, resources=? WHERE id=?"
+			c.execute(sql, (catID,name,notes,cmd,ext,input_type,resources, self._presets_id))
 			self._presets_db.commit()
 			self.presetChanged.emit(self._presets_id)
 			self.message.emit('Changes successfully saved')
@@ -137,6 +157,7 @@ class PresetsManager(QDialog):
 		notes = self.plainTextEditNotes.toPlainText()
 		cmd = self.plainTextEditCommandLine.toPlainText()
 		ext = self.lineEditExtensions.text()
+		resources = format_resources(parse_resources(self.lineEditResources.text()))
 		if self.radioButtonMultiple.isChecked():
 			input_type = INPUT_TYPE_FILES
 		elif self.radioButtonURL.isChecked():
@@ -147,8 +168,8 @@ class PresetsManager(QDialog):
 			input_type = INPUT_TYPE_FILE
 		try:
 			c = self._presets_db.cursor()
-			sql = "INSERT INTO presets(category_id, name, notes, cmd, ext, input_type) VALUES(?,?,?,?,?,?)"
-			c.execute(sql, (catID, name, notes, cmd, ext, input_type))
+			sql = "INSERT INTO presets(category_id, name, notes, cmd, ext, input_type, resources) VALUES(?,?,?,?,?,?,?)"
+			c.execute(sql, (catID, name, notes, cmd, ext, input_type, resources))
 			self._presets_db.commit()
 			self.presetChanged.emit(c.lastrowid)
 			self.message.emit('Changes successfully saved')
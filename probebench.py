@@ -0,0 +1,144 @@
+"""
+QMediaTool - probe engine benchmark
+
+Compares the media probe engines on a synthetic corpus generated with ffmpeg,
+or on existing files, e.g.:
+
+    python main.py --probe-benchmark --files 40 --runs 3
+    python main.py --probe-benchmark --input some/folder
+
+Each file is probed by each engine in turn, the results are written to stdout as
+JSON lines: per engine the mean time per file of the probe process and of parsing
+its output, and the output size. Set $QMT_PROBE to the faster engine.
+"""
+
+import argparse
+import os
+import shlex
+import shutil
+import sys
+import tempfile
+import time
+
+from PyQt5.QtCore import QCoreApplication, QProcess
+
+from const import *
+from task import Task
+from taskenv import setup_env
+from mediaprobe import ENGINES, get_probe_env
+from batch import get_input_files
+from jsonevents import emit
+
+# (extension, ffmpeg input arguments) of the synthetic files, used in turn
+CORPUS = (
+    ('mp4', '-f lavfi -i testsrc=duration=10:size=320x240:rate=25 -f lavfi -i sine=duration=10'),
+    ('mkv', '-f lavfi -i testsrc=duration=10:size=320x240:rate=30000/1001 -f lavfi -i sine=duration=10'),
+    ('mov', '-f lavfi -i testsrc=duration=10:size=320x240:rate=24'),
+    ('mp3', '-f lavfi -i sine=duration=10'),
+    ('wav', '-f lavfi -i sine=duration=10'),
+)
+
+
+########################################
+# Runs task code with task variables env in a new process, returns the process once
+# it finished, or None if it timed out
+########################################
+def run_code (code, env={}):
+    proc = QProcess()
+    Task(code, env).run(proc)
+    if not proc.waitForFinished(PROBE_TIMEOUT * 1000):
+        proc.kill()
+        proc.waitForFinished(1000)
+        return None
+    return proc
+
+
+########################################
+# Creates cnt synthetic media files in folder d, returns their file names
+########################################
+def make_corpus (d, cnt):
+    files = []
+    for i in range(cnt):
+        ext, args = CORPUS[i % len(CORPUS)]
+        fn = os.path.join(d, f'file_{i:04d}.{ext}')
+        proc = run_code(f'$FFMPEG -hide_banner -v error -y {args} -shortest {shlex.quote(fn)}')
+        if proc is None or proc.exitCode() != 0 or not os.path.isfile(fn):
+            emit('error', message=f'Creating {fn} failed')
+            continue
+        files.append(fn)
+    return files
+
+
+########################################
+# Probes files runs times with engine, returns the result as dict
+########################################
+def bench_engine (engine, files, runs):
+    probe_time = parse_time = 0.0
+    size = failed = 0
+    for _ in range(runs):
+        for fn in files:
+            t = time.perf_counter()
+            proc = run_code(engine.get_code(), get_probe_env(fn))
+            probe_time += time.perf_counter() - t
+            if proc is None:
+                failed += 1
+                continue
+            output = proc.readAllStandardOutput().data()
+            size += len(output)
+            t = time.perf_counter()
+            try:
+                engine.parse(output.decode(errors='ignore'))
+            except (ValueError, KeyError, IndexError, TypeError):
+                failed += 1
+            parse_time += time.perf_counter() - t
+    n = max(1, runs * len(files))
+    return {'engine': engine.name, 'files': len(files), 'runs': runs, 'failed': failed,
+            'probe_ms': round(probe_time / n * 1000, 2), 'parse_ms': round(parse_time / n * 1000, 3),
+            'output_bytes': size // n}
+
+
+########################################
+# Runs the probe engine benchmark, returns the exit code
+########################################
+def run_probe_benchmark (argv):
+    parser = argparse.ArgumentParser(prog='main.py', description='Compares the media probe engines.')
+    parser.add_argument('--probe-benchmark', action='store_true', required=True, help='run the probe benchmark')
+    parser.add_argument('--input', action='append', default=[], metavar='PATH',
+            help='file or folder to probe instead of a synthetic corpus (repeatable)')
+    parser.add_argument('--files', type=int, default=20, help='number of synthetic files (default: 20)')
+    parser.add_argument('--runs', type=int, default=3, help='number of times each file is probed (default: 3)')
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as e:
+        return e.code
+
+    app = QCoreApplication(sys.argv[:1])
+    setup_env()
+
+    engines = [e for e in ENGINES.values() if e.is_available()]
+    if not engines:
+        emit('error', message='No probe engine available')
+        return 1
+
+    tmpdir = None
+    if args.input:
+        files = get_input_files(args.input, [])
+    else:
+        tmpdir = tempfile.mkdtemp(prefix='qmt_probebench_')
+        files = make_corpus(tmpdir, args.files)
+    try:
+        if not files:
+            emit('error', message='No files to probe')
+            return 1
+        emit('corpus', files=len(files), synthetic=tmpdir is not None)
+        results = []
+        for engine in engines:
+            results.append(bench_engine(engine, files, max(1, args.runs)))
+            emit('result', **results[-1])
+        ok = [r for r in results if r['failed'] == 0] or results
+        best = min(ok, key=lambda r: r['probe_ms'] + r['parse_ms'])
+        emit('done', fastest=best['engine'], hint=f'QMT_PROBE={best["engine"]}')
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    return 0
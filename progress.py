@@ -0,0 +1,243 @@
+"""
+QMediaTool - TaskProgress class
+
+Each running task gets a progress endpoint of its own: a named pipe (FIFO) in a
+temporary folder, read without blocking, or - on Windows, or if $QMT_PROGRESS is
+"tcp" - a TCP server on an ephemeral localhost port. Its URL is passed to the
+task as $PROGRESSURL, and $FFMPEG_PROG becomes "ffmpeg -hide_banner -progress
+$PROGRESSURL", so progress of parallel tasks (and of several QMediaTool
+instances) doesn't get mixed up.
+
+ffmpeg writes its progress as blocks of key=value lines, each terminated by a
+"progress=continue" or "progress=end" line. The ProgressParser assembles these
+blocks from whatever chunks arrive and turns them into dicts with keys
+
+    out_time_us, frame, dup_frames, drop_frames, total_size (ints)
+    out_time (seconds), fps, bitrate (kbit/s), speed (floats)
+    rate        smoothed speed (media seconds per second)
+    eta         seconds until ffmpeg is done, if the media duration is known
+    end         True for the last block
+
+Fields ffmpeg reports as N/A are left out.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from PyQt5.QtCore import QObject, QSocketNotifier, pyqtSignal
+from PyQt5.QtNetwork import QTcpServer, QHostAddress
+
+from const import *
+from taskhistory import format_duration
+
+# weight of the latest speed sample in the smoothed rate
+RATE_SMOOTHING = 0.3
+
+INT_FIELDS = ('frame', 'dup_frames', 'drop_frames', 'total_size', 'out_time_us')
+FLOAT_FIELDS = ('fps', 'bitrate', 'speed')
+
+
+########################################
+# Formats rate and ETA of a progress block like "1.52x, 42s left"
+########################################
+def format_progress (info):
+    parts = []
+    if 'rate' in info:
+        parts.append(f'{info["rate"]:.2f}x')
+    if 'eta' in info and not info['end']:
+        parts.append(f'{format_duration(info["eta"])} left')
+    return ', '.join(parts)
+
+
+class ProgressParser ():
+
+    ########################################
+    # duration: media duration in seconds, needed for the ETA
+    ########################################
+    def __init__ (self, duration=None):
+        self._duration = duration
+        self._buffer = b''
+        self._block = {}
+        self._last = None
+        self._rate = None
+
+    ########################################
+    # Parses a chunk of the progress stream, returns the blocks it completed
+    ########################################
+    def feed (self, data, now=None):
+        if now is None:
+            now = time.monotonic()
+        lines = (self._buffer + data).split(b'\n')
+        self._buffer = lines.pop()
+        blocks = []
+        for line in lines:
+            k, _, v = line.decode(errors='ignore').strip().partition('=')
+            if k == 'progress':
+                blocks.append(self.get_block(v.strip() == 'end', now))
+            elif k:
+                self._block[k] = v.strip()
+        return blocks
+
+    ########################################
+    # Returns the typed fields of the block assembled so far, plus rate and ETA
+    ########################################
+    def get_block (self, end, now):
+        raw, self._block = self._block, {}
+        # out_time_ms is in microseconds as well, older ffmpeg versions only have it
+        if 'out_time_us' not in raw and 'out_time_ms' in raw:
+            raw['out_time_us'] = raw['out_time_ms']
+        info = {'end': end}
+        for k in INT_FIELDS:
+            try:
+                info[k] = int(raw[k])
+            except (KeyError, ValueError):
+                pass
+        for k in FLOAT_FIELDS:
+            try:
+                # e.g. bitrate=1024.5kbits/s, speed=1.23x
+                info[k] = float(raw[k].rstrip('kbits/x'))
+            except (KeyError, ValueError):
+                pass
+        if 'out_time_us' in info:
+            # negative at the very start of some encodes
+            info['out_time'] = max(0, info['out_time_us']) / 1000000
+            self.update_rate(info['out_time'], now, info.get('speed'))
+        if self._rate is not None:
+            info['rate'] = self._rate
+        if end:
+            info['eta'] = 0.0
+        elif self._duration and self._rate and 'out_time' in info:
+            info['eta'] = max(0.0, self._duration - info['out_time']) / self._rate
+        return info
+
+    ########################################
+    # Updates the exponentially smoothed rate with the media time processed since the
+    # last block, ffmpeg's own (average) speed serves as first value
+    ########################################
+    def update_rate (self, out_time, now, speed):
+        if self._last is not None:
+            last_now, last_out_time = self._last
+            if now > last_now:
+                rate = max(0.0, out_time - last_out_time) / (now - last_now)
+                self._rate = rate if self._rate is None else self._rate + RATE_SMOOTHING * (rate - self._rate)
+        elif speed:
+            self._rate = speed
+        self._last = (now, out_time)
+
+
+class TaskProgress (QObject):
+
+    # a progress block as returned by ProgressParser
+    progress = pyqtSignal(dict)
+
+    ########################################
+    # duration: media duration in seconds, needed for the ETA
+    ########################################
+    def __init__ (self, duration=None, parent=None):
+        super().__init__(parent)
+        self._duration = duration
+        self._parsers = {}
+        self._server = None
+        self._fifoDir = None
+        self._fd = self._wfd = None
+        self._notifier = None
+        self.url = None
+        if PROGRESS_TRANSPORT == 'fifo' and hasattr(os, 'mkfifo'):
+            try:
+                self.open_fifo()
+            except OSError:
+                self.close_fifo()
+        if self.url is None:
+            self._server = QTcpServer(self)
+            self._server.listen(QHostAddress.LocalHost, 0)
+            self._server.newConnection.connect(self.slot_new_connection)
+            self.url = f'tcp://127.0.0.1:{self._server.serverPort()}'
+
+    ########################################
+    # Creates the FIFO and opens it for reading without blocking
+    ########################################
+    def open_fifo (self):
+        self._fifoDir = tempfile.mkdtemp(prefix='qmediatool_progress_')
+        fn = os.path.join(self._fifoDir, 'progress')
+        os.mkfifo(fn, 0o600)
+        self._fd = os.open(fn, os.O_RDONLY | os.O_NONBLOCK)
+        # a write end of our own keeps the FIFO open between ffmpeg runs, so there's no EOF
+        self._wfd = os.open(fn, os.O_WRONLY | os.O_NONBLOCK)
+        self._parser = ProgressParser(self._duration)
+        self._notifier = QSocketNotifier(self._fd, QSocketNotifier.Read, self)
+        self._notifier.activated.connect(self.slot_fifo_read)
+        self.url = 'file:' + fn
+
+    ########################################
+    #
+    ########################################
+    def close_fifo (self):
+        if self._fifoDir is None:
+            return
+        if self._notifier is not None:
+            self._notifier.setEnabled(False)
+        for fd in (self._fd, self._wfd):
+            if fd is not None:
+                os.close(fd)
+        self._fd = self._wfd = None
+        shutil.rmtree(self._fifoDir, ignore_errors=True)
+        self._fifoDir = None
+
+    ########################################
+    # Stops listening and drops all connections
+    ########################################
+    def close (self):
+        self.close_fifo()
+        if self._server is not None:
+            self._server.close()
+        for socket in list(self._parsers):
+            socket.abort()
+        self._parsers.clear()
+
+    ########################################
+    # Reads everything available, ffmpeg runs of the task write one after the other
+    ########################################
+    def slot_fifo_read (self):
+        data = b''
+        while self._fd is not None:
+            try:
+                chunk = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            data += chunk
+        for block in self._parser.feed(data):
+            if block['end']:
+                self._parser = ProgressParser(self._duration)
+            self.progress.emit(block)
+
+    ########################################
+    # A task may run ffmpeg several times, each run connects anew
+    ########################################
+    def slot_new_connection (self):
+        while self._server.hasPendingConnections():
+            socket = self._server.nextPendingConnection()
+            self._parsers[socket] = ProgressParser(self._duration)
+            socket.readyRead.connect(self.slot_ready_read)
+            socket.disconnected.connect(self.slot_disconnected)
+
+    ########################################
+    #
+    ########################################
+    def slot_ready_read (self):
+        socket = self.sender()
+        if socket not in self._parsers:
+            return
+        for block in self._parsers[socket].feed(socket.readAll().data()):
+            self.progress.emit(block)
+
+    ########################################
+    #
+    ########################################
+    def slot_disconnected (self):
+        socket = self.sender()
+        self._parsers.pop(socket, None)
+        socket.deleteLater()
@@ -0,0 +1,212 @@
+"""
+QMediaTool - RemoteProcess class
+
+Runs a task on a worker agent (see agent.py) on another host. The task's code
+and variables are sent to the agent, which expands them with its own tool paths,
+runs the task and sends back its output, ffmpeg progress, output files (unless
+written to shared storage) and exit status.
+"""
+
+import base64
+import json
+import os
+
+from PyQt5.QtCore import QObject, QProcess, QByteArray, QTimer, pyqtSignal
+from PyQt5.QtNetwork import QTcpSocket
+
+from const import *
+
+
+########################################
+# Parses an agent list like "box1:9900/4, secret@box2" into a list of dicts with keys
+# 'host', 'port', 'jobs' (number of tasks run by the agent in parallel) and 'token'
+########################################
+def parse_agents (s):
+    agents = []
+    for part in s.split(','):
+        part = part.strip()
+        if part == '':
+            continue
+        token, _, part = part.rpartition('@')
+        part, _, jobs = part.partition('/')
+        host, _, port = part.partition(':')
+        try:
+            agents.append({'host': host.strip(), 'port': int(port) if port.strip() else DEFAULT_AGENT_PORT,
+                    'jobs': max(1, int(jobs)) if jobs.strip() else 1, 'token': token})
+        except ValueError:
+            pass
+    return agents
+
+
+########################################
+# Returns a message as JSON line
+########################################
+def encode_message (**kwargs):
+    return json.dumps(kwargs).encode() + b'\n'
+
+
+class RemoteProcess (QObject):
+
+    # same signals as QProcess, so the task manager can handle both alike
+    readyReadStandardOutput = pyqtSignal()
+    readyReadStandardError = pyqtSignal()
+    finished = pyqtSignal(int, QProcess.ExitStatus)
+    errorOccurred = pyqtSignal(QProcess.ProcessError)
+    # ffmpeg progress of the task, see TaskProgress
+    progress = pyqtSignal(dict)
+
+    ########################################
+    #
+    ########################################
+    def __init__ (self, agent, parent=None):
+        super().__init__(parent)
+        self.agent = agent
+        self.paused = False
+        self._task = None
+        self._buffer = b''
+        self._output = b''
+        self._connected = False
+        self._finished = False
+
+        self._socket = QTcpSocket(self)
+        self._socket.connected.connect(self.slot_connected)
+        self._socket.readyRead.connect(self.slot_ready_read)
+        self._socket.disconnected.connect(self.slot_disconnected)
+        self._socket.errorOccurred.connect(self.slot_socket_error)
+
+    ########################################
+    # Sends task to the agent
+    ########################################
+    def run_task (self, task):
+        self._task = task
+        self._socket.connectToHost(self.agent['host'], self.agent['port'])
+
+    ########################################
+    #
+    ########################################
+    def send (self, **kwargs):
+        if self._connected:
+            self._socket.write(encode_message(**kwargs))
+
+    ########################################
+    # Delegated QProcess methods
+    ########################################
+    def processId (self):
+        return 0
+
+    def state (self):
+        return QProcess.Running if self._connected and not self._finished else QProcess.NotRunning
+
+    def program (self):
+        return f'{self.agent["host"]}:{self.agent["port"]}'
+
+    def readAllStandardOutput (self):
+        output, self._output = self._output, b''
+        return QByteArray(output)
+
+    def readAllStandardError (self):
+        return QByteArray()
+
+    def pause (self):
+        if not self.paused:
+            self.send(cmd='pause')
+            self.paused = True
+
+    def resume (self):
+        if self.paused:
+            self.send(cmd='resume')
+            self.paused = False
+
+    ########################################
+    # Asks the agent to kill the task. Doesn't wait, like stop().
+    ########################################
+    def kill (self):
+        self.stop()
+
+    ########################################
+    # Asks the agent to kill the task, the connection is dropped if the agent didn't
+    # report it as finished after 3 seconds
+    ########################################
+    def stop (self):
+        if not self._connected or self._finished:
+            return
+        self.send(cmd='kill')
+        QTimer.singleShot(3000, self.slot_stop_timeout)
+
+    ########################################
+    #
+    ########################################
+    def slot_stop_timeout (self):
+        if not self._finished:
+            self._socket.abort()
+
+    ########################################
+    #
+    ########################################
+    def slot_connected (self):
+        self._connected = True
+        self.send(cmd='run', name=self._task.name, code=self._task.code, env=self._task.env,
+                priority=self._task.priority, duration=self._task.duration, token=self.agent['token'])
+
+    ########################################
+    #
+    ########################################
+    def slot_ready_read (self):
+        self._buffer += self._socket.readAll().data()
+        lines = self._buffer.split(b'\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            event = msg.get('event')
+            if event == 'output':
+                self._output += msg['data'].encode()
+                self.readyReadStandardOutput.emit()
+            elif event == 'progress':
+                self.progress.emit(msg.get('info', {}))
+            elif event == 'file':
+                self.write_file(msg['name'], msg['offset'], base64.b64decode(msg['data']))
+            elif event == 'error':
+                self._output += f'\nAgent {self.program()}: {msg["message"]}\n'.encode()
+                self.readyReadStandardOutput.emit()
+            elif event == 'finish':
+                self._task.stats.update(msg.get('stats', {}))
+                self.finish(msg['exit_code'], QProcess.NormalExit)
+
+    ########################################
+    # Writes a part of an output file sent by the agent to the task's output folder
+    ########################################
+    def write_file (self, name, offset, data):
+        fn = os.path.join(self._task.env['OUTPUTDIR'], os.path.basename(name))
+        try:
+            with open(fn, 'ab' if offset > 0 else 'wb') as f:
+                f.write(data)
+        except OSError as e:
+            self._output += f'\nWriting {fn} failed: {e}\n'.encode()
+            self.readyReadStandardOutput.emit()
+
+    ########################################
+    #
+    ########################################
+    def finish (self, exitCode, exitStatus):
+        if self._finished:
+            return
+        self._finished = True
+        self._socket.disconnectFromHost()
+        self.finished.emit(exitCode, exitStatus)
+
+    ########################################
+    #
+    ########################################
+    def slot_disconnected (self):
+        self.finish(-1, QProcess.CrashExit)
+
+    ########################################
+    # Agents that can't be reached are reported like processes that failed to start
+    ########################################
+    def slot_socket_error (self, err):
+        if not self._connected:
+            self._finished = True
+            self.errorOccurred.emit(QProcess.FailedToStart)
@@ -0,0 +1,210 @@
+"""
+QMediaTool - ShellWorker class
+
+A long-lived bash process that runs task scripts it receives over its stdin,
+each in a subshell of its own, which saves starting a new bash per task.
+
+Protocol: the script is sent line by line, followed by a line containing only
+the worker's token. The worker runs it and then writes "<token>:<exit status>"
+to its stdout, where it's cut out of the task's output again. In Windows the
+script is written to a temp file, and the worker only receives a line sourcing
+it, as only scripts run from a file handle UTF-8 file names correctly there
+(like in Task.run).
+"""
+
+import os
+import re
+import signal
+import tempfile
+import uuid
+
+from PyQt5.QtCore import QObject, QProcess, QByteArray, pyqtSignal
+
+from const import *
+from myprocess import MyProcess
+from taskenv import get_process_env
+
+RE_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+########################################
+# Returns s quoted for bash
+########################################
+def quote (s):
+    return "'" + str(s).replace("'", "'\\''") + "'"
+
+
+class ShellWorker (QObject):
+
+    # same signals as QProcess, so the task manager can handle both alike
+    readyReadStandardOutput = pyqtSignal()
+    readyReadStandardError = pyqtSignal()
+    finished = pyqtSignal(int, QProcess.ExitStatus)
+    errorOccurred = pyqtSignal(QProcess.ProcessError)
+
+    ########################################
+    #
+    ########################################
+    def __init__ (self, parent=None):
+        super().__init__(parent)
+        self._token = 'QMT_' + uuid.uuid4().hex
+        self._marker = (self._token + ':').encode()
+        self._buffer = b''
+        self._output = b''
+        self._scriptFile = None
+        self.busy = False
+
+        self._proc = MyProcess(self)
+        self._proc.setProcessChannelMode(QProcess.MergedChannels)
+        self._proc.setProcessEnvironment(get_process_env({}))
+        self._proc.readyReadStandardOutput.connect(self.slot_stdout)
+        self._proc.finished.connect(self.slot_finished)
+        self._proc.errorOccurred.connect(self.slot_error_occurred)
+        loop = f"""
+        while :; do
+            __qmt_script=
+            while IFS= read -r __qmt_line || exit 0; do
+                [[ $__qmt_line == {self._token} ]] && break
+                __qmt_script+=$__qmt_line$'\\n'
+            done
+            (eval "$__qmt_script") < /dev/null
+            printf '{self._token}:%d\\n' $?
+        done
+        """
+        self._proc.start(BASH, ['-c', loop])
+
+    ########################################
+    # Runs command (already expanded) with the task variables env in folder cwd
+    ########################################
+    def run_script (self, command, env, cwd=None):
+        self.busy = True
+        self._buffer = b''
+        self._output = b''
+        lines = [f'export {k}={quote(v)}' for k, v in env.items() if RE_NAME.match(k)]
+        if cwd:
+            lines.append(f'cd {quote(cwd)} || exit 1')
+        lines.append(command)
+        script = '\n'.join(lines)
+        if IS_WIN:
+            self.remove_script_file()
+            fd, self._scriptFile = tempfile.mkstemp(prefix='qmediatool_')
+            os.close(fd)
+            with open(self._scriptFile, 'w') as f:
+                f.write(script + '\n')
+            script = 'source ' + quote(self._scriptFile.replace('\\', '/'))
+        self._proc.write((script + '\n' + self._token + '\n').encode())
+
+    ########################################
+    #
+    ########################################
+    def remove_script_file (self):
+        if self._scriptFile:
+            try:
+                os.remove(self._scriptFile)
+            except OSError:
+                pass
+            self._scriptFile = None
+
+    ########################################
+    #
+    ########################################
+    def is_alive (self):
+        return self._proc.state() != QProcess.NotRunning
+
+    ########################################
+    # Delegated QProcess methods
+    ########################################
+    def processId (self):
+        return self._proc.processId()
+
+    def state (self):
+        return self._proc.state()
+
+    def program (self):
+        return self._proc.program()
+
+    def readAllStandardOutput (self):
+        output, self._output = self._output, b''
+        return QByteArray(output)
+
+    def readAllStandardError (self):
+        return QByteArray()
+
+    @property
+    def paused (self):
+        return self._proc.paused
+
+    def pause (self):
+        self._proc.pause()
+
+    def resume (self):
+        self._proc.resume()
+
+    ########################################
+    # Stops the running task by killing the whole worker, which can't be reused then
+    ########################################
+    def kill (self):
+        self.stop()
+        self._proc.waitForFinished(3000)
+
+    ########################################
+    # Like kill(), but doesn't wait for the worker to exit
+    ########################################
+    def stop (self):
+        if self._proc.paused:
+            self._proc.resume()
+        if not IS_WIN:
+            for pid in reversed(self._proc.get_pids()[1:]):
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+        # not MyProcess.kill(), the worker would take its 'q' as part of a script
+        QProcess.kill(self._proc)
+
+    ########################################
+    #
+    ########################################
+    def slot_stdout (self):
+        self._buffer += self._proc.readAllStandardOutput().data()
+        pos = self._buffer.find(self._marker)
+        if pos >= 0:
+            end = self._buffer.find(b'\n', pos)
+            if end < 0:
+                return  # exit status not complete yet
+            self._output += self._buffer[:pos]
+            exitCode = int(self._buffer[pos + len(self._marker):end])
+            self._buffer = b''
+            if self._output:
+                self.readyReadStandardOutput.emit()
+            self.remove_script_file()
+            self.busy = False
+            self.finished.emit(exitCode, QProcess.NormalExit)
+            return
+        # keep what could be the start of a marker
+        keep = len(self._marker) - 1
+        self._output += self._buffer[:-keep]
+        self._buffer = self._buffer[-keep:]
+        if self._output:
+            self.readyReadStandardOutput.emit()
+
+    ########################################
+    #
+    ########################################
+    def slot_finished (self, exitCode, exitStatus):
+        self.remove_script_file()
+        if self.busy:
+            self.busy = False
+            self._output += self._buffer
+            self._buffer = b''
+            if self._output:
+                self.readyReadStandardOutput.emit()
+            self.finished.emit(-1, QProcess.CrashExit)
+
+    ########################################
+    #
+    ########################################
+    def slot_error_occurred (self, err):
+        if err == QProcess.FailedToStart:
+            self.busy = False
+        self.errorOccurred.emit(err)
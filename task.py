@@ -2,9 +2,50 @@
 QMediaTool - Task class
 """
 
+import hashlib
 import os
+import re
+import shlex
+import shutil
+import stat
 import tempfile
-from const import IS_WIN, BASH
+import time
+from const import IS_WIN, IS_LINUX, BASH, TASK_STATE_PENDING, TASK_PRIORITY_NORMAL
+from taskstats import get_stats_trap, read_stats_file
+from taskenv import get_base_env, get_process_env, expand_vars
+from shellworker import ShellWorker
+from remoteprocess import RemoteProcess
+
+# input file variables: $INPUT, $INPUT0, $INPUT1, ...
+RE_INPUT_VAR = re.compile(r'^INPUT\d*$')
+# tool variables that run other tools: $FFMPEG_PROG is $FFMPEG while a task runs
+TOOL_DEPENDENCIES = {'FFMPEG_PROG': ('FFMPEG',)}
+
+
+########################################
+# Returns the files of tool binary path: path itself and, if it's a single line
+# wrapper script like '/usr/local/bin/ffmpeg "$@"', the binary it calls
+########################################
+def get_tool_files (path):
+    files = [path]
+    try:
+        if os.path.getsize(path) > 4096:
+            return files
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return files
+    if b'\0' in data:
+        return files
+    lines = [l.strip() for l in data.decode(errors='ignore').splitlines() if l.strip() and not l.strip().startswith('#')]
+    if len(lines) == 1:
+        try:
+            binary = shutil.which(shlex.split(lines[0])[0])
+        except (ValueError, IndexError):
+            binary = None
+        if binary and os.path.realpath(binary) != os.path.realpath(path):
+            files.append(binary)
+    return files
 
 
 ########################################
@@ -17,18 +58,123 @@ class Task():
         self.code = code
         self.env = env
         self.name = name
+        self.id = None
+        self.state = TASK_STATE_PENDING
+        self.exit_code = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.fingerprint = None
+        self.resources = {}
+        # ids of tasks that have to be done before this task is run
+        self.depends = []
+        self.priority = TASK_PRIORITY_NORMAL
+        # name of the preset the task was created from, and the duration of the media
+        # it processes in seconds (if known), used for estimating its run time
+        self.preset = ''
+        self.duration = None
+        # resources used by the last run, see taskstats.py
+        self.stats = {}
+        # progress endpoint while running and the last progress block received (see progress.py)
+        self.progress_url = None
+        self.progress = {}
         self._tmpfile = None
+        self._statsfile = None
 
     def __del__ (self):
         if self._tmpfile:
             os.remove(self._tmpfile)
+        if self._statsfile and os.path.isfile(self._statsfile):
+            os.remove(self._statsfile)
+
+    ########################################
+    # Returns a hash over everything that determines the task's result: code,
+    # variables (except $TIMESTAMP), input files and referenced tool binaries
+    # (and the binaries their wrapper scripts run)
+    ########################################
+    def get_fingerprint (self):
+        h = hashlib.sha1(self.code.encode())
+        files = []
+        for k in sorted(self.env):
+            if k == 'TIMESTAMP':
+                continue
+            v = str(self.env[k])
+            h.update(f'\0{k}={v}'.encode())
+            if RE_INPUT_VAR.match(k):
+                files.append(v)
+        base = get_base_env()
+        tools = set(re.findall(r'\$\{?([A-Z_][A-Z0-9_]*)', self.code))
+        for var in list(tools):
+            tools.update(TOOL_DEPENDENCIES.get(var, ()))
+        for var in sorted(tools):
+            if var not in self.env and var in base:
+                files.extend(get_tool_files(base[var].strip('"')))
+        for fn in files:
+            try:
+                st = os.stat(fn)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                h.update(f'\0{fn}:{st.st_size}:{st.st_mtime_ns}'.encode())
+        self.fingerprint = h.hexdigest()
+        return self.fingerprint
+
+    ########################################
+    # Adds the stats written by the shell of the last run, see taskstats.py
+    ########################################
+    def read_stats (self):
+        if self._statsfile:
+            self.stats.update(read_stats_file(self._statsfile))
+            self._statsfile = None
+        return self.stats
+
+    ########################################
+    # Returns the task's variables, while running with those of its progress endpoint
+    ########################################
+    def get_env (self):
+        if not self.progress_url:
+            return self.env
+        env = dict(self.env)
+        env['PROGRESSURL'] = self.progress_url
+        base = get_base_env()
+        if 'FFMPEG' in base:
+            # quoted for bash (also used on Windows), the FIFO is in the temp dir whose path may contain spaces
+            env['FFMPEG_PROG'] = f'{base["FFMPEG"]} -hide_banner -progress {shlex.quote(self.progress_url)}'
+        return env
+
+    ########################################
+    # Returns the code to run, with stats=True the shell's resource usage is collected
+    ########################################
+    def get_command (self, stats=False):
+        command = expand_vars(self.code, self.get_env())
+        if self.priority < TASK_PRIORITY_NORMAL and not IS_WIN:
+            # the shell lowers its own priorities, which are inherited by everything it runs
+            prefix = 'renice -n 19 -p ${BASHPID:-$$} >/dev/null 2>&1; '
+            if IS_LINUX:
+                prefix += 'ionice -c 3 -p ${BASHPID:-$$} >/dev/null 2>&1; '
+            command = prefix + command
+        if stats:
+            fd, self._statsfile = tempfile.mkstemp(prefix='qmediatool_stats_')
+            os.close(fd)
+            command = get_stats_trap(self._statsfile) + command
+        return command
 
-    def run (self, proc):
-        for k,v in self.env.items():
-            os.environ[k] = str(v)
+    ########################################
+    # Runs the task in proc, a QProcess, ShellWorker or RemoteProcess
+    ########################################
+    def run (self, proc, stats=False):
+        if isinstance(proc, RemoteProcess):
+            # expanded by the agent, with its own tool paths
+            proc.run_task(self)
+            return
+        command = self.get_command(stats)
+        if isinstance(proc, ShellWorker):
+            proc.run_script(command, self.get_env(), self.env.get('OUTPUTDIR'))
+            return
+        # each task gets its own environment, so variables don't leak into other tasks
+        proc.setProcessEnvironment(get_process_env(self.get_env()))
         if 'OUTPUTDIR' in self.env:
             proc.setWorkingDirectory(self.env['OUTPUTDIR'])
-        command = os.path.expandvars(self.code)
         if IS_WIN or '\n' in command:
             # only when running external script file UTF-8 filenames are handled correctly in Windows!
             f = tempfile.NamedTemporaryFile()
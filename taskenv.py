@@ -0,0 +1,268 @@
+"""
+QMediaTool - task environment variables
+"""
+
+import os
+import re
+import string
+import time
+
+from PyQt5.QtCore import QProcessEnvironment
+
+from const import *
+
+# environment shared by all tasks: the app's own environment, general variables and tool paths
+_base_env = None
+_base_process_env = None
+
+RE_VAR = re.compile(r'\$(\w+|\{[^}]*\})', re.ASCII)
+
+# task variables with file names or URLs, e.g. from watch folders or folder scans,
+# which bash expands itself (see expand_vars)
+RE_PATH_VAR = re.compile(r'^(INPUT\w*|OUTPUTDIR|URL|CHUNKDIR)$')
+
+
+########################################
+# Sets up the general environment variables provided to all tasks, os.environ isn't changed
+########################################
+def setup_env ():
+    global _base_env, _base_process_env
+    env = dict(os.environ)
+    env['IS_WIN'] = 'true' if IS_WIN else 'false'
+    env['IS_MAC'] = 'true' if IS_MAC else 'false'
+    env['IS_LINUX'] = 'true' if IS_LINUX else 'false'
+    if IS_WIN:
+        env['TMPDIR'] = os.environ['TMP'] + '\\'
+    env.update(get_tool_env_vars())
+    _base_env = env
+    _base_process_env = QProcessEnvironment()
+    for k, v in env.items():
+        _base_process_env.insert(k, v)
+
+
+########################################
+# Returns variables for all binary modules in folder 'bin'
+########################################
+def get_tool_env_vars ():
+    env = {}
+    modules = os.listdir(BIN_DIR)
+    for m in modules:
+        if m.startswith('_'):
+            continue
+        p = BIN_DIR + '/' + m + '/' + m
+        if ' ' in p:
+            p = '"' + p + '"'
+        env[m.upper()] = p
+    return env
+
+
+########################################
+# Returns the environment shared by all tasks as dict
+########################################
+def get_base_env ():
+    if _base_env is None:
+        setup_env()
+    return _base_env
+
+
+########################################
+# Returns the process environment of a task with variables env. The shared base
+# environment is only built once, Qt copies it on write.
+########################################
+def get_process_env (env):
+    get_base_env()
+    process_env = QProcessEnvironment(_base_process_env)
+    for k, v in env.items():
+        process_env.insert(k, str(v))
+    return process_env
+
+
+########################################
+# Expands $VAR and ${VAR} in s like os.path.expandvars does, but with the task
+# variables env and the base environment instead of os.environ. Path variables
+# (RE_PATH_VAR) become ${VAR} and are expanded by bash from the task's process
+# environment, so file names containing $(...), backticks or quotes don't run as
+# commands.
+########################################
+def expand_vars (s, env):
+    base = get_base_env()
+    if IS_WIN:
+        # like ntpath.expandvars: also %VAR%, %% and $$, no expansion within single
+        # quotes, names are case-insensitive
+        upper = {k.upper(): str(v) for k, v in base.items()}
+        upper.update({k.upper(): '${' + k + '}' if RE_PATH_VAR.match(k) else str(v) for k, v in env.items()})
+        return _expand_vars_win(s, upper)
+
+    def repl (m):
+        name = m.group(1)
+        if name.startswith('{'):
+            name = name[1:-1]
+        if name in env:
+            return '${' + name + '}' if RE_PATH_VAR.match(name) else str(env[name])
+        return base.get(name, m.group(0))
+    return RE_VAR.sub(repl, s)
+
+
+########################################
+#
+########################################
+def _expand_vars_win (s, env):
+    varchars = string.ascii_letters + string.digits + '_-'
+    res = ''
+    i = 0
+    n = len(s)
+    while i < n:
+        c = s[i]
+        if c == "'":
+            j = s.find("'", i + 1)
+            j = n - 1 if j < 0 else j
+            res += s[i:j + 1]
+            i = j
+        elif c == '%':
+            if s[i + 1:i + 2] == '%':
+                res += c
+                i += 1
+            else:
+                j = s.find('%', i + 1)
+                if j < 0:
+                    res += s[i:]
+                    i = n - 1
+                else:
+                    var = s[i + 1:j]
+                    res += env.get(var.upper(), '%' + var + '%')
+                    i = j
+        elif c == '$':
+            if s[i + 1:i + 2] == '$':
+                res += c
+                i += 1
+            elif s[i + 1:i + 2] == '{':
+                j = s.find('}', i + 2)
+                if j < 0:
+                    res += s[i:]
+                    i = n - 1
+                else:
+                    var = s[i + 2:j]
+                    res += env.get(var.upper(), '${' + var + '}')
+                    i = j
+            else:
+                j = i + 1
+                while j < n and s[j] in varchars:
+                    j += 1
+                var = s[i + 1:j]
+                res += env.get(var.upper(), '$' + var)
+                i = j - 1
+        else:
+            res += c
+        i += 1
+    return res
+
+
+########################################
+# Returns the config vars used in a preset's code
+########################################
+def get_config_vars (cmd):
+    return [c for c in CONFIG_VARS if '$' + c.upper() in cmd or '${' + c.upper() + '}' in cmd]
+
+
+########################################
+# Returns the single input file variables for file fn with media info info
+########################################
+def get_input_env (fn, info, trackNum=0):
+    env = {}
+    f, ext = os.path.splitext(fn)
+    env['INPUT'] = fn
+    env['INPUTDIR'] = os.path.dirname(f)
+    env['INPUTBASENAME'] = os.path.basename(f).replace(' ', '_')
+    env['INPUTEXT'] = ext[1:]
+    # variables for tracks
+    tracks = info['track']
+    for i in range(len(tracks)):
+        track = tracks[i]
+        if 'Format' in track:
+            env['FORMAT' + str(i)] = track['Format']
+        if 'FrameRate' in track:
+            env['FPS' + str(i)] = float(track['FrameRate'])
+    # variables for currently selected track
+    if trackNum < len(tracks):
+        track = tracks[trackNum]  # -1
+        if 'Format' in track:
+            env['FORMAT'] = track['Format']
+    return env
+
+
+########################################
+# Returns the duration in seconds of the media a task with variables env processes,
+# infos are the media infos of its input files, or None if unknown
+########################################
+def get_media_duration (infos, env):
+    total = 0.0
+    for info in infos:
+        try:
+            total += float(info['general'].get('Duration', 0))
+        except (TypeError, KeyError, ValueError):
+            pass
+    start = float(env.get('START', 0) or 0)
+    end = float(env.get('END', 0) or 0)
+    duration = float(env.get('DURATION', 0) or 0)
+    if duration > 0:
+        total = min(total, duration) if total > 0 else duration
+    elif end > start:
+        total = end - start
+    elif start > 0:
+        total = max(0.0, total - start)
+    return total or None
+
+
+########################################
+# Returns the variables of config vars with the initial values of their widgets
+########################################
+def get_default_config_env (config_vars, info=None):
+    env = {}
+    for c in config_vars:
+        if c in ('Start', 'End'):
+            v = 0.0
+        elif c == 'Duration':
+            v = float(info['general']['Duration']) if info and 'Duration' in info['general'] else 0.0
+        elif c in ('CodecVideo', 'CodecAudio'):
+            v = 'copy'
+        elif c == 'ContainerAudio':
+            v = CONTAINERS_AUDIO[0]
+        elif c == 'ContainerImage':
+            v = CONTAINERS_IMAGE[0]
+        elif c in ('Track', 'DeviceVideo', 'DeviceAudio'):
+            v = 0
+        else:
+            v = DEFAULTS.get(c, '')
+        env[c.upper()] = str(v)
+    return env
+
+
+########################################
+# Returns the variables of a task running preset on inputs (input files, or a URL)
+# with media infos infos. Single inputs get the single file variables ($INPUT,
+# $INPUTDIR, $FORMAT etc.), multiple files presets in addition $CNT and $INPUT<n>.
+# Config vars get their widgets' initial values, overrides (e.g. the widgets'
+# current values, $TRACK or $OUTPUTDIR) are applied last. $OUTPUTDIR defaults to
+# the folder of the first input file.
+########################################
+def build_task_env (preset, inputs, infos, overrides={}):
+    env = {}
+    if preset['input_type'] == INPUT_TYPE_URL:
+        env['URL'] = inputs[0] if inputs else ''
+    elif preset['input_type'] in (INPUT_TYPE_FILE, INPUT_TYPE_FILES) and inputs:
+        if len(inputs) == 1:
+            env.update(get_input_env(inputs[0], infos[0], int(overrides.get('TRACK', 0) or 0)))
+        if preset['input_type'] == INPUT_TYPE_FILES:
+            f, ext = os.path.splitext(inputs[0])
+            env['CNT'] = str(len(inputs))
+            env['INPUTEXT'] = ext[1:]
+            env['INPUTBASENAME'] = os.path.basename(f).replace(' ', '_')
+            for i, fn in enumerate(inputs):
+                env['INPUT' + str(i)] = fn
+        env['OUTPUTDIR'] = os.path.dirname(inputs[0])
+    env.update(get_default_config_env(get_config_vars(preset['cmd']), infos[0] if infos else None))
+    env['TIMESTAMP'] = time.strftime("%Y%m%d_%H%M%S")
+    env.update(overrides)
+    if 'OUTPUTDIR' not in env:
+        env['OUTPUTDIR'] = os.getcwd()
+    return env
@@ -0,0 +1,131 @@
+"""
+QMediaTool - TaskHistory class
+
+Learns from finished tasks how long tasks take: for tasks with known media
+duration the throughput (media seconds processed per wall second), per preset
+and per preset with a specific codec/preset/CRF combination, otherwise the wall
+time per preset. Estimates of the current queue run are corrected by how far off
+the estimates of the tasks finished in that run were.
+"""
+
+import heapq
+
+from const import *
+
+# older results fade out, the last HISTORY_WINDOW results dominate
+HISTORY_WINDOW = 10
+
+
+########################################
+# Formats seconds like 1h 05m, 5m 10s or 42s
+########################################
+def format_duration (sec):
+    sec = int(round(sec))
+    if sec >= 3600:
+        return f'{sec // 3600}h {sec % 3600 // 60:02d}m'
+    if sec >= 60:
+        return f'{sec // 60}m {sec % 60:02d}s'
+    return f'{sec}s'
+
+
+########################################
+# Returns the time until all tasks are done when running up to jobs tasks in parallel,
+# running is the list of remaining times of running tasks, pending the list of
+# estimated times of pending tasks in the order they'll be started
+########################################
+def get_queue_eta (running, pending, jobs):
+    slots = sorted(running)
+    slots += [0.0] * max(0, jobs - len(slots))
+    heapq.heapify(slots)
+    for t in pending:
+        heapq.heappush(slots, heapq.heappop(slots) + t)
+    return max(slots) if slots else 0.0
+
+
+class TaskHistory():
+
+    def __init__ (self, journal):
+        self._journal = journal
+        # key => (value, samples)
+        self._history = journal.get_history()
+        self.reset_run()
+
+    ########################################
+    # Starts a new queue run, whose estimates are corrected by the observed speed
+    ########################################
+    def reset_run (self):
+        self._run_estimated = 0.0
+        self._run_actual = 0.0
+
+    ########################################
+    # Returns the throughput keys of task, most specific first
+    ########################################
+    def get_speed_keys (self, task):
+        keys = []
+        combo = [str(task.env[k]) for k in ('CODECVIDEO', 'PRESET', 'CRF') if k in task.env]
+        if combo:
+            keys.append(f'speed:{task.preset}|' + '/'.join(combo))
+        keys.append(f'speed:{task.preset}')
+        return keys
+
+    ########################################
+    # Returns the estimated wall time of task in seconds based on history only, or None
+    ########################################
+    def get_base_estimate (self, task):
+        if not task.preset:
+            return None
+        if task.duration:
+            for key in self.get_speed_keys(task):
+                if key in self._history:
+                    return task.duration / self._history[key][0]
+        key = f'wall:{task.preset}'
+        return self._history[key][0] if key in self._history else None
+
+    ########################################
+    # Returns the estimated wall time of task in seconds, or None
+    ########################################
+    def get_estimate (self, task):
+        t = self.get_base_estimate(task)
+        if t is None:
+            return None
+        if self._run_estimated > 0:
+            # correct by the speed observed in this run, e.g. due to other load
+            t *= min(4.0, max(0.25, self._run_actual / self._run_estimated))
+        return t
+
+    ########################################
+    # Returns the estimated remaining time of a running task, or None
+    ########################################
+    def get_remaining (self, task, now):
+        t = self.get_estimate(task)
+        if t is None or not task.started:
+            return None
+        elapsed = now - task.started
+        # tasks taking longer than expected are assumed to be almost done
+        return max(t - elapsed, min(elapsed * 0.1, 60.0))
+
+    ########################################
+    #
+    ########################################
+    def update (self, key, value):
+        old, samples = self._history.get(key, (value, 0))
+        samples = min(samples + 1, HISTORY_WINDOW)
+        value = old + (value - old) / samples
+        self._history[key] = (value, samples)
+        self._journal.set_history(key, value, samples)
+
+    ########################################
+    # Learns from a successfully finished task
+    ########################################
+    def add_task (self, task):
+        wall = task.finished - task.started if task.started and task.finished else 0
+        if not task.preset or wall <= 0:
+            return
+        t = self.get_base_estimate(task)
+        if t:
+            self._run_estimated += t
+            self._run_actual += wall
+        if task.duration:
+            for key in self.get_speed_keys(task):
+                self.update(key, task.duration / wall)
+        self.update(f'wall:{task.preset}', wall)
@@ -0,0 +1,218 @@
+"""
+QMediaTool - TaskJournal class
+"""
+
+import json
+import sqlite3
+
+from const import *
+from task import Task
+
+
+########################################
+# Persists the task queue in a SQLite DB, so it survives crashes and restarts
+########################################
+class TaskJournal():
+
+    def __init__ (self, db_file):
+        self._db = sqlite3.connect(db_file)
+        self._db.row_factory = sqlite3.Row
+        c = self._db.cursor()
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA synchronous=NORMAL")
+        sql = """
+        CREATE TABLE IF NOT EXISTS tasks(id INTEGER PRIMARY KEY, position INTEGER NOT NULL DEFAULT 0,
+        name TEXT, code TEXT, env TEXT NOT NULL DEFAULT '{}', state INTEGER NOT NULL DEFAULT 0, exit_code INTEGER,
+        created REAL, started REAL, finished REAL, resources TEXT NOT NULL DEFAULT '{}',
+        depends TEXT NOT NULL DEFAULT '[]', priority INTEGER NOT NULL DEFAULT 0, stats TEXT NOT NULL DEFAULT '{}',
+        preset TEXT NOT NULL DEFAULT '', duration REAL)
+        """
+        c.execute(sql)
+        # add columns introduced by later versions
+        c.execute("PRAGMA table_info(tasks)")
+        cols = [row['name'] for row in c.fetchall()]
+        if not 'resources' in cols:
+            c.execute("ALTER TABLE tasks ADD COLUMN resources TEXT NOT NULL DEFAULT '{}'")
+        if not 'depends' in cols:
+            c.execute("ALTER TABLE tasks ADD COLUMN depends TEXT NOT NULL DEFAULT '[]'")
+        if not 'priority' in cols:
+            c.execute("ALTER TABLE tasks ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+        if not 'stats' in cols:
+            c.execute("ALTER TABLE tasks ADD COLUMN stats TEXT NOT NULL DEFAULT '{}'")
+        if not 'preset' in cols:
+            c.execute("ALTER TABLE tasks ADD COLUMN preset TEXT NOT NULL DEFAULT ''")
+            c.execute("ALTER TABLE tasks ADD COLUMN duration REAL")
+        # outputs of successful runs, by task fingerprint
+        sql = "CREATE TABLE IF NOT EXISTS runs(fingerprint TEXT PRIMARY KEY, outputs TEXT NOT NULL DEFAULT '[]', finished REAL)"
+        c.execute(sql)
+        # learned throughput and wall times, see taskhistory.py
+        sql = "CREATE TABLE IF NOT EXISTS history(key TEXT PRIMARY KEY, value REAL, samples INTEGER)"
+        c.execute(sql)
+        # files that were added to the task queue by watch folders
+        sql = "CREATE TABLE IF NOT EXISTS ingested(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER)"
+        c.execute(sql)
+        self._db.commit()
+
+    ########################################
+    # Returns all journaled tasks in queue order
+    ########################################
+    def load_tasks (self):
+        tasks = []
+        c = self._db.cursor()
+        sql = "SELECT * FROM tasks ORDER BY position, id"
+        c.execute(sql)
+        for row in c.fetchall():
+            task = Task(row['code'], json.loads(row['env']), row['name'])
+            task.id = row['id']
+            task.exit_code = row['exit_code']
+            task.created = row['created']
+            task.started = row['started']
+            task.finished = row['finished']
+            task.resources = json.loads(row['resources'])
+            task.depends = json.loads(row['depends'])
+            task.priority = row['priority']
+            task.stats = json.loads(row['stats'])
+            task.preset = row['preset']
+            task.duration = row['duration']
+            # tasks that were running or paused when the app was closed or crashed have to be run again
+            task.state = TASK_STATE_PENDING if row['state'] in (TASK_STATE_RUNNING, TASK_STATE_PAUSED) else row['state']
+            tasks.append(task)
+        return tasks
+
+    ########################################
+    # Appends tasks to the journal and sets their ids
+    ########################################
+    def add_tasks (self, tasks):
+        c = self._db.cursor()
+        c.execute("SELECT IFNULL(MAX(position), -1) FROM tasks")
+        position = c.fetchone()[0]
+        sql = """
+        INSERT INTO tasks(position, name, code, env, state, exit_code, created, resources, depends, priority,
+        preset, duration)
+        VALUES(?,?,?,?,?,?,?,?,?,?,?,?)
+        """
+        for task in tasks:
+            position += 1
+            # tasks may depend on tasks added before them in the same call
+            task.depends = [getattr(d, 'id', d) for d in task.depends if getattr(d, 'id', d) is not None]
+            c.execute(sql, (position, task.name, task.code, json.dumps(task.env), task.state, task.exit_code,
+                    task.created, json.dumps(task.resources), json.dumps(task.depends), task.priority,
+                    task.preset, task.duration))
+            task.id = c.lastrowid
+        self._db.commit()
+
+    ########################################
+    # Saves state, exit code, timestamps and stats of tasks
+    ########################################
+    def update_tasks (self, tasks):
+        c = self._db.cursor()
+        sql = "UPDATE tasks SET state=?, exit_code=?, started=?, finished=?, stats=? WHERE id=?"
+        c.executemany(sql, [(task.state, task.exit_code, task.started, task.finished, json.dumps(task.stats), task.id)
+                for task in tasks])
+        self._db.commit()
+
+    ########################################
+    #
+    ########################################
+    def update_depends (self, task):
+        c = self._db.cursor()
+        sql = "UPDATE tasks SET depends=? WHERE id=?"
+        c.execute(sql, (json.dumps(task.depends), task.id))
+        self._db.commit()
+
+    ########################################
+    #
+    ########################################
+    def update_priority (self, task):
+        c = self._db.cursor()
+        sql = "UPDATE tasks SET priority=? WHERE id=?"
+        c.execute(sql, (task.priority, task.id))
+        self._db.commit()
+
+    ########################################
+    # Saves the queue order, tasks is the complete queue
+    ########################################
+    def set_order (self, tasks):
+        c = self._db.cursor()
+        sql = "UPDATE tasks SET position=? WHERE id=?"
+        c.executemany(sql, [(i, tasks[i].id) for i in range(len(tasks))])
+        self._db.commit()
+
+    ########################################
+    # Records the output files of a successful run
+    ########################################
+    def add_run (self, fingerprint, outputs, finished):
+        c = self._db.cursor()
+        sql = "INSERT OR REPLACE INTO runs(fingerprint, outputs, finished) VALUES(?,?,?)"
+        c.execute(sql, (fingerprint, json.dumps(outputs), finished))
+        self._db.commit()
+
+    ########################################
+    # Returns the output files of the last successful run, or None
+    ########################################
+    def get_run_outputs (self, fingerprint):
+        c = self._db.cursor()
+        sql = "SELECT outputs FROM runs WHERE fingerprint=?"
+        c.execute(sql, (fingerprint,))
+        row = c.fetchone()
+        return json.loads(row['outputs']) if row else None
+
+    ########################################
+    # Returns the learned history as dict key => (value, samples)
+    ########################################
+    def get_history (self):
+        c = self._db.cursor()
+        sql = "SELECT * FROM history"
+        c.execute(sql)
+        return {row['key']: (row['value'], row['samples']) for row in c.fetchall()}
+
+    ########################################
+    #
+    ########################################
+    def set_history (self, key, value, samples):
+        c = self._db.cursor()
+        sql = "INSERT OR REPLACE INTO history(key, value, samples) VALUES(?,?,?)"
+        c.execute(sql, (key, value, samples))
+        self._db.commit()
+
+    ########################################
+    # Returns the files added by watch folders as dict path => (size, mtime_ns)
+    ########################################
+    def get_ingested (self):
+        c = self._db.cursor()
+        sql = "SELECT * FROM ingested"
+        c.execute(sql)
+        return {row['path']: (row['size'], row['mtime_ns']) for row in c.fetchall()}
+
+    ########################################
+    # Records files added by watch folders, files is a list of (path, size, mtime_ns)
+    ########################################
+    def add_ingested (self, files):
+        c = self._db.cursor()
+        sql = "INSERT OR REPLACE INTO ingested(path, size, mtime_ns) VALUES(?,?,?)"
+        c.executemany(sql, files)
+        self._db.commit()
+
+    ########################################
+    #
+    ########################################
+    def delete_task (self, task):
+        c = self._db.cursor()
+        sql = "DELETE FROM tasks WHERE id=?"
+        c.execute(sql, (task.id,))
+        self._db.commit()
+
+    ########################################
+    #
+    ########################################
+    def clear (self):
+        c = self._db.cursor()
+        sql = "DELETE FROM tasks"
+        c.execute(sql)
+        self._db.commit()
+
+    ########################################
+    #
+    ########################################
+    def close (self):
+        self._db.close()
@@ -3,14 +3,24 @@ QMediaTool - task manager
 """
 
 import os
+import time
 
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 from PyQt5 import uic
 
-from const import RES_DIR
+from const import *
 from myprocess import MyProcess
+from shellworker import ShellWorker
+from remoteprocess import RemoteProcess, parse_agents
+from progress import TaskProgress
+from outputlog import get_log_file, open_log_file, delete_log_file
+from logviewer import LogViewer
+from taskjournal import TaskJournal
+from taskresources import parse_resources, format_resources, fits_limits
+from taskstats import get_tree_rss, format_stats
+from taskhistory import TaskHistory, format_duration, get_queue_eta
 
 
 class TaskManager(QWidget):
@@ -18,6 +28,7 @@ class TaskManager(QWidget):
     statusMessage = pyqtSignal(str)
     outputMessage = pyqtSignal(str)
     outputClear = pyqtSignal()
+    errorOccurred = pyqtSignal(QProcess.ProcessError)
 
     ########################################
     #
@@ -26,56 +37,437 @@ class TaskManager(QWidget):
         super().__init__()
         uic.loadUi(os.path.join(RES_DIR, 'ui', 'taskmanager.ui'), self)
 
+        self._state = QSettings('fx', APP_NAME)
+
         self._taskQueueRunning = False
+        self._taskQueueAborted = False
         self._taskQueueStopOnError = False
-        self._taskQueueCurrentIndex = 0
+        self._taskQueueFailures = 0
+        self._taskQueueSkipped = 0
+
+        # worker processes, and the task queue items currently run by them
+        self._procs = []
+        self._shells = []
+        self._running = {}
+        # paused worker processes don't occupy a slot
+        self._paused = {}
+        # agents that couldn't be reached during the current queue run
+        self._agentsDown = set()
+        # progress endpoints (or remote processes relaying progress) => task queue item
+        self._progressItems = {}
+        # worker process => log file of the task it runs
+        self._logFiles = {}
+        # task id => task, of all tasks in the queue
+        self._tasksById = {}
+        # set when a finished task changed the estimates of the pending tasks
+        self._estimatesChanged = False
+
+        # samples the memory usage of running tasks
+        self._statsTimer = QTimer(self)
+        self._statsTimer.setInterval(TASK_STATS_INTERVAL)
+        self._statsTimer.timeout.connect(self.slot_sample_stats)
+
+        # updates the estimated times while the queue is running
+        self._etaTimer = QTimer(self)
+        self._etaTimer.setInterval(1000)
+        self._etaTimer.timeout.connect(self.slot_update_eta)
 
         self.listWidgetTaskQueue.setDragDropMode(QAbstractItemView.InternalMove)
+        self.listWidgetTaskQueue.model().rowsMoved.connect(self.slot_task_moved)
+        self.listWidgetTaskQueue.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.listWidgetTaskQueue.customContextMenuRequested.connect(self.slot_task_context_menu)
         self.pushButtonTaskDelete.released.connect(self.slot_task_delete)
         self.pushButtonTaskClear.released.connect(self.slot_task_clear)
 
         self.pushButtonRunTaskQueue.released.connect(self.slot_run_task_queue)
         self.pushButtonStopTaskQueue.released.connect(self.slot_stop_task_queue)
         self.checkBoxTaskQueueStopOnError.clicked.connect(self.slot_task_queue_stop_on_error_clicked)
+        self.checkBoxTaskQueueSkipUpToDate.setChecked(self._state.value('TaskQueue/SkipUpToDate', 'false') == 'true')
+        self.checkBoxTaskQueueSkipUpToDate.clicked.connect(
+                lambda checked: self._state.setValue('TaskQueue/SkipUpToDate', 'true' if checked else 'false'))
+        self.checkBoxTaskQueueWarmShells.setChecked(self._state.value('TaskQueue/WarmShells', 'false') == 'true')
+        self.checkBoxTaskQueueWarmShells.clicked.connect(self.slot_warm_shells_clicked)
 
-        self._proc = MyProcess()
-        self._proc.readyReadStandardOutput.connect(self.slot_stdout)
-        self._proc.readyReadStandardError.connect(self.slot_stderr)
-        self._proc.finished.connect(self.slot_complete)
+        self.spinBoxMaxJobs.setValue(int(self._state.value('TaskQueue/MaxJobs', DEFAULT_MAX_JOBS)))
+        self.spinBoxMaxJobs.valueChanged.connect(self.slot_max_jobs_changed)
+        self.lineEditResourceLimits.setText(self._state.value('TaskQueue/ResourceLimits', DEFAULT_RESOURCE_LIMITS))
+        self.lineEditResourceLimits.editingFinished.connect(self.slot_resource_limits_changed)
+        self.lineEditAgents.setText(self._state.value('TaskQueue/Agents', ''))
+        self.lineEditAgents.editingFinished.connect(self.slot_agents_changed)
+
+        # restore task queue of last session
+        self._journal = TaskJournal(DATA_DIR + '/taskqueue.db')
+        self._history = TaskHistory(self._journal)
+        tasks = self._journal.load_tasks()
+        for task in tasks:
+            self.add_task_item(task)
+        self.slot_update_eta()
+        cnt = len([task for task in tasks if task.state not in TASK_STATES_DONE])
+        if cnt > 0:
+            QTimer.singleShot(0, lambda: self.statusMessage.emit(f'{cnt} unfinished Task(s) restored from last session'))
 
     ########################################
     #
     ########################################
     def quit (self):
-        if self._proc.state() != QProcess.NotRunning:
-            self._proc.kill()
+        self._taskQueueRunning = False
+        self._running.update(self._paused)
+        self._paused.clear()
+        # all processes are asked to quit first, then waited for together
+        procs = list(self._running) + [shell for shell in self._shells if shell.is_alive() and shell not in self._running]
+        for proc in procs:
+            proc.stop()
+        deadline = time.monotonic() + 4
+        while any(proc.state() != QProcess.NotRunning for proc in procs) and time.monotonic() < deadline:
+            QCoreApplication.processEvents(QEventLoop.AllEvents, 50)
+        self._journal.close()
+
+    ########################################
+    # Returns an idle worker process for task, creates a new one if needed.
+    # Short tasks are run by shell workers, if enabled.
+    ########################################
+    def get_proc (self, task):
+        if self.checkBoxTaskQueueWarmShells.isChecked():
+            t = self._history.get_base_estimate(task)
+            if t is not None and t < WARM_SHELL_MAX_SECS:
+                return self.get_shell()
+        for proc in self._procs:
+            if proc not in self._running and proc not in self._paused:
+                return proc
+        proc = MyProcess()
+        proc.readyReadStandardOutput.connect(self.slot_stdout)
+        proc.readyReadStandardError.connect(self.slot_stderr)
+        proc.finished.connect(self.slot_complete)
+        proc.errorOccurred.connect(self.slot_error_occurred)
+        self._procs.append(proc)
+        return proc
+
+    ########################################
+    # Returns an idle shell worker, creates a new one if needed
+    ########################################
+    def get_shell (self):
+        # killed workers can't be reused
+        self._shells = [shell for shell in self._shells if shell.is_alive() or shell in self._running]
+        for shell in self._shells:
+            if shell not in self._running and shell not in self._paused:
+                return shell
+        shell = ShellWorker(self)
+        shell.readyReadStandardOutput.connect(self.slot_stdout)
+        shell.finished.connect(self.slot_complete)
+        shell.errorOccurred.connect(self.slot_error_occurred)
+        self._shells.append(shell)
+        return shell
+
+    ########################################
+    #
+    ########################################
+    def slot_warm_shells_clicked (self, checked):
+        self._state.setValue('TaskQueue/WarmShells', 'true' if checked else 'false')
+        if not checked:
+            for shell in self._shells:
+                if shell not in self._running and shell not in self._paused:
+                    shell.kill()
+            self._shells = [shell for shell in self._shells if shell.is_alive()]
 
     ########################################
-    # Runs the next task in the task queue
+    # Returns the number of tasks running on this host
     ########################################
-    def run_next_task (self):
-        if self._taskQueueCurrentIndex < self.listWidgetTaskQueue.count() - 1:
-            # get and run next task
-            self._taskQueueCurrentIndex = self._taskQueueCurrentIndex + 1
-            self.run_task(self.listWidgetTaskQueue.item(self._taskQueueCurrentIndex).data(Qt.UserRole))
+    def get_local_jobs (self):
+        return len([proc for proc in self._running if not isinstance(proc, RemoteProcess)])
+
+    ########################################
+    # Returns an agent with a free slot, or None
+    ########################################
+    def get_free_agent (self):
+        busy = {}
+        for proc in list(self._running) + list(self._paused):
+            if isinstance(proc, RemoteProcess):
+                busy[proc.program()] = busy.get(proc.program(), 0) + 1
+        for agent in parse_agents(self.lineEditAgents.text()):
+            key = f'{agent["host"]}:{agent["port"]}'
+            if key not in self._agentsDown and busy.get(key, 0) < agent['jobs']:
+                return agent
+        return None
+
+    ########################################
+    # Returns the first task queue item with the highest priority that wasn't run yet
+    # and whose dependencies are done and whose resources are available, tasks waiting
+    # for dependencies or resources are passed over. Tasks with a failed dependency are stopped.
+    # The resource limits only apply to tasks run on this host.
+    ########################################
+    def get_next_item (self, check_limits=True):
+        limits = parse_resources(self.lineEditResourceLimits.text()) if check_limits else {}
+        in_use = {}
+        for proc, taskItem in self._running.items():
+            if isinstance(proc, RemoteProcess):
+                continue
+            for k, v in taskItem.data(Qt.UserRole).resources.items():
+                in_use[k] = in_use.get(k, 0) + v
+        states = {task.id: task.state for task in self.get_tasks()}
+        items = [self.listWidgetTaskQueue.item(row) for row in range(self.listWidgetTaskQueue.count())]
+        items.sort(key=lambda taskItem: -taskItem.data(Qt.UserRole).priority)
+        for taskItem in items:
+            task = taskItem.data(Qt.UserRole)
+            if task.state != TASK_STATE_PENDING:
+                continue
+            # dependencies that were deleted from the queue are ignored
+            dep_states = [states[task_id] for task_id in task.depends if task_id in states]
+            if any(state in (TASK_STATE_FAILED, TASK_STATE_STOPPED) for state in dep_states):
+                self.set_task_state(taskItem, TASK_STATE_STOPPED)
+                states[task.id] = TASK_STATE_STOPPED
+                self.outputMessage.emit(f'\nTask "{task.name}" was not run because a task it depends on failed.')
+                continue
+            if all(state in TASK_STATES_DONE for state in dep_states) and fits_limits(task.resources, in_use, limits):
+                return taskItem
+        return None
+
+    ########################################
+    # Fills all free slots with pending tasks, local slots first, then those of agents.
+    # Finishes the queue if nothing is left.
+    ########################################
+    def run_next_tasks (self):
+        while not self._taskQueueAborted:
+            taskItem = None
+            agent = None
+            if self.get_local_jobs() < self.spinBoxMaxJobs.value():
+                taskItem = self.get_next_item()
+            if taskItem is None:
+                agent = self.get_free_agent()
+                if agent is None:
+                    break
+                taskItem = self.get_next_item(False)
+                if taskItem is None:
+                    break
+            if self.checkBoxTaskQueueSkipUpToDate.isChecked() and self.is_up_to_date(taskItem.data(Qt.UserRole)):
+                self.set_task_state(taskItem, TASK_STATE_SKIPPED)
+                self._taskQueueSkipped += 1
+                continue
+            self.run_task(taskItem, agent)
+        if len(self._running) == 0 and len(self._paused) == 0:
+            if not self._taskQueueAborted:
+                # tasks still pending now are waiting for tasks that will never run
+                for row in range(self.listWidgetTaskQueue.count()):
+                    taskItem = self.listWidgetTaskQueue.item(row)
+                    if taskItem.data(Qt.UserRole).state == TASK_STATE_PENDING:
+                        self.set_task_state(taskItem, TASK_STATE_STOPPED)
+            self.slot_task_queue_finished()
+        elif self._paused:
+            self.statusMessage.emit(f'{len(self._running)} Task(s) running, {len(self._paused)} Task(s) paused...')
+        else:
+            self.statusMessage.emit(f'{len(self._running)} Task(s) running...')
+
+    ########################################
+    # Runs a task on this host, or on agent if given
+    ########################################
+    def run_task (self, taskItem, agent=None):
+        task = taskItem.data(Qt.UserRole)
+        if agent is not None:
+            proc = RemoteProcess(agent, self)
+            proc.readyReadStandardOutput.connect(self.slot_stdout)
+            proc.finished.connect(self.slot_complete)
+            proc.errorOccurred.connect(self.slot_error_occurred)
+            proc.progress.connect(self.slot_progress)
+            self._progressItems[proc] = taskItem
         else:
-            self.statusMessage.emit('TaskQueue finished')
+            proc = self.get_proc(task)
+            progress = TaskProgress(task.duration, self)
+            progress.progress.connect(self.slot_progress)
+            self._progressItems[progress] = taskItem
+            task.progress_url = progress.url
+        task.progress = {}
+        self._running[proc] = taskItem
+        self._logFiles[proc] = open_log_file(task)
+        task.get_fingerprint()
+        task.started = time.time()
+        task.finished = None
+        task.stats = {}
+        self.set_task_state(taskItem, TASK_STATE_RUNNING)
+        task.run(proc, True)
+
+    ########################################
+    # Suspends a running task, its slot and resources are given to other tasks meanwhile
+    ########################################
+    def pause_task (self, taskItem):
+        for proc, item in list(self._running.items()):
+            if item is taskItem:
+                proc.pause()
+                del self._running[proc]
+                self._paused[proc] = taskItem
+                self.set_task_state(taskItem, TASK_STATE_PAUSED)
+                self.run_next_tasks()
+                return
 
     ########################################
     #
     ########################################
-    def run_task (self, task):
-        task.run(self._proc)
-        self.statusMessage.emit('Task running...')
+    def resume_task (self, taskItem):
+        for proc, item in list(self._paused.items()):
+            if item is taskItem:
+                proc.resume()
+                del self._paused[proc]
+                self._running[proc] = taskItem
+                self.set_task_state(taskItem, TASK_STATE_RUNNING)
+                self.run_next_tasks()
+                return
+
+    ########################################
+    #
+    ########################################
+    def set_priority (self, taskItem, priority):
+        task = taskItem.data(Qt.UserRole)
+        task.priority = priority
+        self._journal.update_priority(task)
+        self.update_item(taskItem)
+
+    ########################################
+    # Checks if the task's last successful run had the same fingerprint and its outputs still exist
+    ########################################
+    def is_up_to_date (self, task):
+        outputs = self._journal.get_run_outputs(task.get_fingerprint())
+        return bool(outputs) and all(os.path.isfile(fn) for fn in outputs)
+
+    ########################################
+    # Returns the files in the task's output directory that were written while it was running.
+    # Tasks running in parallel in the same directory may claim each other's outputs, which
+    # only means that a task is run again if one of those files is missing.
+    ########################################
+    def get_outputs (self, task):
+        outputs = []
+        outputDir = task.env.get('OUTPUTDIR')
+        if not outputDir or not os.path.isdir(outputDir):
+            return outputs
+        inputs = [os.path.realpath(str(v)) for k,v in task.env.items() if k.startswith('INPUT')]
+        for entry in os.scandir(outputDir):
+            if entry.is_file() and entry.stat().st_mtime >= task.started - 1:
+                fn = os.path.realpath(entry.path)
+                if not fn in inputs:
+                    outputs.append(fn)
+        return outputs
+
+    ########################################
+    # Updates state and color of a task queue item
+    ########################################
+    def set_task_state (self, taskItem, state, save=True):
+        task = taskItem.data(Qt.UserRole)
+        task.state = state
+        if state in TASK_STATE_COLORS:
+            taskItem.setBackground(QColor(TASK_STATE_COLORS[state]))
+        else:
+            taskItem.setBackground(QBrush())
+        if save:
+            self._journal.update_tasks([task])
+
+    ########################################
+    # Returns all tasks in queue order
+    ########################################
+    def get_tasks (self):
+        return [self.listWidgetTaskQueue.item(row).data(Qt.UserRole) for row in range(self.listWidgetTaskQueue.count())]
+
+    ########################################
+    # Returns the ids of all tasks that directly or indirectly depend on task
+    ########################################
+    def get_dependents (self, task):
+        tasks = self.get_tasks()
+        dependents = set()
+        todo = [task.id]
+        while todo:
+            task_id = todo.pop()
+            for t in tasks:
+                if task_id in t.depends and t.id not in dependents:
+                    dependents.add(t.id)
+                    todo.append(t.id)
+        return dependents
+
+    ########################################
+    # Updates text, font and tooltip of a task queue item
+    ########################################
+    def update_item (self, taskItem):
+        task = taskItem.data(Qt.UserRole)
+        self.update_item_text(taskItem)
+        font = taskItem.font()
+        font.setBold(task.priority > TASK_PRIORITY_NORMAL)
+        font.setItalic(task.priority < TASK_PRIORITY_NORMAL)
+        taskItem.setFont(font)
+        tip = []
+        if task.priority != TASK_PRIORITY_NORMAL:
+            tip.append('Priority: ' + TASK_PRIORITY_NAMES[task.priority])
+        if task.resources:
+            tip.append('Resources: ' + format_resources(task.resources))
+        names = [self._tasksById[task_id].name for task_id in task.depends if task_id in self._tasksById]
+        if names:
+            tip.append('Depends on: ' + ', '.join(names))
+        if task.state == TASK_STATE_PENDING and self._history.get_estimate(task) is not None:
+            tip.append('Estimated time: ' + format_duration(self._history.get_estimate(task)))
+        elif task.stats:
+            tip.append(format_stats(task.stats, True))
+        taskItem.setToolTip('\n'.join(tip))
+
+    ########################################
+    # Updates the text of a task queue item: name and progress, estimated time or stats
+    ########################################
+    def update_item_text (self, taskItem):
+        task = taskItem.data(Qt.UserRole)
+        if task.state in (TASK_STATE_RUNNING, TASK_STATE_PAUSED):
+            # ffmpeg's own ETA only covers its current run, tasks may run it several times
+            t = self._history.get_remaining(task, time.time())
+            if t is None:
+                t = task.progress.get('eta')
+            info = f'{format_duration(t)} left' if t is not None else ''
+            if 'rate' in task.progress:
+                info = f'{task.progress["rate"]:.2f}x' + (', ' + info if info else '')
+            if 'out_time' in task.progress and task.duration:
+                info = f'{min(100, task.progress["out_time"] / task.duration * 100):.0f}%' + (', ' + info if info else '')
+        elif task.state == TASK_STATE_PENDING:
+            t = self._history.get_estimate(task)
+            info = f'~{format_duration(t)}' if t is not None else ''
+        else:
+            info = format_stats(task.stats) if task.stats else ''
+        taskItem.setText(f'{task.name}    [{info}]' if info else task.name)
 
     ########################################
     #
     ########################################
     def add_task (self, task):
+        self.add_tasks([task])
+
+    ########################################
+    #
+    ########################################
+    def add_tasks (self, tasks):
+        if self.checkBoxTaskQueueSkipUpToDate.isChecked():
+            # collapse identical tasks, tasks depending on a dropped one then depend on the identical task kept
+            fingerprints = {task.fingerprint or task.get_fingerprint(): task for task in self.get_tasks()}
+            new_tasks = []
+            kept = {}
+            for task in tasks:
+                fingerprint = task.get_fingerprint()
+                if fingerprint in fingerprints:
+                    kept[id(task)] = fingerprints[fingerprint]
+                else:
+                    fingerprints[fingerprint] = task
+                    new_tasks.append(task)
+            if kept:
+                for task in new_tasks:
+                    task.depends = [kept.get(id(d), d) for d in task.depends]
+                self.statusMessage.emit(f'{len(kept)} identical Task(s) were already in Task Queue')
+            tasks = new_tasks
+        self._journal.add_tasks(tasks)
+        for task in tasks:
+            self.add_task_item(task)
+        if self._taskQueueRunning and tasks:
+            self.run_next_tasks()
+        self.slot_update_eta()
+
+    ########################################
+    #
+    ########################################
+    def add_task_item (self, task):
         taskItem = QListWidgetItem()
-        taskItem.setText(task.name)
         taskItem.setData(Qt.UserRole, task)
+        self._tasksById[task.id] = task
         self.listWidgetTaskQueue.addItem(taskItem)
+        self.update_item(taskItem)
+        self.set_task_state(taskItem, task.state, False)
         self.pushButtonRunTaskQueue.setDisabled(False)
 
     ########################################
@@ -86,8 +478,8 @@ class TaskManager(QWidget):
         self.pushButtonRunTaskQueue.setDisabled(running)
         self.pushButtonStopTaskQueue.setDisabled(not running)
 
-        # deactivate task queue widgets
-        self.listWidgetTaskQueue.setDisabled(running)
+        # the queue stays accessible for changing priorities and pausing tasks, but can't be reordered
+        self.listWidgetTaskQueue.setDragDropMode(QAbstractItemView.NoDragDrop if running else QAbstractItemView.InternalMove)
 
         self.pushButtonTaskAdd.setDisabled(running)
         self.pushButtonTaskDelete.setDisabled(running)
@@ -100,7 +492,15 @@ class TaskManager(QWidget):
         # @todo: check if queue is running
         row = self.listWidgetTaskQueue.currentRow()
         if row >= 0:
-            self.listWidgetTaskQueue.takeItem(row)
+            taskItem = self.listWidgetTaskQueue.takeItem(row)
+            task = taskItem.data(Qt.UserRole)
+            self._tasksById.pop(task.id, None)
+            self._journal.delete_task(task)
+            delete_log_file(task)
+            for i in range(self.listWidgetTaskQueue.count()):
+                item = self.listWidgetTaskQueue.item(i)
+                if task.id in item.data(Qt.UserRole).depends:
+                    self.set_depends(item, [task_id for task_id in item.data(Qt.UserRole).depends if task_id != task.id])
             if self.listWidgetTaskQueue.count() == 0:
                 self.pushButtonRunTaskQueue.setDisabled(True)
 
@@ -109,30 +509,160 @@ class TaskManager(QWidget):
     ########################################
     def slot_task_clear (self):
         # @todo: check if queue is running
+        for task in self.get_tasks():
+            delete_log_file(task)
         self.listWidgetTaskQueue.clear()
+        self._tasksById.clear()
+        self._journal.clear()
         self.pushButtonRunTaskQueue.setDisabled(True)
 
+    ########################################
+    #
+    ########################################
+    def slot_task_context_menu (self, p):
+        taskItem = self.listWidgetTaskQueue.itemAt(p)
+        if taskItem is None:
+            return
+        task = taskItem.data(Qt.UserRole)
+        m = QMenu()
+        if not IS_WIN:
+            action = QAction(m)
+            action.setText('&Pause')
+            action.setEnabled(task.state == TASK_STATE_RUNNING)
+            action.triggered.connect(lambda: self.pause_task(taskItem))
+            m.addAction(action)
+            action = QAction(m)
+            action.setText('&Resume')
+            action.setEnabled(task.state == TASK_STATE_PAUSED)
+            action.triggered.connect(lambda: self.resume_task(taskItem))
+            m.addAction(action)
+        menuPriority = m.addMenu('P&riority')
+        for priority, name in TASK_PRIORITY_NAMES.items():
+            action = QAction(menuPriority)
+            action.setText(name)
+            action.setCheckable(True)
+            action.setChecked(task.priority == priority)
+            action.triggered.connect(lambda checked, priority=priority: self.set_priority(taskItem, priority))
+            menuPriority.addAction(action)
+        m.addSeparator()
+        action = QAction(m)
+        action.setText('Set &Dependencies...')
+        action.triggered.connect(lambda: self.slot_task_dependencies(taskItem))
+        m.addAction(action)
+        action = QAction(m)
+        action.setText('&Clear Dependencies')
+        action.setEnabled(len(taskItem.data(Qt.UserRole).depends) > 0)
+        action.triggered.connect(lambda: self.set_depends(taskItem, []))
+        m.addAction(action)
+        m.addSeparator()
+        action = QAction(m)
+        action.setText('Show &Log...')
+        action.setEnabled(os.path.isfile(get_log_file(task)))
+        action.triggered.connect(lambda: LogViewer(get_log_file(task), task.name, self).show())
+        m.addAction(action)
+        m.exec_(self.listWidgetTaskQueue.mapToGlobal(p))
+
+    ########################################
+    # Lets the user select the tasks that have to be done before task item's task is run
+    ########################################
+    def slot_task_dependencies (self, taskItem):
+        task = taskItem.data(Qt.UserRole)
+        # tasks depending on this task are excluded to prevent cycles
+        excluded = self.get_dependents(task)
+        excluded.add(task.id)
+
+        dialog = QDialog(self)
+        dialog.setWindowTitle('Task Dependencies')
+        layout = QVBoxLayout(dialog)
+        layout.addWidget(QLabel(f'Run "{task.name}" after:', dialog))
+        listWidget = QListWidget(dialog)
+        for t in self.get_tasks():
+            if t.id in excluded:
+                continue
+            item = QListWidgetItem(t.name)
+            item.setData(Qt.UserRole, t.id)
+            item.setCheckState(Qt.Checked if t.id in task.depends else Qt.Unchecked)
+            listWidget.addItem(item)
+        layout.addWidget(listWidget)
+        buttonBox = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, dialog)
+        buttonBox.accepted.connect(dialog.accept)
+        buttonBox.rejected.connect(dialog.reject)
+        layout.addWidget(buttonBox)
+        if dialog.exec() != QDialog.Accepted:
+            return
+        depends = []
+        for row in range(listWidget.count()):
+            item = listWidget.item(row)
+            if item.checkState() == Qt.Checked:
+                depends.append(item.data(Qt.UserRole))
+        self.set_depends(taskItem, depends)
+
+    ########################################
+    #
+    ########################################
+    def set_depends (self, taskItem, depends):
+        task = taskItem.data(Qt.UserRole)
+        task.depends = depends
+        self._journal.update_depends(task)
+        self.update_item(taskItem)
+
+    ########################################
+    #
+    ########################################
+    def slot_task_moved (self):
+        self._journal.set_order(self.get_tasks())
+
     ########################################
     #
     ########################################
     def slot_run_task_queue (self):
         self.statusMessage.emit('')
         self.outputClear.emit()  # ???
+
+        # resume an unfinished queue by resetting all items except successful ones,
+        # a completely successful queue is run again from scratch
+        items = [self.listWidgetTaskQueue.item(row) for row in range(self.listWidgetTaskQueue.count())]
+        if all(taskItem.data(Qt.UserRole).state in TASK_STATES_DONE for taskItem in items):
+            reset_items = items
+        else:
+            reset_items = [taskItem for taskItem in items if taskItem.data(Qt.UserRole).state not in TASK_STATES_DONE]
+        for taskItem in reset_items:
+            self.set_task_state(taskItem, TASK_STATE_PENDING, False)
+            self.update_item(taskItem)
+        self._journal.update_tasks([taskItem.data(Qt.UserRole) for taskItem in reset_items])
+        self.run_pending_tasks()
+
+    ########################################
+    # Runs the pending tasks, unlike "Run Task Queue" failed or stopped tasks are left alone
+    ########################################
+    def run_pending_tasks (self):
+        if self._taskQueueRunning:
+            self.run_next_tasks()
+            return
         self._taskQueueFailures = 0
+        self._taskQueueSkipped = 0
         self._taskQueueRunning = True
+        self._taskQueueAborted = False
+        self._agentsDown.clear()
         self.update_ui(True)
-
-        # get and run first task in queue
-        self._taskQueueCurrentIndex = 0
-        self.run_task(self.listWidgetTaskQueue.item(0).data(Qt.UserRole))
+        self._history.reset_run()
+        self._statsTimer.start()
+        self._etaTimer.start()
+        self.run_next_tasks()
 
     ########################################
     #
     ########################################
     def slot_stop_task_queue (self):
         self._taskQueueRunning = False
-        if self._proc.state() != QProcess.NotRunning:
-            self._proc.kill()
+        self._statsTimer.stop()
+        self._etaTimer.stop()
+        self._taskQueueAborted = True
+        self._running.update(self._paused)
+        self._paused.clear()
+        # processes that don't quit are killed by timers, so the GUI doesn't block
+        for proc in list(self._running):
+            proc.stop()
         self.update_ui(False)
         self.outputMessage.emit('\nTask Queue was stopped by User.')
 
@@ -142,44 +672,210 @@ class TaskManager(QWidget):
     def slot_task_queue_stop_on_error_clicked (self, checked):
         self._taskQueueStopOnError = checked
 
+    ########################################
+    #
+    ########################################
+    def slot_max_jobs_changed (self, value):
+        self._state.setValue('TaskQueue/MaxJobs', value)
+        if self._taskQueueRunning:
+            self.run_next_tasks()
+
+    ########################################
+    #
+    ########################################
+    def slot_resource_limits_changed (self):
+        self._state.setValue('TaskQueue/ResourceLimits', self.lineEditResourceLimits.text())
+        if self._taskQueueRunning:
+            self.run_next_tasks()
+
+    ########################################
+    #
+    ########################################
+    def slot_agents_changed (self):
+        self._state.setValue('TaskQueue/Agents', self.lineEditAgents.text())
+        if self._taskQueueRunning:
+            self.run_next_tasks()
+
     ########################################
     #
     ########################################
     def slot_task_queue_finished (self):
-        msg = f'Task Queue Finished ({self._taskQueueFailures} Tasks failed)'
+        self._taskQueueRunning = False
+        self._statsTimer.stop()
+        self._etaTimer.stop()
+        self.slot_update_eta()
+        msg = f'Task Queue Finished ({self._taskQueueFailures} Tasks failed, {self._taskQueueSkipped} up-to-date Tasks skipped)'
         self.statusMessage.emit(msg)
         self.outputMessage.emit(msg)
         self.update_ui(False)
 
+    ########################################
+    # Updates the estimated time of the queue and the remaining times of running tasks
+    ########################################
+    def slot_update_eta (self):
+        now = time.time()
+        running = []
+        pending = []
+        unknown = 0
+        for taskItem in list(self._running.values()) + list(self._paused.values()):
+            self.update_item(taskItem)
+            t = self._history.get_remaining(taskItem.data(Qt.UserRole), now)
+            if t is None:
+                unknown += 1
+            elif taskItem in self._running.values():
+                running.append(t)
+            else:
+                pending.append(t)
+        if self._estimatesChanged:
+            self._estimatesChanged = False
+            for row in range(self.listWidgetTaskQueue.count()):
+                taskItem = self.listWidgetTaskQueue.item(row)
+                if taskItem.data(Qt.UserRole).state == TASK_STATE_PENDING:
+                    self.update_item_text(taskItem)
+        tasks = [task for task in self.get_tasks() if task.state == TASK_STATE_PENDING]
+        tasks.sort(key=lambda task: -task.priority)
+        for task in tasks:
+            t = self._history.get_estimate(task)
+            if t is None:
+                unknown += 1
+            else:
+                pending.append(t)
+        if not running and not pending:
+            self.labelEta.setText(f'{unknown} Task(s) without estimated time' if unknown else '')
+            return
+        eta = get_queue_eta(running, pending, self.spinBoxMaxJobs.value())
+        s = f'Estimated time: {format_duration(eta)} (done at {time.strftime("%H:%M", time.localtime(now + eta))})'
+        if unknown:
+            s += f', {unknown} Task(s) without estimated time'
+        self.labelEta.setText(s)
+
+    ########################################
+    # Progress block of a running task's ffmpeg, see progress.py
+    ########################################
+    def slot_progress (self, info):
+        taskItem = self._progressItems.get(self.sender())
+        if taskItem is None:
+            return
+        task = taskItem.data(Qt.UserRole)
+        if info['end'] and task.duration:
+            info = dict(info, out_time=task.duration)
+        task.progress = info
+        self.update_item(taskItem)
+
+    ########################################
+    #
+    ########################################
+    def end_progress (self, taskItem):
+        for obj, item in list(self._progressItems.items()):
+            if item is taskItem:
+                del self._progressItems[obj]
+                if isinstance(obj, TaskProgress):
+                    obj.close()
+                    obj.deleteLater()
+        taskItem.data(Qt.UserRole).progress_url = None
+
+    ########################################
+    # Keeps track of the peak memory usage of the running tasks' process trees
+    ########################################
+    def slot_sample_stats (self):
+        items = {proc.processId(): taskItem for proc, taskItem in self._running.items() if proc.processId() > 0}
+        for pid, rss in get_tree_rss(list(items)).items():
+            task = items[pid].data(Qt.UserRole)
+            task.stats['rss'] = max(task.stats.get('rss', 0), rss)
+
     ########################################
     #
     ########################################
     def slot_stdout (self):
-        s = self._proc.readAllStandardOutput().data().decode()
-        self.outputMessage.emit(s)
+        self.write_output(self.sender(), self.sender().readAllStandardOutput().data())
 
     ########################################
     #
     ########################################
     def slot_stderr (self):
-        s = self._proc.readAllStandardError().data().decode()
-        self.outputMessage.emit(s)
+        self.write_output(self.sender(), self.sender().readAllStandardError().data())
+
+    ########################################
+    # Writes output of a worker process to the log file of its task and the output log
+    ########################################
+    def write_output (self, proc, data):
+        f = self._logFiles.get(proc)
+        if f is not None:
+            try:
+                f.write(data)
+            except OSError:
+                pass
+        self.outputMessage.emit(data.decode(errors='replace'))
+
+    ########################################
+    #
+    ########################################
+    def close_log_file (self, proc):
+        f = self._logFiles.pop(proc, None)
+        if f is not None:
+            f.close()
+
+    ########################################
+    # A process that failed to start never emits 'finished'.
+    # Tasks for agents that can't be reached are run elsewhere.
+    ########################################
+    def slot_error_occurred (self, err):
+        proc = self.sender()
+        if err == QProcess.FailedToStart and isinstance(proc, RemoteProcess) and proc in self._running:
+            taskItem = self._running.pop(proc)
+            self.end_progress(taskItem)
+            self.close_log_file(proc)
+            self._agentsDown.add(proc.program())
+            self.set_task_state(taskItem, TASK_STATE_PENDING)
+            self.outputMessage.emit(f'\nAgent {proc.program()} can\'t be reached, it\'s not used until the Task Queue is run again.')
+            proc.deleteLater()
+            if self._taskQueueRunning:
+                self.run_next_tasks()
+            return
+        if err == QProcess.FailedToStart and proc in self._running:
+            self.task_complete(proc, -1)
+        self.errorOccurred.emit(err)
 
     ########################################
     #
     ########################################
     def slot_complete (self, exitCode, exitStatus):
+        self.task_complete(self.sender(), exitCode if exitStatus == QProcess.NormalExit else -1)
+
+    ########################################
+    # Paused tasks can end too, e.g. if killed from outside or the agent connection drops
+    ########################################
+    def task_complete (self, proc, exitCode):
+        taskItem = self._running.pop(proc, None) or self._paused.pop(proc, None)
+        if taskItem is None:
+            return
+        self.end_progress(taskItem)
+        self.close_log_file(proc)
+        if isinstance(proc, RemoteProcess):
+            proc.deleteLater()
+        task = taskItem.data(Qt.UserRole)
+        task.exit_code = exitCode
+        task.finished = time.time()
+        task.read_stats()
+        task.stats['wall'] = round(task.finished - task.started, 3)
+
         # update task item color according to success state
-        taskItem = self.listWidgetTaskQueue.item(self._taskQueueCurrentIndex)
+        if not self._taskQueueRunning:
+            self.set_task_state(taskItem, TASK_STATE_STOPPED)
+            self.update_item(taskItem)
+            return
         if exitCode == 0:
-            taskItem.setBackground(QColor('#007F00'))
+            self.set_task_state(taskItem, TASK_STATE_SUCCEEDED)
+            self._journal.add_run(task.fingerprint, self.get_outputs(task), task.finished)
+            self._history.add_task(task)
+            # the estimates of all pending tasks are corrected by the observed speed,
+            # their items are updated with the next ETA update
+            self._estimatesChanged = True
         else:
-            taskItem.setBackground(QColor('#7F0000'))
+            self.set_task_state(taskItem, TASK_STATE_FAILED)
             self._taskQueueFailures += 1
-        if self._taskQueueCurrentIndex<self.listWidgetTaskQueue.count() - 1:
-            if exitCode == 0 or not self._taskQueueStopOnError:
-                self.run_next_task()
-            else:
-                self.slot_task_queue_finished()
-        else:
-            self.slot_task_queue_finished()
+            if self._taskQueueStopOnError:
+                # let tasks in other slots finish, but don't start new ones
+                self._taskQueueAborted = True
+        self.update_item(taskItem)
+        self.run_next_tasks()
@@ -0,0 +1,66 @@
+"""
+QMediaTool - task resources
+
+Resource lists like 'cpu-heavy:2, disk-io' map resource classes to weights,
+a class without weight has weight 1. Presets declare the resources their tasks
+use, the task queue only runs tasks in parallel as long as the summed weights
+of each class stay within that class's limit.
+"""
+
+import re
+
+from const import *
+
+RE_HW_ENCODER = re.compile(r'\$\{?(NVENCC|QSVENCC|VCEENCC)\b|_(nvenc|qsv|amf|videotoolbox|mf)\b')
+RE_NETWORK = re.compile(r'\$\{?(YT-DLP|URL)\b|://')
+RE_CPU_HEAVY = re.compile(r'\blib(x264|x265|vpx|vpx-vp9|aom|svtav1)\b|\$\{?CODECVIDEO\b|-crf\b|-vf\b|-filter_complex\b')
+
+
+########################################
+# Parses a resource list into a dict
+########################################
+def parse_resources (s):
+    res = {}
+    for part in s.split(','):
+        part = part.strip()
+        if part == '':
+            continue
+        name, _, weight = part.partition(':')
+        try:
+            res[name.strip()] = float(weight) if weight.strip() != '' else 1.0
+        except ValueError:
+            pass
+    return res
+
+
+########################################
+# Formats a resource dict as resource list
+########################################
+def format_resources (res):
+    return ', '.join(f'{k}:{v:g}' for k, v in res.items())
+
+
+########################################
+# Guesses the resources of presets that don't declare any
+########################################
+def guess_resources (code, input_type=INPUT_TYPE_FILE):
+    if RE_HW_ENCODER.search(code):
+        return {'hw-encoder': 1.0}
+    if input_type == INPUT_TYPE_URL or RE_NETWORK.search(code):
+        return {'network': 1.0}
+    if RE_CPU_HEAVY.search(code):
+        return {'cpu-heavy': 1.0}
+    # remuxing, tagging, audio conversion etc.
+    return {'disk-io': 1.0}
+
+
+########################################
+# Checks if resources can be allocated in addition to the resources in use
+# without exceeding the limits. A class that is not in use at all is always
+# available, so tasks heavier than a limit still get run, just not in parallel.
+########################################
+def fits_limits (resources, in_use, limits):
+    for k, v in resources.items():
+        if k in limits and in_use.get(k, 0) > 0 and in_use[k] + v > limits[k]:
+            return False
+    return True
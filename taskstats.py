@@ -0,0 +1,118 @@
+"""
+QMediaTool - task resource accounting
+
+When a task's shell exits, it writes the CPU times of itself and its children
+(bash builtin 'times') and, on Linux, its IO counters, which include those of
+its children, to a stats file. The peak memory usage of the task's process
+tree is sampled while it's running.
+"""
+
+import os
+import re
+
+from PyQt5.QtCore import QProcess
+
+from const import *
+
+RE_TIMES = re.compile(r'(\d+)m(\d+[.,]?\d*)s')
+
+
+########################################
+# Returns bash code that writes the shell's stats to file fn on exit
+########################################
+def get_stats_trap (fn):
+    return f"trap 'times > \"{fn}\"; cat /proc/${{BASHPID:-$$}}/io >> \"{fn}\" 2>/dev/null' EXIT; "
+
+
+########################################
+# Reads and deletes a stats file, returns a dict with keys 'user' and 'sys'
+# (CPU seconds) and on Linux 'read' and 'write' (bytes read from/written to storage)
+########################################
+def read_stats_file (fn):
+    stats = {}
+    try:
+        with open(fn, 'r') as f:
+            s = f.read()
+        os.remove(fn)
+    except OSError:
+        return stats
+    # 2 lines (shell, children) with user and sys time each
+    times = [int(m) * 60 + float(sec.replace(',', '.')) for m, sec in RE_TIMES.findall(s)]
+    if len(times) == 4:
+        stats['user'] = round(times[0] + times[2], 3)
+        stats['sys'] = round(times[1] + times[3], 3)
+    for line in s.splitlines():
+        k, _, v = line.partition(':')
+        if k == 'read_bytes':
+            stats['read'] = int(v)
+        elif k == 'write_bytes':
+            stats['write'] = int(v)
+    return stats
+
+
+########################################
+# Returns the summed resident set size (KB) of the process trees of the given pids
+# as dict pid => rss, using a single call of ps (not supported on Windows)
+########################################
+def get_tree_rss (pids):
+    res = {}
+    if IS_WIN or not pids:
+        return res
+    proc = QProcess()
+    proc.start('ps', ['-A', '-o', 'pid=', '-o', 'ppid=', '-o', 'rss='])
+    if not proc.waitForFinished(3000):
+        return res
+    children = {}
+    rss = {}
+    for line in proc.readAllStandardOutput().data().decode().splitlines():
+        cols = line.split()
+        if len(cols) != 3:
+            continue
+        pid, ppid, kb = (int(c) for c in cols)
+        children.setdefault(ppid, []).append(pid)
+        rss[pid] = kb
+    for pid in pids:
+        tree = [pid]
+        i = 0
+        while i < len(tree):
+            tree.extend(children.get(tree[i], []))
+            i += 1
+        res[pid] = sum(rss.get(p, 0) for p in tree)
+    return res
+
+
+########################################
+#
+########################################
+def format_bytes (n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024:
+            return f'{n:.0f} {unit}' if unit == 'B' else f'{n:.1f} {unit}'
+        n /= 1024
+    return f'{n:.1f} TB'
+
+
+########################################
+# Formats task stats (dict with keys 'wall', 'user', 'sys', 'rss', 'read', 'write')
+# as short summary, or detailed with one line per value
+########################################
+def format_stats (stats, detailed=False):
+    parts = []
+    wall = stats.get('wall')
+    cpu = stats['user'] + stats['sys'] if 'user' in stats else None
+    if wall is not None:
+        parts.append(f'Wall time: {wall:.1f}s' if detailed else f'{wall:.1f}s')
+    if cpu is not None:
+        if detailed:
+            load = f' ({cpu / wall * 100:.0f}% load)' if wall else ''
+            parts.append(f'CPU time: {cpu:.1f}s{load}, user {stats["user"]:.1f}s, sys {stats["sys"]:.1f}s')
+        else:
+            parts.append(f'CPU {cpu / wall * 100:.0f}%' if wall else f'CPU {cpu:.1f}s')
+    if 'rss' in stats:
+        parts.append(('Peak memory: ' if detailed else '') + format_bytes(stats['rss'] * 1024))
+    if 'read' in stats:
+        if detailed:
+            parts.append(f'Storage read: {format_bytes(stats["read"])}, written: {format_bytes(stats["write"])}')
+        else:
+            parts.append(f'R {format_bytes(stats["read"])} / W {format_bytes(stats["write"])}')
+    return '\n'.join(parts) if detailed else ', '.join(parts)
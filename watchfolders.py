@@ -0,0 +1,453 @@
+"""
+QMediaTool - watch folders
+
+Files dropped into a watch folder (or any of its subfolders) are added to the
+task queue with the preset mapped to that folder, as soon as their size and
+modification time stopped changing. Folders are watched by QFileSystemWatcher
+(inotify on Linux), folders it can't watch are polled.
+"""
+
+import os
+import time
+
+from PyQt5.QtCore import *
+from PyQt5.QtWidgets import *
+
+from const import *
+from task import Task
+from taskjournal import TaskJournal
+from presets import get_preset
+from taskresources import parse_resources, guess_resources
+from taskenv import build_task_env, get_media_duration
+from mediaprobe import MediaProbePool
+
+
+class WatchFolders (QObject):
+
+    statusMessage = pyqtSignal(str)
+
+    ########################################
+    #
+    ########################################
+    def __init__ (self, taskManager, presets_db):
+        super().__init__()
+        self._taskManager = taskManager
+        self._presets_db = presets_db
+        self._state = QSettings('fx', APP_NAME)
+
+        # files that were already added to the task queue, path => (size, mtime_ns)
+        self._journal = TaskJournal(DATA_DIR + '/taskqueue.db')
+        self._ingested = self._journal.get_ingested()
+
+        self._folders = []
+        self._dirs = set()     # all known folders
+        self._polled = set()   # folders the watcher couldn't watch
+        self._dirty = set()    # folders that have to be scanned
+        self._scan = None      # scan of the folder being scanned, see scan_dir
+        self._pending = {}     # new files, path => [folder, size, mtime_ns, unchanged since]
+        self._checks = []      # pending files left to check in the current round
+        self._probing = {}     # files with stable size being probed, path => folder
+        self._ready = []       # probed files, [(path, folder, media info)]
+
+        # files are probed in the background, so neither bursts of new files nor files
+        # that hang the probe tool block the UI
+        self._probes = MediaProbePool(parent=self)
+        self._probes.probed.connect(self.slot_probed)
+
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self.slot_directory_changed)
+
+        # bursts of change notifications are collected and scanned at once
+        self._scanTimer = QTimer(self)
+        self._scanTimer.setSingleShot(True)
+        self._scanTimer.setInterval(200)
+        self._scanTimer.timeout.connect(self.slot_scan)
+
+        self._checkTimer = QTimer(self)
+        self._checkTimer.setInterval(1000)
+        self._checkTimer.timeout.connect(self.slot_check_pending)
+
+        # scanning and checking files is done in time slices (INPUT_SCAN_SLICE) like adding
+        # input files, so folders with many files (e.g. polled network shares) don't block
+        # the UI. These timers continue them with the next event loop iteration.
+        self._scanSliceTimer = QTimer(self)
+        self._scanSliceTimer.setSingleShot(True)
+        self._scanSliceTimer.setInterval(0)
+        self._scanSliceTimer.timeout.connect(self.slot_scan)
+
+        self._checkSliceTimer = QTimer(self)
+        self._checkSliceTimer.setSingleShot(True)
+        self._checkSliceTimer.setInterval(0)
+        self._checkSliceTimer.timeout.connect(self.slot_check_pending)
+
+        self._pollTimer = QTimer(self)
+        self._pollTimer.setInterval(WATCH_POLL_INTERVAL)
+        self._pollTimer.timeout.connect(self.slot_poll)
+
+        # new files are added in chunks, so the UI stays responsive
+        self._ingestTimer = QTimer(self)
+        self._ingestTimer.setInterval(0)
+        self._ingestTimer.timeout.connect(self.slot_ingest)
+
+        self.load_settings()
+        if self.is_enabled():
+            self.start()
+
+    ########################################
+    # Loads the folder list, a list of dicts with keys 'folder', 'preset' (id) and 'output_dir'
+    ########################################
+    def load_settings (self):
+        self._folders = []
+        cnt = self._state.beginReadArray('WatchFolders/Folders')
+        for i in range(cnt):
+            self._state.setArrayIndex(i)
+            self._folders.append({
+                'folder': self._state.value('Folder', ''),
+                'preset': int(self._state.value('Preset', 0)),
+                'output_dir': self._state.value('OutputDir', ''),
+            })
+        self._state.endArray()
+
+    ########################################
+    #
+    ########################################
+    def save_settings (self):
+        self._state.beginWriteArray('WatchFolders/Folders', len(self._folders))
+        for i in range(len(self._folders)):
+            self._state.setArrayIndex(i)
+            self._state.setValue('Folder', self._folders[i]['folder'])
+            self._state.setValue('Preset', self._folders[i]['preset'])
+            self._state.setValue('OutputDir', self._folders[i]['output_dir'])
+        self._state.endArray()
+
+    ########################################
+    #
+    ########################################
+    def is_enabled (self):
+        return self._state.value('WatchFolders/Enabled', 'false') == 'true'
+
+    ########################################
+    #
+    ########################################
+    def is_auto_run (self):
+        return self._state.value('WatchFolders/AutoRun', 'false') == 'true'
+
+    ########################################
+    #
+    ########################################
+    def start (self):
+        self.stop()
+        for entry in self._folders:
+            if os.path.isdir(entry['folder']):
+                self.add_dir(entry['folder'])
+            else:
+                self.statusMessage.emit(f'Watch folder not found: {entry["folder"]}')
+        self._scanTimer.start()
+        self._checkTimer.start()
+        self._pollTimer.start()
+
+    ########################################
+    #
+    ########################################
+    def stop (self):
+        for timer in (self._scanTimer, self._scanSliceTimer, self._checkTimer, self._checkSliceTimer,
+                self._pollTimer, self._ingestTimer):
+            timer.stop()
+        if self._watcher.directories():
+            self._watcher.removePaths(self._watcher.directories())
+        self._dirs.clear()
+        self._polled.clear()
+        self._dirty.clear()
+        self._scan = None
+        self._pending.clear()
+        self._checks.clear()
+        self._probes.clear()
+        self._probing.clear()
+        self._ready.clear()
+
+    ########################################
+    #
+    ########################################
+    def quit (self):
+        self.stop()
+        self._journal.close()
+
+    ########################################
+    # Returns the folder list entry that folder or file path belongs to
+    ########################################
+    def get_entry (self, path):
+        best = None
+        for entry in self._folders:
+            folder = os.path.normpath(entry['folder'])
+            if path == folder or path.startswith(folder + os.sep):
+                if best is None or len(folder) > len(os.path.normpath(best['folder'])):
+                    best = entry
+        return best
+
+    ########################################
+    # Returns the output folder of entry, by default subfolder "output" of the watch folder
+    ########################################
+    def get_output_dir (self, entry):
+        return entry['output_dir'] or os.path.join(entry['folder'], 'output')
+
+    ########################################
+    # Starts watching folder d, and marks it to be scanned
+    ########################################
+    def add_dir (self, d):
+        d = os.path.normpath(d)
+        if d in self._dirs:
+            return
+        self._dirs.add(d)
+        if not self._watcher.addPath(d):
+            self._polled.add(d)
+        self._dirty.add(d)
+
+    ########################################
+    #
+    ########################################
+    def remove_dir (self, d):
+        self._dirs.discard(d)
+        self._polled.discard(d)
+        self._watcher.removePath(d)
+
+    ########################################
+    # Scans folder d for new files and subfolders, yields after each entry
+    ########################################
+    def scan_dir (self, d):
+        entry = self.get_entry(d)
+        preset = get_preset(self._presets_db, entry['preset']) if entry else None
+        if preset is None:
+            return
+        exts = [ext.strip().lower() for ext in preset['ext'].split(',') if ext.strip() not in ('', '*')]
+        # outputs must not be fed back into the watch folder
+        output_dirs = set(os.path.normpath(self.get_output_dir(e)) for e in self._folders)
+        now = time.time()
+        try:
+            with os.scandir(d) as it:
+                for e in it:
+                    yield
+                    if e.name.startswith('.'):
+                        continue  # hidden files, and temp files of many copy tools
+                    # symlinked folders aren't followed, they could form loops
+                    if e.is_dir(follow_symlinks=False):
+                        if not e.path in output_dirs:
+                            self.add_dir(e.path)
+                        continue
+                    if not e.is_file():
+                        continue
+                    if exts and not os.path.splitext(e.name)[1][1:].lower() in exts:
+                        continue
+                    if e.path in self._pending:
+                        continue
+                    st = e.stat()
+                    if self._ingested.get(e.path) == (st.st_size, st.st_mtime_ns):
+                        continue
+                    self._pending[e.path] = [entry, st.st_size, st.st_mtime_ns, now]
+        except OSError:
+            # folder was deleted or can't be read anymore
+            self.remove_dir(d)
+
+    ########################################
+    # Returns a new task for file fn with media info info
+    ########################################
+    def get_task (self, fn, preset, entry, info):
+        code = preset['cmd'].strip(' \t\n')
+        env = build_task_env(preset, [fn], [info], {'OUTPUTDIR': self.get_output_dir(entry)})
+        os.makedirs(env['OUTPUTDIR'], exist_ok=True)
+        task = Task(code, env, f'{preset["name"].strip()} ({os.path.basename(fn)})')
+        task.preset = preset['name'].strip()
+        task.duration = get_media_duration([info], env)
+        if preset['resources'] != '':
+            task.resources = parse_resources(preset['resources'])
+        else:
+            task.resources = guess_resources(code, preset['input_type'])
+        return task
+
+    ########################################
+    #
+    ########################################
+    def slot_directory_changed (self, d):
+        self._dirty.add(os.path.normpath(d))
+        if not self._scanTimer.isActive():
+            self._scanTimer.start()
+
+    ########################################
+    #
+    ########################################
+    def slot_scan (self):
+        # scanning can find new subfolders, which are scanned in the same run
+        deadline = time.monotonic() + INPUT_SCAN_SLICE
+        while time.monotonic() < deadline:
+            if self._scan is None:
+                if not self._dirty:
+                    return
+                self._scan = self.scan_dir(self._dirty.pop())
+            try:
+                next(self._scan)
+            except StopIteration:
+                self._scan = None
+        self._scanSliceTimer.start()
+
+    ########################################
+    #
+    ########################################
+    def slot_poll (self):
+        self._dirty.update(self._polled)
+        self.slot_scan()
+
+    ########################################
+    # Starts probing new files whose size and mtime didn't change for WATCH_STABLE_SECS
+    ########################################
+    def slot_check_pending (self):
+        if not self._checks:
+            self._checks = list(self._pending)
+        now = time.time()
+        deadline = time.monotonic() + INPUT_SCAN_SLICE
+        while self._checks and time.monotonic() < deadline:
+            path = self._checks.pop()
+            p = self._pending.get(path)
+            if p is None:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self._pending[path]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (p[1], p[2]) or st.st_size == 0:
+                p[1], p[2], p[3] = st.st_size, st.st_mtime_ns, now
+            elif now - p[3] >= WATCH_STABLE_SECS:
+                del self._pending[path]
+                self._probing[path] = p[0]
+                self._probes.probe(path)
+        if self._checks:
+            self._checkSliceTimer.start()
+
+    ########################################
+    # Moves a probed file to the ready list
+    ########################################
+    def slot_probed (self, fn, info):
+        entry = self._probing.pop(fn, None)
+        if entry is None:
+            return
+        if info is None:
+            self.statusMessage.emit(f'Watch folder: adding "{fn}" failed: probing failed')
+            return
+        self._ready.append((fn, entry, info))
+        if not self._ingestTimer.isActive():
+            self._ingestTimer.start()
+
+    ########################################
+    # Adds the next chunk of ready files to the task queue
+    ########################################
+    def slot_ingest (self):
+        chunk = self._ready[:WATCH_INGEST_CHUNK]
+        del self._ready[:WATCH_INGEST_CHUNK]
+        if not self._ready:
+            self._ingestTimer.stop()
+        tasks = []
+        ingested = []
+        for path, entry, info in chunk:
+            try:
+                st = os.stat(path)
+                preset = get_preset(self._presets_db, entry['preset'])
+                if preset is None:
+                    continue
+                tasks.append(self.get_task(path, preset, entry, info))
+            except (OSError, ValueError, KeyError, IndexError) as e:
+                self.statusMessage.emit(f'Watch folder: adding "{path}" failed: {e}')
+                continue
+            ingested.append((path, st.st_size, st.st_mtime_ns))
+        if not ingested:
+            return
+        self._taskManager.add_tasks(tasks)
+        self._journal.add_ingested(ingested)
+        for path, size, mtime_ns in ingested:
+            self._ingested[path] = (size, mtime_ns)
+        waiting = len(self._ready) + len(self._probing)
+        self.statusMessage.emit(f'{len(tasks)} file(s) from watch folders added to Task Queue'
+                + (f', {waiting} waiting' if waiting else ''))
+        if self.is_auto_run():
+            self._taskManager.run_pending_tasks()
+
+    ########################################
+    # Shows the watch folders dialog
+    ########################################
+    def edit (self, parent):
+        dialog = QDialog(parent)
+        dialog.setWindowTitle('Watch Folders')
+        dialog.resize(800, 300)
+        layout = QVBoxLayout(dialog)
+
+        checkBoxEnabled = QCheckBox('&Watch folders', dialog)
+        checkBoxEnabled.setChecked(self.is_enabled())
+        layout.addWidget(checkBoxEnabled)
+
+        c = self._presets_db.cursor()
+        sql = "SELECT id, name FROM presets WHERE input_type IN (?,?) ORDER BY name"
+        c.execute(sql, (INPUT_TYPE_FILE, INPUT_TYPE_FILES))
+        presets = [(row['id'], row['name'].strip()) for row in c.fetchall()]
+
+        tableWidget = QTableWidget(0, 3, dialog)
+        tableWidget.setHorizontalHeaderLabels(['Folder', 'Preset', 'Output Folder (default: <Folder>/output)'])
+        tableWidget.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        tableWidget.verticalHeader().hide()
+        layout.addWidget(tableWidget)
+
+        def add_row (entry):
+            row = tableWidget.rowCount()
+            tableWidget.insertRow(row)
+            tableWidget.setItem(row, 0, QTableWidgetItem(entry['folder']))
+            comboBox = QComboBox(tableWidget)
+            for preset_id, name in presets:
+                comboBox.addItem(name, preset_id)
+            comboBox.setCurrentIndex(max(0, comboBox.findData(entry['preset'])))
+            tableWidget.setCellWidget(row, 1, comboBox)
+            tableWidget.setItem(row, 2, QTableWidgetItem(entry['output_dir']))
+
+        def add_folder ():
+            d = QFileDialog.getExistingDirectory(dialog, 'Select Watch Folder')
+            if d:
+                add_row({'folder': d, 'preset': 0, 'output_dir': ''})
+
+        for entry in self._folders:
+            add_row(entry)
+
+        hbox = QHBoxLayout()
+        button = QPushButton('&Add Folder...', dialog)
+        button.clicked.connect(add_folder)
+        hbox.addWidget(button)
+        button = QPushButton('&Remove', dialog)
+        button.clicked.connect(lambda: tableWidget.removeRow(tableWidget.currentRow()))
+        hbox.addWidget(button)
+        hbox.addStretch()
+        checkBoxAutoRun = QCheckBox('Run Task Queue &automatically', dialog)
+        checkBoxAutoRun.setChecked(self.is_auto_run())
+        hbox.addWidget(checkBoxAutoRun)
+        layout.addLayout(hbox)
+
+        buttonBox = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, dialog)
+        buttonBox.accepted.connect(dialog.accept)
+        buttonBox.rejected.connect(dialog.reject)
+        layout.addWidget(buttonBox)
+
+        if dialog.exec() != QDialog.Accepted:
+            return
+
+        self._folders = []
+        for row in range(tableWidget.rowCount()):
+            folder = tableWidget.item(row, 0).text().strip()
+            comboBox = tableWidget.cellWidget(row, 1)
+            if folder == '' or comboBox.currentIndex() < 0:
+                continue
+            self._folders.append({
+                'folder': folder,
+                'preset': comboBox.currentData(),
+                'output_dir': tableWidget.item(row, 2).text().strip(),
+            })
+        self.save_settings()
+        self._state.setValue('WatchFolders/Enabled', 'true' if checkBoxEnabled.isChecked() else 'false')
+        self._state.setValue('WatchFolders/AutoRun', 'true' if checkBoxAutoRun.isChecked() else 'false')
+        if self.is_enabled():
+            self.start()
+        else:
+            self.stop()